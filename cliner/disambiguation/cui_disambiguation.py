@@ -3,7 +3,7 @@ import sys
 import os
 import pickle as pickle
 
-from features_dir.umls_dir.interpret_umls import obtain_concept_ids
+from features_dir.umls_dir.interpret_umls import obtain_concept_ids_concurrent
 
 sys.path.append((os.environ["CLINER_DIR"] + "/cliner/features_dir/umls_dir"))
 #sys.path.append((os.environ["CLINER_DIR"] + "/cliner/normalization/spellCheck"))
@@ -14,15 +14,20 @@ from umls_cache import UmlsCache
 pwl = None
 umls_cache = UmlsCache()
 
+# phrase -> concept id, shared by every note (for one set of cui frequencies)
+resolved_cuis = {}
+resolved_cui_freq = None
+
 
 def disambiguate(output, txtFile, cui_freq):
     """
     obtains concept ids for each phrase indicated by the span generated from prediction
     """
 
-    txtFile = open(txtFile, "r")
+    global resolved_cui_freq
 
-    txtFile = txtFile.read()
+    with open(txtFile, "r") as f:
+        txtFile = f.read()
 
     cuisToInsert = []
 
@@ -63,11 +68,19 @@ def disambiguate(output, txtFile, cui_freq):
 
     # perform cui lookup for all concepts detected in file
 
-    cuis = []
+    # phrases resolved for earlier notes are reused
+    if resolved_cui_freq is not cui_freq:
+        resolved_cuis.clear()
+        resolved_cui_freq = cui_freq
+
+    new_phrases = [phrase for phrase in set(phrases)
+                   if phrase not in resolved_cuis]
+
+    new_cuis = obtain_concept_ids_concurrent(
+        umls_cache, new_phrases, PyPwl=pwl, cui_freq=cui_freq)
+    resolved_cuis.update(zip(new_phrases, new_cuis))
 
-    for phrase in phrases:
-        cuis.append(obtain_concept_ids(
-            umls_cache, phrase, PyPwl=pwl, cui_freq=cui_freq))
+    cuis = [resolved_cuis[phrase] for phrase in phrases]
 
     for cui, cuiToInsert in zip(cuis, cuisToInsert):
         cuiToInsert["cui"] = cui
@@ -10,8 +10,11 @@ import os
 import sys
 import argparse
 import glob
+import bisect
+import multiprocessing
+import numpy as np
 from cliner import helper
-from copy import deepcopy
+from cliner import globals_cliner
 
 from cliner.notes.note import Note
 from cliner.notes.note import concept_labels as labels
@@ -41,37 +44,114 @@ def getConceptSpans(boundaries, classifications):
     conceptSpans = {}
 
     for lineIndex, span in enumerate(boundaries):
+
+        # (beginning, end) of the concept being read (None between concepts)
+        beginning = None
+        end = None
+
+        # one pass over the line: a 'B' opens a span, 'I's extend it
         for boundaryIndex, boundary in enumerate(span):
-            if boundary == 'B':
+            if boundary == 'I':
+                if beginning is not None:
+                    end = boundaryIndex
+                continue
 
-                concept = classifications[lineIndex][boundaryIndex]
-                beginning = boundaryIndex
-                end = boundaryIndex
+            if beginning is not None:
+                conceptSpans[lineIndex][(beginning, end)] = \
+                    classifications[lineIndex][beginning]
+                beginning = None
 
+            if boundary == 'B':
                 if lineIndex not in conceptSpans:
                     conceptSpans[lineIndex] = {}
+                beginning = boundaryIndex
+                end = boundaryIndex
 
-                for possibleEnd in span[boundaryIndex + 1:]:
-                    if possibleEnd == 'B' or possibleEnd == 'O':
-                        break
-                    if possibleEnd == 'I':
-                        end += 1
-
-                conceptSpans[lineIndex].update({(beginning, end): concept})
+        if beginning is not None:
+            conceptSpans[lineIndex][(beginning, end)] = \
+                classifications[lineIndex][beginning]
 
     return conceptSpans
 
 
-def evaluate(referenceSpans, predictedSpans, exactMatch=False, reportSeperately=False):
+class SpanSweep:
+    """
+    The predicted spans of one line, for matching against reference spans
 
-    # used to generate a dictionary of dictionaries
-    # of the form measuresForClasses["treatment"]["True Positives"] -> Number
-    # of True Positives for treatment classes
-    classes = [
-        "treatment",
-        "problem",
-        "test",
-    ]
+    Spans are kept in the order of the dict they came from, and can be
+    removed once matched. When they are sorted and disjoint (as
+    getConceptSpans() makes them), the spans overlapping a reference span
+    are found by binary search instead of scanning the whole line.
+    """
+
+    def __init__(self, spans):
+        self.spans = list(spans)
+        self.alive = [True] * len(self.spans)
+        self.position = {span: i for i, span in enumerate(self.spans)}
+
+        # sorted & disjoint -> starts and ends are both increasing
+        self.sorted = all(s[0] <= s[1] for s in self.spans) and \
+            all(a[1] < b[0] for a, b in zip(self.spans, self.spans[1:]))
+        self.starts = [s[0] for s in self.spans]
+        self.ends = [s[1] for s in self.spans]
+
+    def find(self, span):
+        """ index of an identical (not yet removed) span, or None """
+        i = self.position.get(span)
+        if (i is not None) and self.alive[i]:
+            return i
+        return None
+
+    def remove(self, i):
+        self.alive[i] = False
+
+    def remaining(self):
+        return [span for span, alive in zip(self.spans, self.alive) if alive]
+
+    def overlapping(self, span):
+        """ indices (in order) of the remaining spans that overlap span """
+        if self.sorted and span[0] <= span[1]:
+            j = bisect.bisect_left(self.ends, span[0])
+            while j < len(self.spans) and self.starts[j] <= span[1]:
+                if self.alive[j]:
+                    yield j
+                j += 1
+        else:
+            for j, pSpan in enumerate(self.spans):
+                if self.alive[j] and spanOverlap(span, pSpan):
+                    yield j
+
+    def longest(self, span, accept, length=None):
+        """
+        index of the longest remaining span with an endpoint inside span
+        (the first one on ties), whose index passes accept()
+
+        only spans longer than length count (None: any length)
+        """
+        best = None
+        for j in self.overlapping(span):
+            pSpan = self.spans[j]
+
+            # FIND LONGEST OVERLAP
+            if span[0] <= pSpan[0] <= span[1] or span[0] <= pSpan[1] <= span[1]:
+                if accept(j) and (length is None or length < (pSpan[1] - pSpan[0])):
+                    length = pSpan[1] - pSpan[0]
+                    best = j
+        return best
+
+
+def matchSpans(referenceSpans, predictedSpans, exactMatch=False):
+    """
+    matchSpans()
+
+    Purpose: Match reference against predicted concept spans
+
+    @param referenceSpans. line -> {(start,end) -> concept} of gold concepts
+    @param predictedSpans. line -> {(start,end) -> concept} of predictions
+    @param exactMatch.     whether spans must match exactly (or just overlap)
+    @return                (dict of True Positives/False Negatives/False
+                            Positives counts, confusion matrix)
+    """
 
     measures = {
         "True Positives": 0,
@@ -79,166 +159,171 @@ def evaluate(referenceSpans, predictedSpans, exactMatch=False, reportSeperately=
         "False Positives": 0
     }
 
-    confusion = [[0] * len(labels) for e in labels]
-
-    # TO DO: figure out how to report concepts seperately and have it work
-    # with reporting together as well.
+    # (reference label, predicted label) of every decision
+    actual = []
+    predicted = []
 
-    measuresForClasses = {classKey: deepcopy(
-        measures) for classKey in dict.fromkeys(classes)}
+    def count(measure, reference, prediction):
+        measures[measure] += 1
+        actual.append(labels[reference])
+        predicted.append(labels[prediction])
 
-    # falseNegs = []
+    leftover = []
 
     for line in referenceSpans:
 
-            # if the line does not exist for whatever reason for all spans on that line
-            # mark them as false negative
+        # if the line does not exist for whatever reason for all spans on that line
+        # mark them as false negative
         if line not in predictedSpans:
-            for spanNotInPredictedSpan in referenceSpans[line]:
-                classification = referenceSpans[line][spanNotInPredictedSpan]
-                measuresForClasses[classification]["False Negatives"] += 1
-                confusion[labels[classification]][labels['none']] += 1
+            for span, classInRefSpan in referenceSpans[line].items():
+                count("False Negatives", classInRefSpan, 'none')
             continue
 
-        if exactMatch:
+        classInPredSpans = predictedSpans[line]
+        sweep = SpanSweep(classInPredSpans)
 
-            for span in referenceSpans[line]:
+        if exactMatch:
 
-                classInRefSpan = referenceSpans[line][span]
+            for span, classInRefSpan in referenceSpans[line].items():
 
                 # if the span exists & concept matches, then true positive
-                if span in predictedSpans[line]:
-
-                    classInPredSpan = predictedSpans[line][span]
-
-                    if referenceSpans[line][span] == predictedSpans[line][span]:
-                        measuresForClasses[classInRefSpan][
-                            "True Positives"] += 1
+                j = sweep.find(span)
+                if j is not None:
+                    classInPredSpan = classInPredSpans[span]
+                    if classInRefSpan == classInPredSpan:
+                        count("True Positives", classInRefSpan, classInPredSpan)
                     else:
-                        measuresForClasses[classInRefSpan][
-                            "False Negatives"] += 1
-                    confusion[labels[classInRefSpan]][
-                        labels[classInPredSpan]] += 1
-                    predictedSpans[line].pop(span)
-
-                else:
-
-                    overlap = False
-                    for pSpan, v in list(predictedSpans[line].items()):
-                        # if containsSpan(span, pSpan):
-                        # or spanOverlap(pSpan,span):
-                        if spanOverlap(span, pSpan):
-                            overlap = True
+                        count("False Negatives", classInRefSpan, classInPredSpan)
+                    sweep.remove(j)
 
-                    if not overlap:
-                        measuresForClasses[classInRefSpan][
-                            "False Negatives"] += 1
-                        confusion[labels[classInRefSpan]][labels['none']] += 1
+                # overlapping (but not identical) spans are not counted here
+                elif next(sweep.overlapping(span), None) is None:
+                    count("False Negatives", classInRefSpan, 'none')
 
         else:
 
             # find true positives for inexact spans
-            accountedFor = {}
-            for span in referenceSpans[line]:
-
-                accountedFor[span] = False
-                classInRefSpan = referenceSpans[line][span]
-
-                longestMatchingSpanWithMatchingClassification = {
-                    "Predicted Span": None, "Predicted Span length": 0, "Predicted Concept": None}
-
-                for predictedSpan in predictedSpans[line]:
-
-                    classinPredSpan = predictedSpans[line][predictedSpan]
-
-                    # FIND LONGEST OVERLAP
-                    if predictedSpan[0] >= span[0] and predictedSpan[0] <= span[1] or predictedSpan[1] >= span[0] and predictedSpan[1] <= span[1]:
-                        # find longest span with match
-                        if classInRefSpan == classinPredSpan:
-                            try:
-                                if longestMatchingSpanWithMatchingClassification[
-                                        "Predicted Span length"] < (predictedSpan[1] - predictedSpan[0]):
-                                    longestMatchingSpanWithMatchingClassification[
-                                        "Predicted Span length"] = (predictedSpan[1] - predictedSpan[0])
-                                    longestMatchingSpanWithMatchingClassification[
-                                        "Predicted Concept"] = classinPredSpan
-                                    longestMatchingSpanWithMatchingClassification[
-                                        "Predicted Span"] = predictedSpan
-                            except TypeError:
-                                from IPython.core.debugger import Tracer  # NOQA
-                                Tracer()()
-
-                # if there is an overlapping concept match report true positive
-                if longestMatchingSpanWithMatchingClassification['Predicted Span'] is not None:
-                    accountedFor[span] = True
-                    measuresForClasses[classInRefSpan]["True Positives"] += 1
-                    confusion[labels[classInRefSpan]][
-                        labels[longestMatchingSpanWithMatchingClassification["Predicted Concept"]]] += 1
-                    predictedSpans[line].pop(
-                        longestMatchingSpanWithMatchingClassification["Predicted Span"])
+            unmatched = []
+            for span, classInRefSpan in referenceSpans[line].items():
+
+                def sameConcept(j):
+                    return classInPredSpans[sweep.spans[j]] == classInRefSpan
+
+                j = sweep.longest(span, sameConcept, length=0)
+                if j is not None:
+                    count("True Positives", classInRefSpan, classInRefSpan)
+                    sweep.remove(j)
+                else:
+                    unmatched.append((span, classInRefSpan))
 
             # find the false negatives for inexact spans
-            for span in referenceSpans[line]:
-                # already accounted for
-                if accountedFor[span]:
-                    continue
-
-                classInRefSpan = referenceSpans[line][span]
-
-                longestMatchingSpan = {
-                    "Predicted Span": None, "Predicted Span length": None, "Predicted Concept": None}
-                for predictedSpan in predictedSpans[line]:
-                    classinPredSpan = predictedSpans[line][predictedSpan]
-
-                    # FIND LONGEST OVERLAP
-                    if predictedSpan[0] >= span[0] and predictedSpan[0] <= span[1] \
-                       or predictedSpan[1] >= span[0] and predictedSpan[1] <= span[1]:
-
-                        if longestMatchingSpan["Predicted Span length"] < (predictedSpan[1] - predictedSpan[0]):
-                            longestMatchingSpan["Predicted Span length"] = (
-                                predictedSpan[1] - predictedSpan[0])
-                            longestMatchingSpan[
-                                "Predicted Concept"] = classinPredSpan
-                            longestMatchingSpan[
-                                "Predicted Span"] = predictedSpan
-
-                if longestMatchingSpan['Predicted Span'] is not None:
-                    measuresForClasses[classInRefSpan]["False Negatives"] += 1
-                    confusion[labels[classInRefSpan]][
-                        labels[longestMatchingSpan["Predicted Concept"]]] += 1
-                    predictedSpans[line].pop(
-                        longestMatchingSpan["Predicted Span"])
+            for span, classInRefSpan in unmatched:
+                j = sweep.longest(span, lambda j: True)
+                if j is not None:
+                    count("False Negatives", classInRefSpan,
+                          classInPredSpans[sweep.spans[j]])
+                    sweep.remove(j)
                 else:
-                    measuresForClasses[classInRefSpan]["False Negatives"] += 1
-                    confusion[labels[classInRefSpan]][labels['none']] += 1
-                    # predictedSpans[line].pop(span)
+                    count("False Negatives", classInRefSpan, 'none')
+
+        leftover += [classInPredSpans[span] for span in sweep.remaining()]
+
+    # predicted lines that have no reference spans at all
+    for line in predictedSpans:
+        if line not in referenceSpans:
+            leftover += list(predictedSpans[line].values())
 
     # for all the spans that are in predicted that are left. these are false positives
     # as they do not occur in the reference spans.
-    leftover = deepcopy(predictedSpans)
-    for line in predictedSpans:
-        for span in predictedSpans[line]:
+    for classInPredSpan in leftover:
+        count("False Positives", 'none', classInPredSpan)
+
+    # accumulate the confusion matrix in one go
+    n = len(labels)
+    cells = np.asarray(actual, dtype=int) * n + np.asarray(predicted, dtype=int)
+    confusion = np.bincount(cells, minlength=n * n).reshape(n, n)
 
-            classInPredSpan = predictedSpans[line][span]
+    return measures, confusion
 
-            if True:
-                measuresForClasses[classInPredSpan]["False Positives"] += 1
-                confusion[labels['none']][labels[classInPredSpan]] += 1
-                leftover[line].pop(span)
+
+def evaluate(referenceSpans, predictedSpans, exactMatch=False, reportSeperately=False):
+
+    measures, confusion = matchSpans(referenceSpans, predictedSpans, exactMatch)
 
     # if false then do not report concepts
     if not reportSeperately:
-        truePositive = 0
-        falseNegative = 0
-        falsePositive = 0
-        for dictKey in measuresForClasses:
-            truePositive += measuresForClasses[dictKey]["True Positives"]
-            falseNegative += measuresForClasses[dictKey]["False Negatives"]
-            falsePositive += measuresForClasses[dictKey]["False Positives"]
-
-        return {"True Positives": truePositive, "False Negatives": falseNegative, "False Positives": falsePositive}
+        return measures
+    else:
+        return confusion.tolist()
+
+
+def evaluateFile(job):
+    """
+    evaluateFile()
+
+    Purpose: Evaluate the predictions for one file (exact and inexact spans)
+
+    @param job. (txt, annotations, gold, format) file paths and data format
+    @return     ((exact measures, exact confusion),
+                 (inexact measures, inexact confusion))
+    """
+    txt, annotations, gold, format = job
+
+    # Read predictions and gols standard data
+    cnote = Note(format)
+    rnote = Note(format)
+    cnote.read(txt, annotations)
+    rnote.read(txt, gold)
+
+    referenceSpans = getConceptSpans(rnote.getIOBLabels(), rnote.conlist())
+    predictedSpans = getConceptSpans(cnote.getIOBLabels(), cnote.conlist())
+
+    return (matchSpans(referenceSpans, predictedSpans, exactMatch=True),
+            matchSpans(referenceSpans, predictedSpans, exactMatch=False))
+
+
+def evaluateFiles(files, format, processes=1):
+    """
+    evaluateFiles()
+
+    Purpose: Evaluate many files (in parallel), summing up the results
+
+    @param files.     list of (txt, predictions, gold) file paths
+    @param format.    data format of the files
+    @param processes. number of processes to evaluate with
+    @return           ((exact measures, exact confusion),
+                       (inexact measures, inexact confusion))
+    """
+    jobs = [(txt, annotations, gold, format) for txt, annotations, gold in files]
+
+    if processes > 1:
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        try:
+            results = pool.imap_unordered(evaluateFile, jobs, chunksize=16)
+            totals = sumResults(results)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        return confusion
+        totals = sumResults(map(evaluateFile, jobs))
+
+    return totals
+
+
+def sumResults(results):
+    """ add up the (measures, confusion) pairs of every file """
+
+    n = len(labels)
+    totals = [({"True Positives": 0, "False Negatives": 0, "False Positives": 0},
+               np.zeros((n, n), dtype=int)) for matching in range(2)]
+
+    for result in results:
+        for (measures, confusion), (fileMeasures, fileConfusion) in zip(totals, result):
+            for key in measures:
+                measures[key] += fileMeasures[key]
+            confusion += fileConfusion
+
+    return totals[0], totals[1]
 
 
 def displayMatrix(out, name, confusion):
@@ -413,6 +498,13 @@ def main():
                         default=None
                         )
 
+    parser.add_argument("-processes",
+                        dest="processes",
+                        type=int,
+                        default=globals_cliner.processes,
+                        help="Number of processes to evaluate files with",
+                        )
+
     # Parse command line arguments
     args = parser.parse_args()
 
@@ -460,67 +552,21 @@ def main():
     # annotations  <- predictions
     # gold         <- gold standard
 
-    truePositivesExactSpan = 0
-    falseNegativesExactSpan = 0
-    falsePositivesExactSpan = 0
-
-    truePositivesInexactSpan = 0
-    falseNegativesInexactSpan = 0
-    falsePositivesInexactSpan = 0
-
-    confusion = [[0] * len(labels) for e in labels]
-
-    confusionMatrixExactSpan = deepcopy(confusion)
-    confusionMatrixInexactSpan = deepcopy(confusion)
-
     if len(files) == 0:
         exit("No files to be evaluated")
 
-    for txt, annotations, gold in files:
-
-        # Read predictions and gols standard data
-        cnote = Note(format)
-        rnote = Note(format)
-        cnote.read(txt, annotations)
-        rnote.read(txt, gold)
-
-        referenceSpans = getConceptSpans(rnote.getIOBLabels(), rnote.conlist())
-        predictedSpans = getConceptSpans(cnote.getIOBLabels(), cnote.conlist())
-
-        # TO DO: i need to generate a cumulative total accross all of the files
-        # modify my functions slightly and have it return the number of true positive and etc...
-        # then call generate results
-
-        exactResults = evaluate(deepcopy(referenceSpans), deepcopy(
-            predictedSpans), exactMatch=True, reportSeperately=False)
-
-        inexactResults = evaluate(deepcopy(referenceSpans), deepcopy(
-            predictedSpans), exactMatch=False, reportSeperately=False)
-
-        truePositivesExactSpan += exactResults["True Positives"]
-        falseNegativesExactSpan += exactResults["False Negatives"]
-        falsePositivesExactSpan += exactResults["False Positives"]
-
-        inexactResults = evaluate(deepcopy(referenceSpans), deepcopy(
-            predictedSpans), exactMatch=False, reportSeperately=False)
-
-        truePositivesInexactSpan += inexactResults["True Positives"]
-        falseNegativesInexactSpan += inexactResults["False Negatives"]
-        falsePositivesInexactSpan += inexactResults["False Positives"]
-
-        MatrixInexactSpan = evaluate(deepcopy(referenceSpans), deepcopy(
-            predictedSpans), exactMatch=False, reportSeperately=True)
+    exact, inexact = evaluateFiles(files, format, max(1, args.processes))
 
-        for sublist1, sublist2 in zip(confusionMatrixInexactSpan, MatrixInexactSpan):
-            for i, int2 in enumerate(sublist2):
-                sublist1[i] += int2
+    truePositivesExactSpan = exact[0]["True Positives"]
+    falseNegativesExactSpan = exact[0]["False Negatives"]
+    falsePositivesExactSpan = exact[0]["False Positives"]
 
-        MatrixExactSpan = evaluate(deepcopy(referenceSpans), deepcopy(
-            predictedSpans), exactMatch=True, reportSeperately=True)
+    truePositivesInexactSpan = inexact[0]["True Positives"]
+    falseNegativesInexactSpan = inexact[0]["False Negatives"]
+    falsePositivesInexactSpan = inexact[0]["False Positives"]
 
-        for sublist1, sublist2 in zip(confusionMatrixExactSpan, MatrixExactSpan):
-            for i, int2 in enumerate(sublist2):
-                sublist1[i] += int2
+    confusionMatrixExactSpan = exact[1]
+    confusionMatrixInexactSpan = inexact[1]
 
     print("\nResults for exact span for concepts together.\n")
 
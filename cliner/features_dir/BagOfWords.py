@@ -22,6 +22,9 @@ class BagOfWords(object):
 
         self._vocab = {}
 
+        # column index -> word (inverse of self._vocab)
+        self._words = []
+
     def fit(self, corpus):
 
         """
@@ -37,6 +40,10 @@ class BagOfWords(object):
 
         self._vocab = self._count_vect.vocabulary_
 
+        self._words = [None] * len(self._vocab)
+        for word, index in self._vocab.items():
+            self._words[index] = word
+
         self._fitted = True
 
     def get_vocab(self):
@@ -50,35 +57,51 @@ class BagOfWords(object):
         """
         takes in same input formatting as fit()
 
-        returns a list of dicts. each dict is the freq of each word occuring.
+        returns a list of dicts. each dict is the freq of each word occuring
+        (only words that occur in the document are included).
         Term Frequency Inverse Document Frequency normalization is used.
         """
 
-        transformed_corpus = None
+        transformed_corpus = self.transform_sparse(corpus)
 
-        d = []
+        # Models fit before the inverse vocabulary was stored
+        if len(getattr(self, '_words', [])) != len(self._vocab):
+            self._words = [None] * len(self._vocab)
+            for word, index in self._vocab.items():
+                self._words[index] = word
 
-        if self.is_fitted() is False:
-            exit("bow model error: cannot transformed data when model is not fitted yet")
-        else:
-            transformed_corpus = self._count_vect.transform(corpus)
+        d = []
 
-        V = self.get_vocab()
+        indptr = transformed_corpus.indptr
+        indices = transformed_corpus.indices
+        data = transformed_corpus.data
 
-        for transformed_doc, doc in zip(transformed_corpus, corpus):
+        # Only visit the nonzero entries of each row
+        for row in range(transformed_corpus.shape[0]):
 
             word_freq_map = {}
 
-            transformed_doc = transformed_doc.toarray()[0]
-
-            for word in V:
-                freq = transformed_doc[V[word]]
-                word_freq_map[word] = freq
+            for k in range(indptr[row], indptr[row + 1]):
+                word_freq_map[self._words[indices[k]]] = data[k]
 
             d.append(word_freq_map)
 
         return d
 
+    def transform_sparse(self, corpus):
+
+        """
+        takes in same input formatting as fit()
+
+        returns a scipy CSR matrix with one row per document (columns are
+        indexed by get_vocab()).
+        """
+
+        if self.is_fitted() is False:
+            exit("bow model error: cannot transformed data when model is not fitted yet")
+
+        return self._count_vect.transform(corpus).tocsr()
+
 def tokenize(doc):
     #print "called tokenize()"
 
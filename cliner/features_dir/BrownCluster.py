@@ -1,28 +1,50 @@
 from difflib import get_close_matches
+import atexit
+import os
+import pickle
 import time
 import re
-import numpy
 
 class BrownCluster(object):
 
     longest_n_gram = 4
 
+    # get_close_matches() cutoff for near (non-exact) matches
+    cutoff = .95
+
+    # Below this length, a word within the cutoff is at most one inserted or
+    # deleted character away (ex. at length 19, two insertions score .95),
+    # so the deletion index finds every possible match.
+    fuzzy_index_max_length = 19
+
     def __init__(self, path):
         """ takes in path to output of cluster implementation """
 
         self.process_path(path)
 
+        # string -> cluster bits ("" when there is no match), saved across runs
+        self.memo_path = path + '.lookups'
+        try:
+            with open(self.memo_path, "rb") as f:
+                self.memo = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.memo = {}
+        self.memo_size = len(self.memo)
+
+        atexit.register(self.save_memo)
+
     def process_path(self, path):
 
         # TODO: put better preprocessing...
-        output = open(path, "rb").read()
-        output = [line.split('\t') for line in output.split('\n')]
-        output.pop()
-
         d = {}
 
-        for line in output:
-            d[re.sub(r"[^A-Za-z0-9]", "", line[1].lower())] = {'cluster':line[0], 'count':line[2]}
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                line = line.split('\t')
+                d[re.sub(r"[^A-Za-z0-9]", "", line[1].lower())] = {'cluster':line[0], 'count':line[2]}
 
         self.clusters = d
         self.vocab = set(self.clusters)
@@ -33,6 +55,40 @@ class BrownCluster(object):
         for n in range(1, BrownCluster.longest_n_gram):
             self.groups[n] = self.n_gram_group(self.vocab, n)
 
+        # deletion index: every word with at most one character deleted -> words
+        self.deletions = {}
+        for word in self.vocab:
+            for key in self.single_deletions(word):
+                if key in self.deletions:
+                    self.deletions[key].append(word)
+                else:
+                    self.deletions[key] = [word]
+
+    def save_memo(self):
+        """ write the lookup memo (if it has grown) next to the paths file """
+
+        if len(self.memo) == self.memo_size:
+            return
+
+        try:
+            tmp_path = '%s.%d' % (self.memo_path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.memo, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.memo_path)
+            self.memo_size = len(self.memo)
+        except (IOError, OSError):
+            pass
+
+    def single_deletions(self, string):
+        """ the string itself, and the string with each one character deleted """
+
+        keys = set([string])
+
+        for i in range(len(string)):
+            keys.add(string[:i] + string[i+1:])
+
+        return keys
+
 
     def n_gram_group(self, vocab, gram_length):
         groups = {}
@@ -68,6 +124,18 @@ class BrownCluster(object):
         string = string.lower()
         ret_val = []
 
+        # Fast path: exact match (always the closest match)
+        if string in self.clusters:
+            return [self.clusters[string]]
+
+        # Near matches are one edit away, unless the string is long
+        if len(string) < BrownCluster.fuzzy_index_max_length:
+            candidates = set()
+            for key in self.single_deletions(string):
+                candidates.update(self.deletions.get(key, []))
+        else:
+            candidates = None
+
         for n in range(BrownCluster.longest_n_gram - 1, 0, -1):
 
             group = self.groups[n]
@@ -76,10 +144,16 @@ class BrownCluster(object):
 
             if n_gram is not None or n == 1:
 
+                if candidates is None:
+                    words = group.get(n_gram, [])
+                else:
+                    words = [word for word in candidates
+                             if self.get_first_n_alphanum(word, n) == n_gram]
+
                 for match in get_close_matches(string,
-                                               group[n_gram],
+                                               words,
                                                n=1,
-                                               cutoff=.95):
+                                               cutoff=BrownCluster.cutoff):
                     ret_val.append(self.clusters[match])
 
             if len(ret_val) > 0:
@@ -89,12 +163,17 @@ class BrownCluster(object):
 
     def get_first_n_bits(self, string, n):
 
-        match = self.get_match(string)
+        if string in self.memo:
+            cluster_str = self.memo[string]
+        else:
+            match = self.get_match(string)
 
-        if match == []:
-            return ""
+            if match == []:
+                cluster_str = ""
+            else:
+                cluster_str = match[0]['cluster']
 
-        cluster_str = match[0]['cluster']
+            self.memo[string] = cluster_str
 
         if n < 0:
             return cluster_str
@@ -107,12 +186,12 @@ if __name__ == '__main__':
 
     init = time.time()
 
-    print bc.get_first_n_bits('blood', -1)
-    print bc.get_first_n_bits('blood', 0)
-    print bc.get_first_n_bits('blood', 1 )
-    print bc.get_first_n_bits('blood', 3)
-    print bc.get_first_n_bits('blood', 1000)
+    print(bc.get_first_n_bits('blood', -1))
+    print(bc.get_first_n_bits('blood', 0))
+    print(bc.get_first_n_bits('blood', 1 ))
+    print(bc.get_first_n_bits('blood', 3))
+    print(bc.get_first_n_bits('blood', 1000))
 
-    print time.time() - init
+    print(time.time() - init)
 
 
@@ -0,0 +1,78 @@
+######################################################################
+#  CliNER - feature_store.py                                         #
+#                                                                    #
+#  Purpose: Persist extracted features on disk, so that repeated     #
+#               training runs can skip feature extraction            #
+######################################################################
+
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from cliner.helper import mkpath
+
+
+class FeatureStore(object):
+
+    def __init__(self, dirname, signature=''):
+        """
+        Constructor.
+
+        @param dirname.   directory to keep stored features in
+        @param signature. string identifying the feature configuration and
+                          code version (stored features are only reused when
+                          their signature matches)
+        """
+        self.dirname = dirname
+        self.signature = signature
+
+        mkpath(dirname)
+
+    def key(self, *data):
+        """ build a lookup key from the data that features are extracted from """
+        digest = hashlib.sha1(self.signature.encode('utf-8'))
+        digest.update(pickle.dumps(data, 2))
+        return digest.hexdigest()
+
+    def has_key(self, key):
+        return os.path.exists(self.__path(key))
+
+    def add_map(self, key, value):
+        path = self.__path(key)
+        mkpath(os.path.dirname(path))
+
+        # Write to a temp file first, so readers never see a partial entry
+        os_handle, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(os_handle, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    def get_map(self, key):
+        with open(self.__path(key), 'rb') as f:
+            return pickle.load(f)
+
+    def __path(self, key):
+        # Fan out into subdirectories to keep directory listings small
+        return os.path.join(self.dirname, key[:2], key + '.pickle')
+
+
+def source_digest(dirname):
+    """
+    source_digest()
+
+    Purpose: Hash every python source file under a directory
+
+    @param dirname. directory to hash the source code of
+    @return         hex digest string (changes whenever the code changes)
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(dirname):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith('.py'):
+                digest.update(fname.encode('utf-8'))
+                with open(os.path.join(root, fname), 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
@@ -10,7 +10,13 @@
 __author__ = 'Willie Boag'
 __date__ = 'Jan. 27, 2014'
 
+import os
+import multiprocessing
+
+import cliner
 import cliner.features_dir.sentence_features as feat_sent
+from cliner.features_dir.feature_store import source_digest
+from cliner import globals_cliner
 
 # display enabled modules to user
 feat_sent.display_enabled_modules()
@@ -21,12 +27,21 @@ def IOB_prose_features(nested_prose_data):
     IOB_prose_features()
 
     @param data      A list of split sentences (1 sent = 1 line from file)
+                     (every sentence is assumed to already be prose)
     @param Y         A list of list of IOB (1:1 mapping with data)
     @return          tuple: list of IOB_prose_features, list of IOB
 
     """
-    # Genia preprocessing
-    feat_sent.sentence_features_preprocess(nested_prose_data)
+    return parallel_map(_IOB_prose_features_shard, nested_prose_data)
+
+
+def _IOB_prose_features_shard(nested_prose_data):
+    """ IOB_prose_features() for one contiguous shard of sentences """
+
+    # Genia preprocessing (data was already partitioned, so all of it is prose)
+    # NOTE: GENIA features must be requested in the same order as tagged
+    prose_mask = [True] * len(nested_prose_data)
+    feat_sent.sentence_features_preprocess(nested_prose_data, prose_mask)
 
     prose_feats = []
     for sentence in nested_prose_data:
@@ -43,6 +58,11 @@ def IOB_nonprose_features(nonprose_data):
     @return          tuple: list of IOB_prose_features, list of IOB
 
     """
+    return parallel_map(_IOB_nonprose_features_shard, nonprose_data)
+
+
+def _IOB_nonprose_features_shard(nonprose_data):
+    """ IOB_nonprose_features() for one contiguous shard of sentences """
     nonprose_feats = []
     for sentence in nonprose_data:
         nonprose_feats.append(feat_sent.IOB_nonprose_features(sentence))
@@ -78,10 +98,74 @@ def concept_features(sentence, chunk_inds):
     return features_list
 
 
+def concept_features_for_sentences(sentences, inds_list):
+    """
+    concept_features_for_sentences()
+
+    @param sentences.  a list of sentences (each a list of chunks)
+    @param inds_list.  a list of lists of important indices (1:1 with sentences)
+    @return            a list of lists of dictionaries of features
+                         (one list per sentence, one dict per index)
+    """
+    return parallel_map(_concept_features_shard,
+                        list(zip(sentences, inds_list)))
+
+
+def _concept_features_shard(sentences_and_inds):
+    """ concept_features_for_sentences() for one contiguous shard """
+    sentences = [sentence for sentence, _ in sentences_and_inds]
+    inds_list = [chunk_inds for _, chunk_inds in sentences_and_inds]
+    feat_sent.dependency_parser_preprocess(sentences)
+    feat_sent.word2vec_preprocess(sentences, inds_list)
+    return [concept_features(sentence, chunk_inds)
+            for sentence, chunk_inds in sentences_and_inds]
+
+
+def parallel_map(func, data, processes=None):
+    """
+    parallel_map()
+
+    Purpose: Apply func to contiguous shards of data in a pool of processes
+
+    @param func.      function mapping a list of items to a list of results
+                      (must be a module-level function, so it can be pickled)
+    @param data.      list of items (ex. sentences)
+    @param processes. number of worker processes (default: globals_cliner)
+    @return           list of results, in the same order as data
+
+    Each shard is processed in order by a single worker, which preserves any
+    in-order requirements within a shard (ex. GENIA's iterator). Workers are
+    forked, so loaded resources (taggers, caches, UMLS trie) stay warm.
+
+    >>> parallel_map(sorted, list(range(16, 0, -1)), processes=2)
+    [15, 16, 13, 14, 11, 12, 9, 10, 7, 8, 5, 6, 3, 4, 1, 2]
+    """
+    if processes is None:
+        processes = globals_cliner.processes
+
+    # Not worth the overhead of starting workers
+    if processes <= 1 or len(data) < 2 * processes:
+        return func(data)
+
+    # A few shards per worker balances uneven sentence lengths
+    num_shards = min(len(data), processes * 4)
+    size = -(-len(data) // num_shards)
+    shards = [data[i:i + size] for i in range(0, len(data), size)]
+
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes, initializer=feat_sent.init_worker) as pool:
+        results = pool.map(func, shards, chunksize=1)
+
+    return [item for shard in results for item in shard]
+
+
 def extract_third_pass_features(chunks, inds, bow=None):
 
     unvectorized_X = []
 
+    # Parse every line up front, in batches
+    feat_sent.third_pass_preprocess(chunks, inds)
+
     for lineno, indices in enumerate(inds):
 
         features = feat_sent.third_pass_features(chunks[lineno], indices,
@@ -90,3 +174,21 @@ def extract_third_pass_features(chunks, inds, bow=None):
         unvectorized_X += features
 
     return unvectorized_X
+
+
+def feature_signature():
+    """
+    feature_signature()
+
+    @return A string identifying the enabled feature set and the version of
+            the code that extracts it (used to key stored features).
+    """
+    config = [sorted(feat_sent.enabled.items()),
+              sorted(feat_sent.enabled_concept_features),
+              feat_sent.enabled_IOB_prose_sentence_features,
+              feat_sent.enabled_IOB_nonprose_sentence_features]
+
+    features_dir = os.path.dirname(os.path.abspath(__file__))
+
+    return '%s|%s|%s' % (cliner.__version__, config,
+                         source_digest(features_dir))
@@ -25,5 +25,8 @@ class GeniaCache(object):
         return self.cache[str(key)]
 
     def __del__(self):
-        with open(self.filename, "wb") as f_out:
+        # Write then rename, so concurrent workers never leave a partial file
+        tmp_filename = '%s.%d' % (self.filename, os.getpid())
+        with open(tmp_filename, "wb") as f_out:
             pickle.dump(self.cache, f_out)
+        os.replace(tmp_filename, self.filename)
@@ -12,14 +12,19 @@ from cliner.features_dir import utilities
 
 class GeniaFeatures(object):
 
-    def __init__(self, tagger, data):
+    def __init__(self, tagger, data, prose_mask=None):
         """
         Constructor.
 
-        @param data. A list of split sentences
+        @param data.       A list of split sentences
+        @param prose_mask. A list of booleans (1:1 with data) marking prose
+                           (computed from data if not given)
         """
+        if prose_mask is None:
+            prose_mask = [utilities.is_prose_sentence(s) for s in data]
+
         # Filter out nonprose sentences
-        prose = [sent for sent in data if utilities.is_prose_sentence(sent)]
+        prose = [sent for sent, is_prose in zip(data, prose_mask) if is_prose]
 
         # Process prose sentences with GENIA tagger
         self.GENIA_features = iter(interface_genia.genia(tagger, prose))
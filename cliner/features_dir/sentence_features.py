@@ -12,6 +12,7 @@ import re
 
 from cliner.features_dir.utilities import load_pos_tagger
 from cliner.features_dir import word_features as feat_word
+from cliner import globals_cliner
 
 # What modules are available
 from cliner.features_dir.read_config import enabled_modules
@@ -33,6 +34,7 @@ if enabled.get("BROWN", False):
 
 # Only create UMLS cache if module is available
 if enabled.get('UMLS', False):
+    from cliner.features_dir.umls_dir import interface_umls
     from cliner.features_dir.umls_dir import interpret_umls
     from cliner.features_dir.umls_dir import umls_features as feat_umls
 
@@ -51,7 +53,10 @@ if enabled.get('GENIA', False):
 
 if enabled.get("WORD2VEC", False):
     from cliner.features_dir.word2vec_dir.clustering import\
-        predict_sequence_cluster
+        predict_sequence_cluster, predict_sequence_clusters
+
+# chunk -> sequence cluster, for the sentences being processed
+chunk_clusters = {}
 
 enabled_IOB_nonprose_sentence_features = []
 # enabled_IOB_nonprose_sentence_features.append('pos')
@@ -74,13 +79,24 @@ enabled_IOB_prose_sentence_features.append('UMLS')
 
 dependency_parser = None
 
-if enabled.get("PY4J", False):
-    stanford_dir = os.path.join(CLINER_DIR,
-                                *["cliner", "lib", "java", "stanford_nlp"])
-    sys.path.append(stanford_dir)
 
-    from stanfordParse import DependencyParser
-    dependency_parser = DependencyParser()
+def load_dependency_parser():
+    """ start the dependency parser (only instantiated once) """
+    global dependency_parser
+
+    if dependency_parser is None:
+        stanford_dir = os.path.join(CLINER_DIR,
+                                    *["cliner", "lib", "java", "stanford_nlp"])
+        sys.path.append(stanford_dir)
+
+        from stanfordParse import DependencyParser
+        dependency_parser = DependencyParser(globals_cliner.parser_gateways)
+
+    return dependency_parser
+
+
+if enabled.get("PY4J", False):
+    load_dependency_parser()
 
 
 def display_enabled_modules():
@@ -93,12 +109,70 @@ def display_enabled_modules():
     print()
 
 
-def sentence_features_preprocess(data):
+def init_worker():
+    """
+    Re-open connections that cannot be shared with the parent process.
+
+    Called once in each forked feature extraction worker, so that the loaded
+    taggers, caches, and UMLS trie are inherited (warm) from the parent.
+    """
+    global dependency_parser
+
+    if enabled.get('UMLS', False):
+        interface_umls.reconnect()
+
+    if dependency_parser is not None:
+        dependency_parser.close()
+        dependency_parser = type(dependency_parser)(
+            globals_cliner.parser_gateways)
+
+
+def dependency_parser_preprocess(sentences):
+    """
+    Parse sentences in batches, ahead of extracting their features
+    (the parser memoizes its results by sentence).
+    """
+    if dependency_parser is not None:
+        dependency_parser.get_collapsed_dependencies_batch(sentences)
+
+
+def word2vec_preprocess(sentences, inds_list):
+    """
+    Assign the sequence cluster of every important chunk, in one batch.
+
+    @param sentences. A list of sentences (each a list of chunks)
+    @param inds_list. A list of lists of important indices (1:1 with sentences)
+    """
+    global chunk_clusters
+
+    if enabled.get("WORD2VEC", False):
+        chunks = list(set(sentence[i] for sentence, inds in
+                          zip(sentences, inds_list) for i in inds))
+        chunk_clusters = dict(zip(chunks, predict_sequence_clusters(chunks)))
+
+
+def third_pass_preprocess(lines, inds):
+    """
+    Parse (in batches) every line that third_pass_features() will parse.
+
+    @param lines. A list of lines (each a list of chunks)
+    @param inds.  A list of lists of important indices (1:1 with lines)
+    """
+    load_dependency_parser()
+
+    lines = [line for line, indices in zip(lines, inds)
+             if len(indices) >= 2 and len(line) <= 100]
+
+    dependency_parser.getNounPhraseHeadsBatch([" ".join(l) for l in lines])
+    dependency_parser.get_collapsed_dependencies_batch(lines)
+
+
+def sentence_features_preprocess(data, prose_mask=None):
     global feat_genia
     tagger = enabled.get('GENIA', False)
     # Only run GENIA tagger if module is available
     if tagger:
-        feat_genia = GeniaFeatures(tagger, data)
+        feat_genia = GeniaFeatures(tagger, data, prose_mask)
 
 
 def IOB_prose_features(sentence, data=None):
@@ -399,7 +473,10 @@ def concept_features_for_sentence(sentence, chunk_inds):
         for i, chunk_index in enumerate(chunk_inds):
 
             chunk = sentence[chunk_index]
-            cluster = predict_sequence_cluster(chunk)
+            if chunk in chunk_clusters:
+                cluster = chunk_clusters[chunk]
+            else:
+                cluster = predict_sequence_cluster(chunk)
 
             features_list[i].update({("cluster", cluster): 1})
 
@@ -466,21 +543,62 @@ def getShortestList(lists):
     return shortestList
 
 
-def third_pass_features(line, indices, bow_model=None):
-    """ extract third pass features
-        running this assumes all the dependencies are properly installed.
+# Characters stripped from chunk tokens before Brown cluster lookup
+_non_brown_chars = re.compile("[^A - Za - z0 - 9]")
+
+
+def _third_pass_chunk_features(chunk, heads, cui):
     """
+    _third_pass_chunk_features()
 
-    global dependency_parser
+    Purpose: Features of one chunk, for every pair it is the start/end of
 
-    # only instantiate once.
-    if dependency_parser is None:
+    @param chunk. <string> the chunk's text
+    @param heads. <list> of noun phrase heads in the chunk's line
+    @param cui.   the chunk's (lowercased) concept id
+    @return       <dict> of the chunk's lowercased text, Brown cluster
+                  features (as a start and as an end word), NP head
+                  containment, CUI, and unigrams
+    """
 
-        sys.path.append(os.path.join(
-            *[os.environ["CLINER_DIR"], "cliner", "lib", "java", "stanford_nlp"]))
-        from stanfordParse import DependencyParser
+    text = chunk.lower()
+
+    brown_start = {}
+    brown_end = {}
+    if enabled.get("BROWN", False):
+
+        tokens = [_non_brown_chars.sub("", token) for token in text.split()]
+        tokens = [token for token in tokens if token != '']
+
+        for token in tokens:
+            cluster_str = bc.get_first_n_bits(token, -1)
+
+            for n in (2, 4, 6, 8):
+                brown_start[("brown_cluster_first_%d_bits_start_word" % n,
+                             token)] = cluster_str[:n]
+                brown_end[("brown_cluster_first_%d_bits_end_word" % n,
+                           token)] = cluster_str[:n]
+
+    contains_head = 0
+    for head in heads:
+        if head in text:
+            contains_head = 1
+            break
+
+    return {'text': text,
+            'brown_start': brown_start,
+            'brown_end': brown_end,
+            'contains_head': contains_head,
+            'cui': cui,
+            'unigrams': [tok.lower() for tok in chunk.split()]}
 
-        dependency_parser = DependencyParser()
+
+def third_pass_features(line, indices, bow_model=None):
+    """ extract third pass features
+        running this assumes all the dependencies are properly installed.
+    """
+
+    load_dependency_parser()
 
     heads = []
 
@@ -498,133 +616,96 @@ def third_pass_features(line, indices, bow_model=None):
             heads = dependency_parser.getNounPhraseHeads(sentence)
 
             #  the parser takes way too long to run for really long strings.
-            dependencies = dependency_parser.get_collapsed_dependencies(
-                " ".join(line))
+            dependencies = dependency_parser.get_collapsed_dependencies(line)
         else:
             dependencies = []
 
         tagged_line = nltk_tagger.tag(line)
 
-    features_list = []
-
-    # Build (n choose 2)booleans
-    for i in range(len(indices)):
-        for j in range(i + 1, len(indices)):
-
-            feats = {}
-
-            start = line[indices[i]].lower()
-            end = line[indices[j]].lower()
-
-            between_tokens = line[(indices[i] + 1): indices[j]]
-            bow = bow_model.transform([' '.join(between_tokens)])[0]
-
-            for _, pos in tagged_line[(indices[i] + 1): indices[j]]:
-                feats[('pos', pos)] = 1
-
-            for key in bow:
-                feats[('bow', key)] = bow[key]
+    pairs = [(i, j) for i in range(len(indices))
+             for j in range(i + 1, len(indices))]
 
-            start_tokens = start.split()
-            start_tokens = [re.sub("[^A - Za - z0 - 9]", "", token)
-                            for token in start_tokens]
-            start_tokens = [token for token in start_tokens if token != '']
+    # Every concept id the line needs, looked up as one batch
+    texts = [line[ind].lower() for ind in indices]
+    disjoint = ["{} {}".format(texts[i], texts[j]) for i, j in pairs]
+    cuis = interpret_umls.obtain_concept_ids_batch(umls_cache,
+                                                   texts + disjoint,
+                                                   PyPwl=None)
+    disjoint_cuis = cuis[len(texts):]
 
-            if enabled.get("BROWN", False):
+    # Per-chunk features (shared by every pair the chunk takes part in)
+    chunk_feats = {}
+    for ind, cui in zip(indices, cuis):
+        chunk_feats[ind] = _third_pass_chunk_features(line[ind], heads, cui)
 
-                for token in start_tokens:
-                    cluster_str = bc.get_first_n_bits(token, -1)
+    # Text between each pair, transformed as one batch
+    between = [' '.join(line[(indices[i] + 1): indices[j]]) for i, j in pairs]
+    bows = bow_model.transform(between)
 
-                    feats[("brown_cluster_first_2_bits_start_word",
-                           token)] = cluster_str[:2]
-                    feats[("brown_cluster_first_4_bits_start_word",
-                           token)] = cluster_str[:4]
-                    feats[("brown_cluster_first_6_bits_start_word",
-                           token)] = cluster_str[:6]
-                    feats[("brown_cluster_first_8_bits_start_word",
-                           token)] = cluster_str[:8]
-
-                end_tokens = end.split()
-                end_tokens = [re.sub("[^A - Za - z0 - 9]", "", token)
-                              for token in end_tokens]
-                end_tokens = [token for token in end_tokens if token != '']
-
-                for token in end_tokens:
-                    cluster_str = bc.get_first_n_bits(token, -1)
+    features_list = []
 
-                    feats[("brown_cluster_first_2_bits_end_word", token)
-                          ] = cluster_str[:2]
-                    feats[("brown_cluster_first_4_bits_end_word", token)
-                          ] = cluster_str[:4]
-                    feats[("brown_cluster_first_6_bits_end_word", token)
-                          ] = cluster_str[:6]
-                    feats[("brown_cluster_first_8_bits_end_word", token)
-                          ] = cluster_str[:8]
+    # Build (n choose 2)booleans
+    for (i, j), bow, disjoint_cui in zip(pairs, bows, disjoint_cuis):
 
-            if len(heads) > 0:
+        feats = {}
 
-                contains = 0
-                for head in heads:
-                    if head in start:
-                        contains = 1
-                        break
+        left = chunk_feats[indices[i]]
+        right = chunk_feats[indices[j]]
 
-                feats[('contains_NP_head', start)] = contains
+        start = left['text']
+        end = right['text']
 
-                contains = 0
-                for head in heads:
-                    if head in end:
-                        contains = 1
-                        break
+        for _, pos in tagged_line[(indices[i] + 1): indices[j]]:
+            feats[('pos', pos)] = 1
 
-                feats[('contains_NP_head', end)] = contains
+        # Only the words that occur between the chunks
+        for key, freq in bow.items():
+            feats[('bow', key)] = freq
 
-            get_cui = interpret_umls.obtain_concept_ids
+        feats.update(left['brown_start'])
+        feats.update(right['brown_end'])
 
-            start_cui = get_cui(umls_cache, start, PyPwl=None)
-            end_cui = get_cui(umls_cache, end, PyPwl=None)
-            disjoint_cui = get_cui(
-                umls_cache, "{} {}".format(start, end), PyPwl=None)
+        if len(heads) > 0:
+            feats[('contains_NP_head', start)] = left['contains_head']
+            feats[('contains_NP_head', end)] = right['contains_head']
 
-            feats[('start_cui', start_cui)] = 1
-            feats[('end_cui', end_cui)] = 1
-            feats[('disjoint_cui', disjoint_cui)] = 1
+        feats[('start_cui', left['cui'])] = 1
+        feats[('end_cui', right['cui'])] = 1
+        feats[('disjoint_cui', disjoint_cui)] = 1
 
-            # Features of pair relationship
-            lOfRels = getTypesOfRel(start, end, dependencies)
+        # Features of pair relationship
+        lOfRels = getTypesOfRel(start, end, dependencies)
 
-            feats[('dependency_relation', None)] = (len(lOfRels) > 0)
+        feats[('dependency_relation', None)] = (len(lOfRels) > 0)
 
-            numOfRels = getNumOfObjects(lOfRels)
+        numOfRels = getNumOfObjects(lOfRels)
 
-            lOfTokes = getTokens(start, end, dependencies)
+        lOfTokes = getTokens(start, end, dependencies)
 
-            numOfTokes = getNumOfObjects(lOfTokes)
+        numOfTokes = getNumOfObjects(lOfTokes)
 
-            feats[('rels_btwn_depen', None)] = numOfRels
-            feats['num_of_depen_tokes'] = numOfTokes
+        feats[('rels_btwn_depen', None)] = numOfRels
+        feats['num_of_depen_tokes'] = numOfTokes
 
-            # feats[("tokes_that_exists_in_umls_db", None)] = interface_umls.substrs_that_exists([start, end], pwl)
+        # feats[("tokes_that_exists_in_umls_db", None)] = interface_umls.substrs_that_exists([start, end], pwl)
 
-            # Feature: Left Unigrams
-            for tok in line[indices[i]].split():
-                tok = tok.lower()
-                feats[('left_unigram', tok)] = 1
+        # Feature: Left Unigrams
+        for tok in left['unigrams']:
+            feats[('left_unigram', tok)] = 1
 
-            # Feature: Right Unigrams
-            for tok in line[indices[j]].split():
-                tok = tok.lower()
-                feats[('right_unigram', tok)] = 1
+        # Feature: Right Unigrams
+        for tok in right['unigrams']:
+            feats[('right_unigram', tok)] = 1
 
-            # Feature: Unigrams between spans
-            for tok in ' '.join(line[indices[i + 1]:indices[j]]).split():
-                tok = tok.lower()
-                feats[('inner_unigram', tok)] = 1
+        # Feature: Unigrams between spans
+        for tok in ' '.join(line[indices[i + 1]:indices[j]]).split():
+            tok = tok.lower()
+            feats[('inner_unigram', tok)] = 1
 
-            # Feature: Number of chunks between spans
-            feats[('span_dist', None)] = len(line[indices[i + 1]:indices[j]])
+        # Feature: Number of chunks between spans
+        feats[('span_dist', None)] = len(line[indices[i + 1]:indices[j]])
 
-            # Add pair features to list of data points
-            features_list.append(feats)
+        # Add pair features to list of data points
+        features_list.append(feats)
 
     return features_list
@@ -6,7 +6,9 @@
 
 
 import copy
+import pickle
 import sqlite3
+import threading
 from . import create_sqliteDB
 import os
 
@@ -57,6 +59,31 @@ def SQLConnect():
 # Global database connection
 c = SQLConnect()
 
+
+def reconnect():
+    """ open a fresh connection (sqlite connections must not cross a fork) """
+    global c, _local
+    c = SQLConnect()
+    _local = threading.local()
+
+
+# Connections for other threads (sqlite connections can't cross threads)
+_local = threading.local()
+
+
+def cursor():
+    """ get the database cursor for the calling thread """
+    if threading.current_thread() is threading.main_thread():
+        return c
+    if not hasattr(_local, 'c'):
+        _local.c = SQLConnect()
+    return _local.c
+
+
+# Precomputed indexes (loaded on first use)
+_indexes = {}
+_indexes_lock = threading.Lock()
+
 # Global trie
 trie = create_trie.create_trie()
 
@@ -68,29 +95,32 @@ trie = create_trie.create_trie()
 
 def string_lookup(string):
     """ Get sty for a given string """
+    cur = cursor()
     try:
-        c.execute(
+        cur.execute(
             "SELECT sty FROM MRCON a, MRSTY b WHERE a.cui = b.cui AND str = ?; ", (string,))
-        return c.fetchall()
+        return cur.fetchall()
     except sqlite3.ProgrammingError as e:
         return []
 
 
 def cui_lookup(string):
     """ get cui for a given string """
+    cur = cursor()
     try:
         # Get cuis
-        c.execute("SELECT cui FROM MRCON WHERE str = ?;", (string,))
-        return c.fetchall()
+        cur.execute("SELECT cui FROM MRCON WHERE str = ?;", (string,))
+        return cur.fetchall()
     except sqlite3.ProgrammingError as e:
         return []
 
 
 def abr_lookup(string):
     """ searches for an abbreviation and returns possible expansions for that abbreviation"""
+    cur = cursor()
     try:
-        c.execute("SELECT str FROM LRABR WHERE abr = ?;", (string,))
-        return c.fetchall()
+        cur.execute("SELECT str FROM LRABR WHERE abr = ?;", (string,))
+        return cur.fetchall()
     except sqlite3.ProgrammingError as e:
         return []
 
@@ -102,13 +132,77 @@ def concept_exists(string):
 
 def tui_lookup(string):
     """ takes in a concept id string (ex: C00342143) and returns the TUI of that string which represents the semantic type is belongs to """
+    cur = cursor()
     try:
-        c.execute("SELECT tui FROM MRSTY WHERE cui = ?;", (string,))
-        return c.fetchall()
+        cur.execute("SELECT tui FROM MRSTY WHERE cui = ?;", (string,))
+        return cur.fetchall()
     except sqlite3.ProgrammingError as e:
         return []
 
 
+############################################
+###          Precomputed Indexes         ###
+############################################
+
+
+def load_index(name, build):
+    """
+    get an index saved in the umls tables dir, building (and saving) it when
+    it is missing or older than the database
+    """
+    with _indexes_lock:
+        if name not in _indexes:
+            path = os.path.join(umls_tables, name)
+            db_path = os.path.join(umls_tables, "umls.db")
+
+            if os.path.isfile(path) and \
+               os.path.getmtime(path) >= os.path.getmtime(db_path):
+                with open(path, "rb") as f:
+                    index = pickle.load(f)
+            else:
+                index = build()
+
+                # Write then rename, so readers never see a partial file
+                tmp_path = '%s.%d' % (path, os.getpid())
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+
+            _indexes[name] = index
+
+    return _indexes[name]
+
+
+def cuis_with_tuis(tuis):
+    """ the set of every cui that has at least one of the given tuis """
+    tuis = sorted(set(tuis))
+
+    def build():
+        cur = cursor()
+        cur.execute("SELECT DISTINCT cui FROM MRSTY WHERE tui IN (%s);" %
+                    ",".join("?" * len(tuis)), tuis)
+        return frozenset(row[0] for row in cur.fetchall())
+
+    return load_index("cuis_with_tuis-%s.pickle" % "-".join(tuis), build)
+
+
+def abbreviation_index():
+    """ abbreviation -> { expansion -> list of cuis of that expansion } """
+
+    def build():
+        index = {}
+        cur = cursor()
+        cur.execute("SELECT a.abr, a.str, b.cui FROM LRABR a "
+                    "LEFT JOIN MRCON b ON a.str = b.str;")
+        for abr, expansion, cui in cur.fetchall():
+            cuis = index.setdefault(abr, {}).setdefault(expansion, [])
+            if cui is not None and cui not in cuis:
+                cuis.append(cui)
+        return index
+
+    return load_index("abbreviations.pickle", build)
+
+
 def substrs_that_exists(lOfStrs, pwl):
     """ sees if a sub string exists within trie"""
 
@@ -1,7 +1,9 @@
 import os
 import sys
 import time
+import threading
 import nltk
+from concurrent.futures import ThreadPoolExecutor
 from cliner.features_dir.umls_dir import interface_umls
 from cliner.features_dir.umls_dir.umls_cache import UmlsCache
 from cliner.normalization.spellCheck.spellChecker import spellCheck
@@ -14,6 +16,7 @@ sys.path.append((os.environ["CLINER_DIR"] + "/cliner/lib/java/metamap"))
 # from spellChecker import getPWL
 
 metamap = None
+metamap_lock = threading.Lock()
 
 
 def umls_semantic_type_word(umls_string_cache, sentence):
@@ -154,7 +157,7 @@ def umls_semantic_type_sentence(cache, sentence):
 
 def abr_lookup(cache, word):
     """ get expansions of an abbreviation """
-    if word + "--abrs" in cache:
+    if cache.has_key(word + "--abrs"):  # NOQA
         abbreviations = cache.get_map(word + "--abrs")
     else:
         abbreviations = interface_umls.abr_lookup(word)
@@ -171,22 +174,12 @@ def abr_lookup(cache, word):
 
 def get_cuis_for_abr(cache, word):
     """ gets cui for each possible expansion of abbreviation """
-    if cache.has_key(word + "--cuis_of_abr"):  # NOQA
-        cuis_of_abr = cache.get_map(word + "--cuis_of_abr")
-    else:
-        cuis_of_abr = {}
-        for phrase in abr_lookup(cache, word):
-            # prevents circular loop
-            cuis_of_abr[phrase] = get_cui(cache, phrase)
-
-        cache.add_map(word + "cuis_of_abr", cuis_of_abr)
-
-    return cuis_of_abr
+    return interface_umls.abbreviation_index().get(word, {})
 
 
 def get_tui(cache, cuiStr):
     """ get tui of a cui """
-    if cuiStr + "--tui" in cache:
+    if cache.has_key(cuiStr + "--tui"):  # NOQA
         tui = cache.get_map(cuiStr + "--tui")
     else:
         # list of singleton tuples
@@ -294,17 +287,9 @@ def filter_cuis_by_tui(cache, cuis, filter=["T020",  # acquired abnormality
                                             "T046",  # Pathologic Function
                                             "T184"]):
     """ removes cuis that do not have tui that is in the filter """
-    results = set()
+    allowed = interface_umls.cuis_with_tuis(filter)
 
-    for cui in cuis:
-
-        for tui in get_tui(cache, cui):
-
-            if tui in filter:
-                results.add(cui)
-                break
-
-    return list(results)
+    return list(set(cuis) & allowed)
 
 
 def normalize_phrase(phrase, PyPwl=None):
@@ -342,26 +327,123 @@ def is_valid_phrase(phrase):
 
 def obtain_concept_ids(cache, phrase, PyPwl=None, cui_freq={}):
 
+    return obtain_concept_ids_batch(cache, [phrase], PyPwl=PyPwl,
+                                    cui_freq=cui_freq)[0]
+
+
+def obtain_concept_ids_batch(cache, phrases, PyPwl=None, cui_freq={}):
+    """
+    get the most likely concept id for each of a list of phrases.
+
+    every phrase whose MetaMap result is not cached yet is looked up in one
+    batch, and the results are added to the (persistent) cache, so repeated
+    phrases are only sent to MetaMap once.
+    """
+
+    lookup_metamap(cache, phrases)
+
+    return [cached_concept_id(cache, phrase, PyPwl, cui_freq)
+            for phrase in phrases]
+
+
+def lookup_metamap(cache, phrases):
+    """
+    send every phrase whose MetaMap result is not cached to MetaMap (in one
+    batch), and cache the results.
+
+    the java MetaMap api is not thread safe, so only one thread at a time
+    looks up (and caches) MetaMap results.
+    """
+
     global metamap
 
-    # phrases that do not contain alphanumerica characters will cause metamap
-    # to crash.
-    if is_valid_phrase(phrase) is False:
-        return ['CUI-less']
+    with metamap_lock:
 
-    # phrases = [normalize_phrase(phrase, PyPwl=PyPwl) for phrase in phrases]
+        # phrases that do not contain alphanumerica characters will cause
+        # metamap to crash.
+        lookup = [phrase for phrase in phrases
+                  if is_valid_phrase(phrase) and
+                  not cache.has_key(phrase + '--metamap')]  # NOQA
+
+        # Eliminate duplicates (keeping order)
+        lookup = list(dict.fromkeys(lookup))
 
-    # assumes dependencies are installed properly if this function is called.
-    if metamap is None:
-        from cuiLookup import MetaMap
-        metamap = MetaMap()
+        if not lookup:
+            return
 
-    # lvgnorm is used within the metamap java code for efficiency reasons.
-    conceptIds = metamap.getConceptIds(phrase)
+        # assumes dependencies are installed properly if this function is
+        # called. (metamap can also be set to a stub with the same interface)
+        if metamap is None:
+            from cuiLookup import MetaMap
+            metamap = MetaMap()
 
-    retVal = []
+        # lvgnorm is used within the metamap java code for efficiency reasons.
+        for phrase, conceptId in zip(lookup, metamap.getConceptIdsBatch(lookup)):
+            cache.add_map(phrase + '--metamap', conceptId)
+
+
+class LockedCache(object):
+    """ a cache shared by threads (every access holds the same lock) """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+
+    def has_key(self, key):
+        with self.lock:
+            return self.cache.has_key(key)  # NOQA
+
+    def add_map(self, key, value):
+        with self.lock:
+            self.cache.add_map(key, value)
+
+    def get_map(self, key):
+        with self.lock:
+            return self.cache.get_map(key)
+
+
+def obtain_concept_ids_concurrent(cache, phrases, PyPwl=None, cui_freq={},
+                                  max_workers=8, batch_size=25):
+    """
+    obtain_concept_ids_batch(), with the abbreviation / cui lookups of the
+    distinct phrases split into batches that are resolved by a bounded pool
+    of threads.
+
+    MetaMap is called once, up front, for every phrase (it is not thread
+    safe). the sqlite queries that follow spend most of their time waiting,
+    so threads overlap that latency.
+    """
+
+    unique = list(dict.fromkeys(phrases))
+
+    lookup_metamap(cache, unique)
+
+    shared = LockedCache(cache)
+
+    batches = [unique[i:i + batch_size]
+               for i in range(0, len(unique), batch_size)]
+
+    def resolve(batch):
+        return [cached_concept_id(shared, phrase, PyPwl, cui_freq)
+                for phrase in batch]
+
+    resolved = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for batch, cuis in zip(batches, pool.map(resolve, batches)):
+            resolved.update(zip(batch, cuis))
+
+    return [resolved[phrase] for phrase in phrases]
+
+
+def cached_concept_id(cache, phrase, PyPwl=None, cui_freq={}):
+    """ get the most likely concept id for a phrase already looked up """
+
+    if is_valid_phrase(phrase) is False:
+        return ['CUI-less']
+
+    # phrases = [normalize_phrase(phrase, PyPwl=PyPwl) for phrase in phrases]
 
-    assert(len(conceptIds) == 1)
+    conceptIds = [cache.get_map(phrase + '--metamap')]
 
     for conceptId in conceptIds:
 
@@ -7,7 +7,6 @@
 ######################################################################
 
 
-import re
 import pickle
 import os
 
@@ -46,6 +45,10 @@ def load_pos_tagger(path_to_obj=pos_tagger_path):
 
     return tagger
 
+# Characters that disqualify a word from being 'prose'
+_nonprose_punctuation = frozenset(".?,!:\"'")
+
+
 def is_prose_sentence(sentence):
     """
     is_prose_sentence()
@@ -127,12 +130,11 @@ def is_prose_word(word):
     False
     """
     # Punctuation
-    for punc in ".?,!:\"'":
-        if punc in word:
-            return False
+    if _nonprose_punctuation.intersection(word):
+        return False
 
     # Digit
-    if re.match('\d', word):
+    if word[:1].isdecimal():
         return False
 
     # All uppercase
@@ -1,21 +1,27 @@
 
-import vectors
 import numpy as np
 
-from word2vec import embeddings
-from sklearn.cluster import KMeans
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cliner.features_dir.word2vec_dir import vectors
+from cliner.features_dir.word2vec_dir.word2vec import get_embeddings
+from sklearn.cluster import MiniBatchKMeans
 
 lexical_clusters   = None
 embedding_clusters = None
 skipgram_mappings  = None
 
+# chunk -> sequence vector (float32), for chunks clustered during training
+sequence_vectors   = {}
+
 def predict_sequence_cluster(chunk):
 
         global lexical_clusters
         global embedding_clusters
         global skipgram_mappings
 
-        vector = vectors.get_sequence_vectors(chunk, skipgram_mappings, embeddings)
+        vector = vectors.get_sequence_vectors(chunk, skipgram_mappings, get_embeddings())
 
         D = vector.shape[0]
 
@@ -30,60 +36,116 @@ def predict_sequence_cluster(chunk):
             return embedding_clusters.predict(vector)[0]
 
 
-def get_sequence_vector_clusters(chunked_sentences, chunk_indices):
+def predict_sequence_clusters(chunks):
+    """
+    predict_sequence_cluster() for many chunks, with one predict() call per
+    cluster model.
+    """
 
-    # TODO: perform this on chunked data...
-    # TODO: vectorize this code...
+    # reuse the vectors computed for clustering
+    missing = [chunk for chunk in chunks if chunk not in sequence_vectors]
+    computed = dict(zip(missing, vectors.get_sequence_vectors_batch(missing, skipgram_mappings, get_embeddings())))
+    seq_vectors = [sequence_vectors[chunk] if chunk in sequence_vectors else computed[chunk]
+                   for chunk in chunks]
 
-    global skipgram_mappings
+    clusters = [None] * len(chunks)
 
-    chunk_embeddings = []
-    chunk_lexical    = []
+    for D, model in ((200, lexical_clusters), (500, embedding_clusters)):
 
-    print "getting vectors..."
+        rows = [i for i, vector in enumerate(seq_vectors) if vector.shape[0] == D]
 
-    j = 1
+        if rows:
+            predictions = model.predict(np.vstack([seq_vectors[i] for i in rows]))
+            for i, cluster in zip(rows, predictions):
+                clusters[i] = cluster
 
-    n = len(chunked_sentences)
+    assert None not in clusters
 
-    for l, inds in zip(chunked_sentences, chunk_indices):
+    return clusters
 
-        print "{} / {} getting vector".format(j, n)
 
-        j += 1
+class Centroids(object):
+    """
+    compact cluster model: just the centroids (float32), predicting the
+    nearest one (same as KMeans.predict, without the fitted labels)
+    """
 
-        for i in inds:
+    def __init__(self, centers):
+        self.centers = np.asarray(centers, dtype='float32')
+        self.squared_norms = (self.centers ** 2).sum(axis=1)
 
-            vector = vectors.get_sequence_vectors(l[i], skipgram_mappings, embeddings)
+    def predict(self, X):
+        X = np.atleast_2d(X)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2  (|x|^2 is the same for every c)
+        distances = self.squared_norms - 2 * np.dot(X, self.centers.T)
+        return distances.argmin(axis=1)
 
-            print vector.shape
 
-            D = vector.shape[0]
+def fit_centroids(vectors_, weights, sample_size, batch_size=1024, seed=0):
+    """
+    fit up to 1024 clusters with mini-batch k-means
 
-            assert D == 200 or D == 500
+    vectors_:    matrix of distinct sequence vectors
+    weights:     number of times each vector occurs in the training data
+    sample_size: most occurrences to fit on (sampled, when there are more)
+    """
 
-            if D == 200:
-                chunk_lexical.append(vector)
-            else:
-                chunk_embeddings.append(vector)
+    weights = np.asarray(weights, dtype='float64')
 
+    if sample_size is not None and weights.sum() > sample_size:
+        rng = np.random.RandomState(seed)
+        sample = rng.choice(len(weights), size=sample_size, p=weights/weights.sum())
+        weights = np.bincount(sample, minlength=len(weights)).astype('float64')
+        keep = weights > 0
+        vectors_, weights = vectors_[keep], weights[keep]
 
-    # need atleast one example to train
-    # TODO: what problems may arise from this?
-    if len(chunk_embeddings) == 0:
-        chunk_embeddings.append(np.random.randn(500))
+    model = MiniBatchKMeans(n_clusters=min(len(vectors_), 1024),
+                            batch_size=batch_size, max_iter=120, n_init=3,
+                            random_state=seed)
+    model.fit(vectors_, sample_weight=weights)
 
-    if len(chunk_lexical) == 0:
-        chunk_lexical.append(np.random.randn(200))
+    return Centroids(model.cluster_centers_)
 
-    embedding_clusters = KMeans(max_iter=120, n_clusters=min(len(chunk_embeddings), 1024))
-    lexical_clusters = KMeans(max_iter=120, n_clusters=min(len(chunk_lexical), 1024))
 
-    print "clustering..."
-    embedding_clusters.fit(chunk_embeddings)
-    lexical_clusters.fit(chunk_lexical)
+def get_sequence_vector_clusters(chunked_sentences, chunk_indices, sample_size=None):
 
-    return embedding_clusters, lexical_clusters
+    global skipgram_mappings
+
+    # every distinct chunk gets its vector computed once (weighted by count)
+    counts = Counter(l[i] for l, inds in zip(chunked_sentences, chunk_indices) for i in inds)
+    chunks = list(counts)
+
+    print("getting vectors...")
+
+    seq_vectors = vectors.get_sequence_vectors_batch(chunks, skipgram_mappings, get_embeddings())
+
+    sequence_vectors.update((chunk, vector.astype('float32'))
+                            for chunk, vector in zip(chunks, seq_vectors))
 
+    training = {200: ([], []), 500: ([], [])}
 
+    for chunk, vector in zip(chunks, seq_vectors):
 
+        D = vector.shape[0]
+
+        assert D == 200 or D == 500
+
+        training[D][0].append(vector)
+        training[D][1].append(counts[chunk])
+
+    # need atleast one example to train
+    # TODO: what problems may arise from this?
+    for D, (vecs, weights) in training.items():
+        if len(vecs) == 0:
+            vecs.append(np.random.randn(D))
+            weights.append(1)
+
+    print("clustering...")
+
+    # fit both cluster models at the same time
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        embedding_clusters, lexical_clusters = pool.map(
+            lambda D: fit_centroids(np.vstack(training[D][0]), training[D][1], sample_size),
+            (500, 200))
+
+    return embedding_clusters, lexical_clusters
@@ -54,7 +54,7 @@ if __name__ == "__main__":
 
     init_time = time.time()
 
-    print get_char_grams(["he", "ran"], 1)
+    print(get_char_grams(["he", "ran"], 1))
 
     """
     skip_grams = get_char_skip_grams(["he", "ran", "to", "class", "and", "was", "late", "world!"], 2, 1)
@@ -65,5 +65,5 @@ if __name__ == "__main__":
     print get_lexical_vectors(token, gram_mappings)
     """
 
-    print time.time() - init_time
+    print(time.time() - init_time)
 
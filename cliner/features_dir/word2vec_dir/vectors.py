@@ -1,6 +1,6 @@
 
 import numpy as np
-from word2vec import embeddings
+from cliner.features_dir.word2vec_dir.word2vec import get_embeddings
 
 def get_surrounding_embeddings(chunked_sentence, index):
 
@@ -13,6 +13,8 @@ def get_surrounding_embeddings(chunked_sentence, index):
 
     embedding_sum = np.zeros((300,))
 
+    embeddings = get_embeddings()
+
     for chunk in surrounding_chunks:
 
         chunk = chunk.split(' ')
@@ -26,20 +28,59 @@ def get_surrounding_embeddings(chunked_sentence, index):
     return {"embedding_{}".format(i):entry for i, entry in enumerate(embedding_sum)}
 
 
-def get_lexical_vectors(token, gram_mappings):
+class GramMatrix(object):
+    """ char-gram vectors stacked into one matrix, with a gram -> row index """
+
+    def __init__(self, gram_mappings):
+
+        self.mappings = gram_mappings
+
+        grams = list(gram_mappings)
+        self.index = {gram: i for i, gram in enumerate(grams)}
+
+        # longest gram (substrings longer than this can't be grams)
+        self.longest = max([len(gram) for gram in grams] + [0])
+
+        if grams:
+            self.matrix = np.vstack([gram_mappings[gram] for gram in grams])
+        else:
+            self.matrix = np.zeros((0, 200))
+
+    def rows(self, token):
+        """ rows of every distinct gram that occurs in the token """
 
-    grams_in_token = []
+        rows = set()
 
-    # TODO: make thos a parameter
-    lexical_vect = np.zeros(200)
+        for n in range(1, self.longest + 1):
+            for i in range(len(token) - n + 1):
+                row = self.index.get(token[i:i + n])
+                if row is not None:
+                    rows.add(row)
 
-    for gram in gram_mappings:
+        return list(rows)
 
-        if gram in token:
 
-            grams_in_token.append(gram)
+# GramMatrix of the most recently used gram mappings
+_gram_matrix = None
+
+
+def get_gram_matrix(gram_mappings):
+
+    global _gram_matrix
+
+    if _gram_matrix is None or _gram_matrix.mappings is not gram_mappings:
+        _gram_matrix = GramMatrix(gram_mappings)
+
+    return _gram_matrix
+
+
+def get_lexical_vectors(token, gram_mappings):
+
+    # sum of the vectors of every gram that occurs in the token (looked up
+    # from the token's own substrings, not by scanning every gram)
+    grams = get_gram_matrix(gram_mappings)
 
-            lexical_vect += gram_mappings[gram]
+    lexical_vect = grams.matrix[grams.rows(token)].sum(axis=0)
 
     return (lexical_vect/np.linalg.norm(lexical_vect))
 
@@ -89,9 +130,54 @@ def get_sequence_vectors(chunk, skipgram_mappings, word_embeddings):
         normed_sequence_embeddings = (sequence_embeddings / np.linalg.norm(sequence_embeddings))
         return normed_sequence_embeddings
 
+
+def get_sequence_vectors_batch(chunks, skipgram_mappings, word_embeddings):
+    """
+    get_sequence_vectors() for many chunks at once.
+
+    each distinct token's lexical vector and embedding is computed once, and
+    embeddings are gathered from the matrix in one indexing operation.
+    """
+
+    tokenized = [chunk.split(' ') for chunk in chunks]
+    tokens = list(set(token for chunk in tokenized for token in chunk))
+
+    lexical = {token: get_lexical_vectors(token, skipgram_mappings)
+               for token in tokens}
+
+    known = [token for token in tokens if token in word_embeddings]
+    if known:
+        rows = word_embeddings.vectors([word_embeddings.index(t) for t in known])
+        embedded = dict(zip(known, rows))
+    else:
+        embedded = {}
+
+    vectors = []
+
+    for chunk_tokens in tokenized:
+
+        in_vocab = [token for token in chunk_tokens if token in embedded]
+
+        if in_vocab:
+            summed_lexical_vectors = np.sum([lexical[t] for t in in_vocab], axis=0)
+            summed_embeddings = np.sum([embedded[t] for t in in_vocab], axis=0)
+        else:
+            summed_lexical_vectors = np.sum([lexical[t] for t in chunk_tokens], axis=0)
+            summed_embeddings = None
+
+        normed_lexical_vectors = (summed_lexical_vectors / np.linalg.norm(summed_lexical_vectors))
+
+        if summed_embeddings is None:
+            vectors.append(normed_lexical_vectors)
+        else:
+            sequence_embeddings = np.append(summed_embeddings / np.linalg.norm(summed_embeddings), normed_lexical_vectors)
+            vectors.append(sequence_embeddings / np.linalg.norm(sequence_embeddings))
+
+    return vectors
+
 if __name__ == "__main__":
 
-    print len(embeddings)
+    print(len(get_embeddings()))
 
 
 
@@ -3,14 +3,17 @@
 #
 #  https://groups.google.com/forum/#!searchin/word2vec-toolkit/python/word2vec-toolkit/GFNZkoDPd0g/7EJ2If34gjAJ
 #
+#  The .bin file is converted once into a vocabulary file (one word per line)
+#  and a single float32 matrix (.npy), which is memory-mapped when needed.
+#  Forked workers share the mapped matrix through the page cache.
+#
 
 
 import os
+import mmap
 import numpy as np
 import sys
 
-from collections import defaultdict
-
 CLINER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), *["..", "..", ".."])
 FEATURES_DIR = os.path.join(CLINER_DIR, *["cliner", "features_dir"])
 
@@ -20,127 +23,177 @@ import read_config
 
 embeddings = None
 
-def load_bin(fname, bin_mode=False):
 
-    word_vecs = {}
-    print '\n\tloading word2vec embeddings'
+def convert_bin(fname, prefix, bin_mode=True):
+    """
+    convert word2vec output into <prefix>.vocab and <prefix>.npy
+
+    fname:    word2vec vectors (binary or text format)
+    prefix:   path (without extension) of the converted files
+    bin_mode: whether fname is in word2vec's binary format
+    """
+
+    print('\n\tconverting word2vec embeddings')
 
-    if bin_mode is True:
-        with open(fname, "rb") as f:
-            header = f.readline()
+    with open(fname, "rb") as f:
 
-            vocab_size, layer1_size = map(int, header.split())
+        header = f.readline()
+        vocab_size, layer1_size = map(int, header.split())
 
-            print "\n\tvocab size: {}".format(vocab_size)
+        print("\n\tvocab size: {}".format(vocab_size))
+
+        # write vectors straight into the (memory-mapped) output matrix
+        matrix = np.lib.format.open_memmap(prefix + '.npy.tmp', mode='w+',
+                                           dtype='float32',
+                                           shape=(vocab_size, layer1_size))
+        words = []
+
+        if bin_mode is True:
 
             binary_len = np.dtype('float32').itemsize * layer1_size
 
-            i = 0
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            pos = len(header)
 
-            for line in xrange(vocab_size):
+            for i in range(vocab_size):
 
-                i += 1
+                end = data.find(b' ', pos)
 
-                if (i%(vocab_size/20)) == 0:
-                    print '\t\t%5.1f%%' % (100*float(i)/vocab_size)
+                words.append(data[pos:end].strip(b'\n').decode('utf-8', 'replace'))
+                matrix[i] = np.frombuffer(data, dtype='float32',
+                                          count=layer1_size, offset=end + 1)
 
-                word = []
+                pos = end + 1 + binary_len
 
-                while True:
+            data.close()
 
-                    ch = f.read(1)
+        else:
 
-                    if ch == ' ':
+            # formatting per line, minus the header, is word <1st value> <2nd value> .... < nth value> where n is size of vector
 
-                        word = ''.join(word)
-                        break
+            for i, line in enumerate(f):
 
-                    if ch != '\n':
-                        word.append(ch)
+                line = line.rstrip().split(b' ')
 
-#                print word
-                word_vecs[word] = np.fromstring(f.read(binary_len), dtype='float32')
+                words.append(line[0].decode('utf-8', 'replace'))
+                matrix[i] = np.array(line[1:layer1_size + 1], dtype='float32')
 
-    else:
+        matrix.flush()
+        del matrix
 
-        # formatting per line, minus the header, is word <1st value> <2nd value> .... < nth value> where n is size of vector
+    with open(prefix + '.vocab.tmp', 'w', encoding='utf-8') as f:
+        for word in words:
+            f.write(word + '\n')
 
-        with open(fname, "rb") as f:
+    # rename last, so a partial conversion is never picked up
+    os.replace(prefix + '.npy.tmp', prefix + '.npy')
+    os.replace(prefix + '.vocab.tmp', prefix + '.vocab')
 
-            header = f.readline()
+    print('\n\tword2vec embeddings complete')
 
-            vocab_size, vector_size  = map(int, header.split())
 
-            print "\n\t vocab size {}".format(vocab_size)
-            print "\t vectorize size".format(vector_size)
+class Embeddings(object):
+    """
+    word -> vector lookups backed by a memory-mapped float32 matrix.
 
-            for i, line in enumerate(f):
+    unknown words get a (nearly) zero vector, like the old defaultdict.
+    """
 
-                if (i%(vocab_size/20)) == 0:
-                    print '\t\t%5.1f%%' % (100*float(i)/vocab_size)
+    def __init__(self, prefix):
 
-                line = line.split(' ')
+        with open(prefix + '.vocab', encoding='utf-8') as f:
+            words = f.read().split('\n')[:-1]
 
-                word = line[0]
-                vector = map(float, line[1:-1])
+        # row -> word, and word -> row (for repeated words, the last row wins)
+        self.words = words
+        self.vocab = {word: i for i, word in enumerate(words)}
 
-                assert len(vector) == vector_size
+        self.matrix = np.load(prefix + '.npy', mmap_mode='r')
+        self.dim = self.matrix.shape[1]
 
-                word_vecs[word] = vector
+        self.default = np.array([.0000000000000000000000000001] * self.dim, dtype='float32')
 
-    print '\n\tword2vec embeddings complete'
-    return word_vecs
+    def __len__(self):
+        return len(self.vocab)
 
+    def __iter__(self):
+        return iter(self.vocab)
 
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def index(self, word):
+        """ row of the word in the matrix (-1 when unknown) """
+        return self.vocab.get(word, -1)
+
+    def vectors(self, indices):
+        """ (copied) rows of the matrix for a list of indices """
+        return np.array(self.matrix[indices], dtype='float32')
+
+    def __getitem__(self, word):
+        i = self.vocab.get(word, -1)
+        if i < 0:
+            return self.default.copy()
+        return np.array(self.matrix[i], dtype='float32')
+
+
+def get_embeddings():
+    """ load (memory-map) the embeddings the first time they are needed """
+
+    global embeddings
 
-if embeddings is None:
+    if embeddings is None:
 
-    # Load word vectors
-    vectors_bin = read_config.enabled_modules()["WORD2VEC"]
+        vectors_bin = read_config.enabled_modules()["WORD2VEC"]
+        prefix = os.path.splitext(vectors_bin)[0]
 
-    pretrained = load_bin(vectors_bin, bin_mode=True)
+        # convert the .bin the first time it is used
+        if not (os.path.exists(prefix + '.npy') and os.path.exists(prefix + '.vocab')):
+            convert_bin(vectors_bin, prefix, bin_mode=True)
 
-    # be able to handle OOV by giving them 0 vectors
-    embeddings = defaultdict(lambda:np.zeros(len(pretrained.values()[0])))
-    embeddings = defaultdict(lambda:np.array([.0000000000000000000000000001]*len(pretrained.values()[0])))
-    embeddings.update(pretrained)
+        embeddings = Embeddings(prefix)
 
-    print "\tsuccessfully loaded word2vec embeddings\n"
+        print("\tsuccessfully loaded word2vec embeddings\n")
+
+    return embeddings
 
 
 def cosine_similarity(x, y):
     return (np.inner(x,y) / (np.linalg.norm(x) * np.linalg.norm(y)))
 
+
+def compute_similarity_scores(vector):
+    """ cosine similarity of vector with every embedding (one matrix product) """
+
+    matrix = get_embeddings().matrix
+
+    return np.dot(matrix, vector) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector))
+
+
 def get_word_from_vec(vector):
 
-    global embeddings
+    embeddings = get_embeddings()
 
     # TODO: hacky
     if len(vector) != 300:
         exit("wrong dimensionality, should be 300")
 
-    similarity_measures = {}
-
-    map(lambda word: similarity_measures.update({word: cosine_similarity(vector, embeddings[word])}), embeddings)
-
-    return max(embeddings.keys(), key=lambda k:similarity_measures[k])
+    return embeddings.words[int(np.argmax(compute_similarity_scores(vector)))]
 
 
 def compute_similarity_score(vector):
 
-    global embeddings
+    embeddings = get_embeddings()
 
     # TODO: hacky
     if len(vector) != 300:
         exit("wrong dimensionality, should be 300")
 
-    similarity_measures = {}
-
-    map(lambda word: similarity_measures.update({word: cosine_similarity(vector, embeddings[word])}), embeddings)
+    scores = compute_similarity_scores(vector)
 
-    sorted_candidates = sorted(zip(similarity_measures.keys(), similarity_measures.values()), key=lambda x: x[1])
+    sorted_candidates = [(word, scores[i]) for word, i in embeddings.vocab.items()]
 
-    sorted_candidates.reverse()
+    sorted_candidates.sort(key=lambda x: x[1], reverse=True)
 
     return sorted_candidates
 
@@ -151,3 +204,12 @@ def get_candidates(vector):
     return candidates[0:10]
 
 
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        exit("\n\tusage: %s <vectors.bin> [output prefix]\n" % sys.argv[0])
+
+    vectors_bin = sys.argv[1]
+    prefix = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(vectors_bin)[0]
+
+    convert_bin(vectors_bin, prefix, bin_mode=vectors_bin.endswith('.bin'))
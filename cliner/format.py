@@ -16,13 +16,26 @@ import argparse
 import sys
 import os
 import glob
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import multiprocessing
+from collections import namedtuple
 
-import helper
-from notes.note import Note
+from cliner import helper
+from cliner import globals_cliner
+from cliner.notes.note import Note
+from cliner.notes.abstract_note import AbstractNote
+from cliner.tools import chunked
+
+tmp_dir = tempfile.gettempdir()
 
-import tempfile
 
-tmp_dir = '/tmp'
+# A text file and its annotations (file paths, or contents read from an archive)
+Document = namedtuple('Document', ['name', 'extension', 'txt', 'ann', 'inline'])
+
 
 def create_filename(odir, bfile, extension):
     fname = os.path.basename(bfile) + extension
@@ -30,6 +43,349 @@ def create_filename(odir, bfile, extension):
 
 
 
+def output_path(odir, name, extension):
+    """ path for a document's output (keeps its relative path under odir) """
+    name = os.path.normpath(name)
+    if os.path.isabs(name) or (name.split(os.sep)[0] == os.pardir):
+        raise Exception('Refusing to write outside of output directory: %s' % name)
+    return os.path.join(odir, name + extension)
+
+
+
+def input_format(extension):
+    """ data format of an annotation file extension (None if unsupported) """
+    for f,ext in Note.dictOfFormatToExtensions().items():
+        if ext == extension:
+            return f
+    return None
+
+
+
+def convertible_formats():
+    """ data formats that can be converted to (they can read standard data) """
+    return [ f for f in Note.supportedFormats()
+             if Note.derivedClass(f).read_standard is not AbstractNote.read_standard ]
+
+
+
+def convert(txt, annotations, in_format, out_format, name=None):
+    """
+    convert()
+
+    Purpose: Convert one annotated file from one data format to another
+
+    @param txt.         path to the text file
+    @param annotations. path to the annotation file (in format in_format)
+    @param in_format.   data format of the annotations
+    @param out_format.  data format to convert to
+    @param name.        document name (defaults to the text file's name)
+    @return             <string> of the annotations in out_format
+    """
+
+    if out_format not in convertible_formats():
+        raise Exception('Cannot convert to format: %s' % out_format)
+
+    # Read input data into note object
+    in_note = Note(in_format)
+    in_note.read(txt,annotations)
+
+
+    # Convert data to standard format
+    internal_output = in_note.write_standard()
+
+    os_handle,tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="format_temp")
+    with os.fdopen(os_handle, 'w') as f:
+        f.write(internal_output)
+
+    try:
+        # Read internal standard data into new file with given output format
+        out_note = Note(out_format)
+        out_note.read_standard(txt,tmp_file)
+
+        # Semeval annotations name the file they belong to
+        if out_format == 'semeval':
+            out_note.setFileName(os.path.basename(name or txt))
+
+        return out_note.write()
+
+    finally:
+        # Clean up
+        os.remove(tmp_file)
+
+
+
+##################################################################
+####                     Bulk conversion                      ####
+##################################################################
+
+
+def documents(path):
+    """
+    documents()
+
+    Purpose: Stream the (text, annotation) pairs in a directory, tar or zip
+
+    @param path. directory, tar archive (optionally compressed) or zip archive
+    @return      <generator> of Document tuples
+    """
+    if os.path.isdir(path):
+        return directory_documents(path)
+    elif zipfile.is_zipfile(path):
+        return zip_documents(path)
+    elif tarfile.is_tarfile(path):
+        return tar_documents(path)
+    else:
+        raise Exception('Cannot read documents from %s (not a directory, tar or zip)' % path)
+
+
+
+def split_member(name):
+    """ archive member or file name -> (pairing key, extension) """
+    key,ext = os.path.splitext(name)
+    return key, ext[1:]
+
+
+
+def directory_documents(dirname):
+    """ pairs of files in a directory tree (passed along as paths, named by relative path) """
+
+    extensions = set(Note.supportedFormatExtensions())
+
+    for root,dirs,files in os.walk(dirname):
+        dirs.sort()
+
+        txt_files = {}
+        ann_files = {}
+        for fname in sorted(files):
+            key,ext = split_member(fname)
+            if ext == 'txt':
+                txt_files[key] = os.path.join(root, fname)
+            elif ext in extensions:
+                ann_files[key] = (ext, os.path.join(root, fname))
+
+        for key in sorted(txt_files):
+            if key in ann_files:
+                ext,ann = ann_files[key]
+                name = os.path.relpath(os.path.join(root, key), dirname)
+                yield Document(name, ext, txt_files[key], ann, False)
+
+
+
+def tar_documents(path):
+    """ pairs of members in a tar archive (read sequentially, never extracted) """
+
+    extensions = set(Note.supportedFormatExtensions())
+
+    # Members seen whose partner has not been read yet
+    pending = {}
+
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            key,ext = split_member(member.name)
+            if (ext != 'txt') and (ext not in extensions):
+                continue
+
+            contents = tar.extractfile(member).read()
+
+            # Wait for the partner (a text file pairs with an annotation file)
+            other = pending.get(key)
+            if (other is None) or ((other[0] == 'txt') == (ext == 'txt')):
+                pending[key] = (ext, contents)
+                continue
+            del pending[key]
+
+            # Pair text with annotations (in whichever order they came)
+            if ext == 'txt':
+                (ext, ann), txt = other, contents
+            else:
+                txt, ann = other[1], contents
+            yield Document(key, ext, txt, ann, True)
+
+
+
+def zip_documents(path):
+    """ pairs of members in a zip archive (each read when it is needed) """
+
+    extensions = set(Note.supportedFormatExtensions())
+
+    with zipfile.ZipFile(path) as archive:
+
+        txt_members = {}
+        ann_members = {}
+        for name in archive.namelist():
+            key,ext = split_member(name)
+            if ext == 'txt':
+                txt_members[key] = name
+            elif ext in extensions:
+                ann_members[key] = (ext, name)
+
+        for key in sorted(txt_members):
+            if key in ann_members:
+                ext,ann = ann_members[key]
+                yield Document(key, ext,
+                               archive.read(txt_members[key]),
+                               archive.read(ann), True)
+
+
+
+# Scratch directory for documents read from archives (made by bulk_convert)
+scratch_dir = None
+
+def convert_document(job):
+    """
+    convert_document()
+
+    Purpose: Convert one Document (run inside the worker processes)
+
+    @param job. (Document, output format)
+    @return     (name, converted annotations or None, error message, seconds)
+    """
+    doc,out_format = job
+    init_time = time.time()
+
+    in_format = input_format(doc.extension)
+
+    try:
+        if doc.inline:
+            # Note readers take file paths (one pair of scratch files per process)
+            txt = os.path.join(scratch_dir, '%d.txt' % os.getpid())
+            ann = os.path.join(scratch_dir, '%d.%s' % (os.getpid(), doc.extension))
+            with open(txt, 'wb') as f:
+                f.write(doc.txt)
+            with open(ann, 'wb') as f:
+                f.write(doc.ann)
+        else:
+            txt,ann = doc.txt,doc.ann
+
+        out = convert(txt, ann, in_format, out_format, doc.name + '.txt')
+        return doc.name, out, None, time.time() - init_time
+
+    # (note readers exit() on some malformed input, which must not kill a worker)
+    except (Exception, SystemExit) as e:
+        return doc.name, None, '%s: %s' % (type(e).__name__, e), time.time() - init_time
+
+
+
+class Timer:
+    """ Accumulate the time spent in each stage of the conversion """
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def timed(self, stage, iterable):
+        """ wrap an iterable, charging the time spent producing items to stage """
+        iterator = iter(iterable)
+        while True:
+            init_time = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.time() - init_time)
+                return
+            self.add(stage, time.time() - init_time)
+            yield item
+
+
+
+def bulk_convert(path, out_dir, out_format, processes=1, batch_size=500):
+    """
+    bulk_convert()
+
+    Purpose: Convert every annotated document in a directory or archive
+
+    @param path.       directory, tar or zip of text & annotation files
+    @param out_dir.    directory to write the converted annotations to
+    @param out_format. data format to convert to
+    @param processes.  number of processes to convert with
+    @param batch_size. number of converted documents to write at a time
+    @return            (number converted, list of (name,error) failures)
+    """
+
+    global scratch_dir
+
+    if out_format not in convertible_formats():
+        raise Exception('Cannot convert to format: %s' % out_format)
+
+    helper.mkpath(out_dir)
+    extension = '.' + Note.dictOfFormatToExtensions()[out_format]
+
+    # (made before the pool, so every worker knows where it is)
+    scratch_dir = tempfile.mkdtemp(dir=tmp_dir, prefix='cliner-format-')
+
+    timer = Timer()
+    init_time = time.time()
+
+    # Stream documents in (reading from disk/archive is the 'read' stage)
+    jobs = ((doc,out_format) for doc in timer.timed('read', documents(path)))
+
+    if processes > 1:
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        results = pool.imap_unordered(convert_document, jobs, chunksize=16)
+    else:
+        pool = None
+        results = map(convert_document, jobs)
+
+    converted = 0
+    failures = []
+    written = set()
+
+    try:
+        # Results are read in (and written out) a batch at a time
+        for batch in chunked(results, batch_size):
+
+            for name,out,error,seconds in batch:
+                timer.add('convert', seconds)
+
+            write_time = time.time()
+            for name,out,error,seconds in batch:
+                if error is None and name in written:
+                    error = 'duplicate document name'
+                if error is None:
+                    try:
+                        out_path = output_path(out_dir, name, extension)
+                    except Exception as e:
+                        error = str(e)
+                if error is not None:
+                    failures.append( (name,error) )
+                    continue
+                written.add(name)
+                helper.mkpath(os.path.dirname(out_path))
+                with open(out_path, 'w') as f:
+                    f.write(out)
+                converted += 1
+            timer.add('write', time.time() - write_time)
+
+            if globals_cliner.verbosity > 0:
+                print('\tconverted %d documents' % converted, file=sys.stderr)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    # Report per-stage timing and throughput
+    total = time.time() - init_time
+    print('\n\tconverted %d documents (%d failed) in %.2fs (%.1f documents/s)'
+          % (converted, len(failures), total, converted / max(total, 1e-9)),
+          file=sys.stderr)
+    for stage in ('read', 'convert', 'write'):
+        note = ' (summed over %d processes)' % processes if (stage == 'convert' and processes > 1) else ''
+        print('\t\t%-8s %.2fs%s' % (stage, timer.seconds.get(stage, 0.0), note),
+              file=sys.stderr)
+    for name,error in failures:
+        print('\t\tfailed: %s (%s)' % (name, error), file=sys.stderr)
+
+    return converted, failures
+
+
+
 def main():
 
     # Argument Parser
@@ -45,6 +401,12 @@ def main():
         help = "The files that contain the labels for the training examples",
     )
 
+    parser.add_argument("-i",
+        dest = "input",
+        default = None,
+        help = "Directory, tar or zip of text and annotation files to convert in bulk",
+    )
+
     parser.add_argument("-o",
         dest = "out",
         default = None,
@@ -53,7 +415,21 @@ def main():
 
     parser.add_argument("-f",
         dest = "format",
-        help = "Output format (%s)"%str(' or '.join(Note.supportedFormats())),
+        help = "Output format (%s)"%str(' or '.join(convertible_formats())),
+    )
+
+    parser.add_argument("-processes",
+        dest = "processes",
+        type = int,
+        default = globals_cliner.processes,
+        help = "Number of processes to convert with (bulk conversion)",
+    )
+
+    parser.add_argument("-batch",
+        dest = "batch",
+        type = int,
+        default = 500,
+        help = "Number of converted documents to write at a time (bulk conversion)",
     )
 
     # Parse the command line arguments
@@ -67,68 +443,65 @@ def main():
     format      = args.format
 
 
+    # Ensure output format is specified
+    if (not format) or (format not in convertible_formats()):
+        print('\n\tError: Must specify supported output format', file=sys.stderr)
+        print('\t\t(%s)' %str(' or '.join(convertible_formats())), file=sys.stderr)
+        print('', file=sys.stderr)
+        exit(3)
+
+
+    # Bulk conversion
+    if args.input:
+        if not os.path.exists(args.input):
+            print('\n\tError: Given input does not exist', file=sys.stderr)
+            print('', file=sys.stderr)
+            exit(1)
+        if not out_file:
+            print('\n\tError: Must supply output directory for bulk conversion', file=sys.stderr)
+            print('', file=sys.stderr)
+            exit(1)
+
+        bulk_convert(args.input, out_file, format,
+                     processes=max(1, args.processes),
+                     batch_size=max(1, args.batch))
+        return
+
+
     # Ensure annotations are specified
     if not txt:
-        print >>sys.stderr, '\n\tError: Must supply text file'
-        print >>sys.stderr
+        print('\n\tError: Must supply text file', file=sys.stderr)
+        print('', file=sys.stderr)
         exit(1)
     elif not os.path.exists(txt):
-        print >>sys.stderr, '\n\tError: Given text file does not exist'
-        print >>sys.stderr
+        print('\n\tError: Given text file does not exist', file=sys.stderr)
+        print('', file=sys.stderr)
         exit(1)
 
     # Ensure annotations are specified
     extensions = Note.supportedFormatExtensions()
     if not annotations:
-        print >>sys.stderr, '\n\tError: Must supply annotations'
-        print >>sys.stderr
+        print('\n\tError: Must supply annotations', file=sys.stderr)
+        print('', file=sys.stderr)
         exit(2)
-    elif not os.path.exists(txt):
-        print >>sys.stderr, '\n\tError: Given annotation file does not exist'
-        print >>sys.stderr
+    elif not os.path.exists(annotations):
+        print('\n\tError: Given annotation file does not exist', file=sys.stderr)
+        print('', file=sys.stderr)
         exit(2)
     elif os.path.splitext(annotations)[1][1:] not in extensions:
-        print >>sys.stderr, '\n\tError: annotation must be a supported format'
-        print >>sys.stderr, '\t\t(.%s)' %str(' or .'.join(extensions) )
-        print >>sys.stderr
+        print('\n\tError: annotation must be a supported format', file=sys.stderr)
+        print('\t\t(.%s)' %str(' or .'.join(extensions) ), file=sys.stderr)
+        print('', file=sys.stderr)
         exit(2)
 
-    # Ensure output format is specified
-    if (not format) or (format not in Note.supportedFormats()):
-        print >>sys.stderr, '\n\tError: Must specify supported output format'
-        print >>sys.stderr, '\t\t(%s)' %str(' or '.join(Note.supportedFormats()))
-        print >>sys.stderr
-        exit(3)
-
 
     # Automatically find the input file format
-    in_extension =  os.path.splitext(annotations)[1][1:]
-    for f,ext in Note.dictOfFormatToExtensions().items():
-        if ext == in_extension:
-            in_format = f
-
-    # Read input data into note object
-    in_note = Note(in_format)
-    in_note.read(txt,annotations)
-
-
-    # Convert data to standard format
-    internal_output = in_note.write_standard()
-
-    os_handle,tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="format_temp")
-    with open(tmp_file, 'w') as f:
-        f.write(internal_output)
-    os.close(os_handle)
-
-    #print internal_output
-
-    # Read internal standard data into new file with given output format
-    out_note = Note(format)
-    out_note.read_standard(txt,tmp_file)
+    in_format = input_format(os.path.splitext(annotations)[1][1:])
 
+    # Convert
+    out = convert(txt, annotations, in_format, format)
 
     # Output data
-    out = out_note.write()
     if out_file:
         with open(out_file, 'w') as out_f:
             out_f.write(out)
@@ -136,12 +509,6 @@ def main():
         sys.stdout.write(out)
 
 
-    # Clean up
-    os.remove(tmp_file)
-    if out_file:
-        out_f.close()
-
-
 
 if __name__ == '__main__':
     main()
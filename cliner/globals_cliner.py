@@ -8,3 +8,12 @@
 
 
 verbosity = 2
+
+# Number of processes to extract features with
+processes = 1
+
+# Number of JVM gateways to run the dependency parser on
+parser_gateways = 1
+
+# Most chunk occurrences to fit the WORD2VEC chunk clusters on
+cluster_sample_size = 100000
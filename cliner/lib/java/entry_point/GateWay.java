@@ -16,7 +16,13 @@ class GateWay {
 
     public static void main(String[] args) {
 
-        GatewayServer gatewayServer = new GatewayServer(new EntryPoint());
+        // optional port argument, so several gateways can run side by side
+        int port = GatewayServer.DEFAULT_PORT;
+        if (args.length > 0) {
+            port = Integer.parseInt(args[0]);
+        }
+
+        GatewayServer gatewayServer = new GatewayServer(new EntryPoint(), port);
         gatewayServer.start();
 //        System.out.println("Gateway Server Started");
 
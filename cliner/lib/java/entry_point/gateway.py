@@ -1,11 +1,15 @@
-
 import os
 import subprocess
 import time
 import signal
+import socket
+import tempfile
+import threading
 import atexit
+import fcntl
+import weakref
 
-from py4j.java_gateway import GatewayClient
+from py4j.java_gateway import JavaGateway, GatewayParameters, DEFAULT_PORT
 
 gateway_runner = os.environ["CLINER_DIR"] + "/cliner/lib/java/entry_point/runner.sh"
 
@@ -25,41 +29,200 @@ ENTRY_POINT_DEPENDENCIES=":{}".format(os.path.join(ENTRY_POINT_DIR, "*"))
 DEPENDENCIES = ENTRY_POINT_DIR + PY4J_DEPENDENCIES + METAMAP_DEPENDENCIES + NORMAPI_DEPENDENCIES + STANFORD_DEPENDENCIES
 
 devnull = open(os.devnull,"wb")
+
+
+def port_open(port, host="127.0.0.1"):
+    """ is something accepting connections on a port? """
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+def retry(func, timeout=60, first_delay=10, max_delay=1000, message="timed out"):
+    """
+    call func until it returns a value other than None (or stops raising),
+    backing off exponentially between attempts.
+
+    first_delay and max_delay are in milliseconds. exits after timeout seconds.
+    """
+
+    init_time = time.time()
+    delay = first_delay
+
+    while True:
+
+        try:
+            result = func()
+            if result is not None:
+                return result
+        except Exception:
+            pass
+
+        if (time.time() - init_time) > timeout:
+            exit(message)
+
+        time.sleep(delay / 1000.0)
+        delay = min(2 * delay, max_delay)
+
+
 class GateWayServer(object):
     """
         creates the py4j gateway to allow access to jvm objects.
-        only one gateway server may be running at a time on a specific port.
+
+        only one gateway server may be running at a time on a specific port,
+        so a gateway that is already accepting connections (started by another
+        process, ex. a parent of forked workers) is shared instead of launched.
     """
 
-    server = None
+    # port -> gateway server process (only the ones launched by this process)
+    servers = {}
+
+    # port -> pid that launched its server (forked children do not own it)
+    launchers = {}
+
+    # port -> {key: function} called after the gateway on that port is restarted
+    # (bound methods are held weakly, so dead instances drop out on their own)
+    restart_hooks = {}
+
+    # command used to start a gateway (can be replaced by a stub for testing)
+    command = ["java", "-cp", DEPENDENCIES, "gateway.GateWay"]
+
+    lock = threading.Lock()
 
     def __init__(self):
         pass
 
     @staticmethod
-    def launch_gateway():
+    def launch_gateway(port=DEFAULT_PORT, timeout=60):
+        """ make sure a gateway is running on port, and wait until it is ready """
 
-        if GateWayServer.server is None:
-            GateWayServer.server = subprocess.Popen(["java", "-cp", DEPENDENCIES, "gateway.GateWay"], stdout=devnull, stderr=subprocess.STDOUT)
+        with GateWayServer.lock, GateWayServer._host_lock(port):
 
+            if port_open(port):
+                return
+
+            server = GateWayServer.servers.get(port)
+            if server is None or server.poll() is not None:
+                GateWayServer.servers[port] = subprocess.Popen(GateWayServer.command + [str(port)], stdout=devnull, stderr=subprocess.STDOUT, start_new_session=True)
+                GateWayServer.launchers[port] = os.getpid()
+
+            # readiness: the server only opens its port once the EntryPoint is built
+            def ready():
+                if GateWayServer.servers[port].poll() is not None:
+                    raise SystemExit("gateway on port %d exited during startup" % port)
+                return port_open(port) or None
+
+            try:
+                retry(ready, timeout, message="Could not start gateway on port %d" % port)
+            except SystemExit:
+                GateWayServer.stop(port)
+                raise
+
+    @staticmethod
+    def connect(port=DEFAULT_PORT, timeout=60):
+        """ launch (if needed) and connect to the gateway on port """
+
+        GateWayServer.launch_gateway(port, timeout)
+
+        def gateway():
+            gateway = JavaGateway(gateway_parameters=GatewayParameters(port=port, eager_load=True))
+            return gateway
+
+        return retry(gateway, timeout, message="Could not connect to gateway on port %d" % port)
+
+    @staticmethod
+    def healthy(port=DEFAULT_PORT):
+        """ is the gateway on port up and accepting connections? """
+        server = GateWayServer.servers.get(port)
+        if server is not None and server.poll() is not None:
+            return False
+        return port_open(port)
+
+    @staticmethod
+    def add_restart_hook(port, hook, key=None):
+        """
+        call hook() whenever the gateway on port is restarted (ex. to reconnect).
+
+        registering again with the same key replaces the earlier hook.
+        """
+        if key is None:
+            key = hook
+        if hasattr(hook, "__self__"):
+            ref = weakref.WeakMethod(hook)
+        else:
+            ref = lambda: hook
+        GateWayServer.restart_hooks.setdefault(port, {})[key] = ref
+
+    @staticmethod
+    def remove_restart_hook(port, key):
+        """ stop calling the hook registered on port under key """
+        GateWayServer.restart_hooks.get(port, {}).pop(key, None)
+
+    @staticmethod
+    def restart(port=DEFAULT_PORT, timeout=60):
+        """ stop the gateway on port (if this process launched it) and start a new one """
+
+        GateWayServer.stop(port)
+        GateWayServer.launch_gateway(port, timeout)
+
+        hooks = GateWayServer.restart_hooks.get(port, {})
+        for key, ref in list(hooks.items()):
+            hook = ref()
+            if hook is None:
+                del hooks[key]
+            else:
+                hook()
+
+    @staticmethod
+    def stop(port=DEFAULT_PORT):
+
+        server = GateWayServer.servers.pop(port, None)
+        launcher = GateWayServer.launchers.pop(port, None)
+
+        if launcher != os.getpid():
+            return
+
+        if server is not None and server.poll() is None:
+            os.killpg(server.pid, signal.SIGKILL)
+            server.wait()
+
+    @staticmethod
+    def _host_lock(port):
+        """ lock file, so parallel processes do not race to launch the same gateway """
+        return _FileLock(os.path.join(tempfile.gettempdir(), "cliner-gateway-%d.lock" % port))
 
     @staticmethod
     @atexit.register
     def cleanup():
 
-        if GateWayServer.server is not None:
-            os.kill(GateWayServer.server.pid, signal.SIGKILL)
-            GateWayServer.server = None
-            devnull.close()
+        for port in list(GateWayServer.servers):
+            GateWayServer.stop(port)
 
     def __del__(self):
         pass
 
+
+class _FileLock(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, "w")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
 if __name__ == "__main__":
 
-    print "nothing to do in main"
+    print("nothing to do in main")
     GateWayServer.launch_gateway()
 
     while True:
         pass
-
@@ -151,6 +151,20 @@ public class MetaMap {
         return formatResults(results);
     }
 
+    // lookup many phrases in one call (one line of output per phrase)
+    public String getCuisBatch(List<String> args) throws Exception
+    {
+
+        StringBuilder retStr = new StringBuilder();
+
+        for (String arg : args) {
+            retStr.append(getCuis(arg));
+        }
+
+        return retStr.toString();
+
+    }
+
     public String formatResults(Vector<String> results) {
 
         String retStr = results.elementAt(0);
@@ -1,10 +1,8 @@
 
-from subprocess import check_output
-from py4j.java_gateway import JavaGateway, Py4JNetworkError
+from py4j.java_collections import ListConverter
 
 from metamap_server_launcher import MetaMapServer
 
-import time
 import sys
 import os
 import re
@@ -18,86 +16,87 @@ sys.path.append(gateway_dir)
 
 from gateway import GateWayServer
 
-from socket import error
-
 class MetaMap(object):
 
     def __init__(self):
 
         MetaMapServer.start_server()
-        # launches java gateway server.
-        GateWayServer.launch_gateway()
-
-        init_time = time.time()
-
-        while True:
-
-            try:
 
-                self.gateway = JavaGateway(eager_load=True)
-                self.metamap = self.gateway.entry_point.getMetaMapObj()
+        # launches java gateway server (or shares the one already running).
+        self.gateway = GateWayServer.connect()
+        self.metamap = self.gateway.entry_point.getMetaMapObj()
 
-            except:
 
-                if (time.time() - init_time) > 60:
-                    exit("Could not load necessary dependencies...")
-                else:
-                    time.sleep(5)
-                    continue
+    def getConceptIds(self, phrase):
+        """
+        performs a cui lookup on a phrase using metamap java api.
+        """
 
-            break
+        return self.getConceptIdsBatch([phrase])
 
 
-    def getConceptIds(self, phrase):
+    def getConceptIdsBatch(self, phrases, batch_size=100):
         """
-        performs a cui lookup on a phrase using metamap java api.
+        performs a cui lookup on many phrases using metamap java api.
+
+        phrases are sent to the gateway batch_size at a time (instead of one
+        call per phrase). returns one result per phrase, in the same order.
         """
 
-        phrase = re.sub("\n", "", phrase)
+        phrases = [re.sub("\n", "", phrase) for phrase in phrases]
 
         retVal = []
 
-        output = self.metamap.getCuis(phrase)
+        for i in range(0, len(phrases), batch_size):
+
+            batch = phrases[i:i+batch_size]
 
-        results = output.split('\n')[:-1]
+            java_batch = ListConverter().convert(batch, self.gateway._gateway_client)
 
-        results = [line.split('&&') for line in results]
+            output = self.metamap.getCuisBatch(java_batch)
 
-        if len(results) != 1:
+            results = output.split('\n')[:-1]
 
-            print len(results)
+            if len(results) != len(batch):
 
-            print "phrase: ", phrase
-            print "results: ", results
+                print(len(results))
 
-            exit("error")
+                print("phrases: ", batch)
+                print("results: ", results)
 
-        for candidates in results:
+                exit("error")
 
-            mappings = {}
+            for phrase, line in zip(batch, results):
+                retVal.append(parse_cuis(phrase, line))
 
-            norm_phrases = set()
+        return retVal
 
-            for candidate in candidates:
 
-                candidate = candidate.split('|')
+def parse_cuis(phrase, line):
+    """
+    parses one line of MetaMap.getCuis() output into the candidate mappings.
+    """
 
-                norm = candidate[1]
-                name = candidate[3]
-                cui  = candidate[5]
+    mappings = {}
 
-                norm_phrases.add(norm)
+    norm_phrases = set()
 
-                if name in mappings:
-                    mappings[name].add(cui)
-                else:
-                    mappings[name] = set([cui])
+    for candidate in line.split('&&'):
 
-            retVal.append({"norms":norm_phrases, "text":phrase, "mappings":mappings})
+        candidate = candidate.split('|')
 
-        assert(len(retVal) == 1)
+        norm = candidate[1]
+        name = candidate[3]
+        cui  = candidate[5]
 
-        return retVal
+        norm_phrases.add(norm)
+
+        if name in mappings:
+            mappings[name].add(cui)
+        else:
+            mappings[name] = set([cui])
+
+    return {"norms":norm_phrases, "text":phrase, "mappings":mappings}
 
 if __name__ == "__main__":
 
@@ -113,9 +112,9 @@ if __name__ == "__main__":
     phrases = ["a second glucagon shot"]
 
     for phrase in phrases[0:1]:
-        print phrase
-        print
-        print m.getConceptIds(phrase)
+        print(phrase)
+        print()
+        print(m.getConceptIds(phrase))
 
 
 # EOF
@@ -1,19 +1,31 @@
-
 import atexit
 import signal
 import os
+import sys
 import subprocess
-import time
 
 metamap_dir = os.path.join(*[os.environ["CLINER_DIR"], "cliner", "lib", "java", "metamap", "metamapBase", "public_mm", "bin"])
 
 mmserver_path = os.path.join(metamap_dir, "mmserver")
 skrmedpost_path = os.path.join(metamap_dir, "skrmedpostctl")
 
-from kill_process import kill_process_by_name
+gateway_dir = os.path.join(*[os.environ["CLINER_DIR"], "cliner", "lib", "java", "entry_point"])
+sys.path.append(gateway_dir)
+
+from gateway import port_open, retry
+
+# ports the servers accept connections on, once they are ready
+SKRMEDPOST_PORT = 1795
+MMSERVER_PORT = 8066
 
 devnull = open(os.devnull, "wb")
 class MetaMapServer():
+    """
+        starts the metamap tagger (skrmedpost) and metamap servers.
+
+        servers that are already running on this host are shared, and only
+        the servers started by this process are stopped on exit.
+    """
 
     mmserver = None
     skrmedpost = None
@@ -22,69 +34,75 @@ class MetaMapServer():
         pass
 
     @staticmethod
-    def start_server():
+    def start_server(timeout=120):
 
 #        print "\nLoading metamap..."
 
-        init_time = time.time()
-
-        MetaMapServer.execute_skrmedpost()
-
-        while True:
+        if not port_open(SKRMEDPOST_PORT):
+            MetaMapServer.execute_skrmedpost()
+            retry(lambda: port_open(SKRMEDPOST_PORT) or None, timeout,
+                  message="Could not run skrmedpost server...")
 
+        if not port_open(MMSERVER_PORT):
             MetaMapServer.execute_mmserver()
 
-            time.sleep(10)
-
-            return_code = MetaMapServer.mmserver.poll()
-
-            if return_code not in [None, 0]:
-
-                if (time.time() - init_time) > 120:
+            def ready():
+                if MetaMapServer.mmserver.poll() is not None:
+                    # exited during startup, try again
+                    MetaMapServer.mmserver = None
+                    MetaMapServer.execute_mmserver()
+                    return None
+                return port_open(MMSERVER_PORT) or None
 
-                    exit("Could not run memtap server...")
+            retry(ready, timeout, message="Could not run metamap server...")
 
-                else:
-
-                    MetaMapServer.shutdown_server()
-                    continue
+    @staticmethod
+    def healthy():
+        """ are both servers accepting connections? """
+        return port_open(SKRMEDPOST_PORT) and port_open(MMSERVER_PORT)
 
-            else:
-                break
+    @staticmethod
+    def restart(timeout=120):
+        MetaMapServer.shutdown_server()
+        MetaMapServer.start_server(timeout)
 
     @staticmethod
     def execute_skrmedpost():
 
         MetaMapServer.skrmedpost = subprocess.Popen([skrmedpost_path, "start"], stdout=devnull, stderr=subprocess.STDOUT)
+        MetaMapServer.skrmedpost.wait()
 
     @staticmethod
     def kill_skrmedpost():
 
-        MetaMapServer.skrmedpost = subprocess.Popen([skrmedpost_path, "stop"], stdout=devnull, stderr=subprocess.STDOUT)
+        if MetaMapServer.skrmedpost is not None:
+            subprocess.call([skrmedpost_path, "stop"], stdout=devnull, stderr=subprocess.STDOUT)
+            MetaMapServer.skrmedpost = None
 
     @staticmethod
     def execute_mmserver():
 
         if MetaMapServer.mmserver is None:
-            MetaMapServer.mmserver = subprocess.Popen([mmserver_path], stdout=devnull, stderr=subprocess.STDOUT)
+            # own process group, so the server and its children can be stopped together
+            MetaMapServer.mmserver = subprocess.Popen([mmserver_path], stdout=devnull, stderr=subprocess.STDOUT, start_new_session=True)
 
 
     @staticmethod
     def shutdown_server():
-        kill_process_by_name("mmserver.*")
-        os.kill(MetaMapServer.skrmedpost.pid, signal.SIGKILL)
-        MetaMapServer.mmserver = None
+
+        if MetaMapServer.mmserver is not None:
+            if MetaMapServer.mmserver.poll() is None:
+                os.killpg(MetaMapServer.mmserver.pid, signal.SIGKILL)
+                MetaMapServer.mmserver.wait()
+            MetaMapServer.mmserver = None
+
+        MetaMapServer.kill_skrmedpost()
 
     @staticmethod
     @atexit.register
     def cleanup():
 
-        # kill all user processes with the name mmserver
-        kill_process_by_name("mmserver.*")
-        os.kill(MetaMapServer.skrmedpost.pid, signal.SIGKILL)
-        MetaMapServer.mmserver = None
-        MetaMapServer.kill_skrmedpost()
-        devnull.close()
+        MetaMapServer.shutdown_server()
 
 if __name__ == "__main__":
 
@@ -92,4 +110,3 @@ if __name__ == "__main__":
 
     while True:
         pass
-
@@ -4,17 +4,10 @@
     tokenization methods.
 """
 
-from subprocess import Popen, PIPE, STDOUT
-
-from py4j.java_collections import JavaArray
-from py4j.java_gateway import JavaGateway
-
-import re
 import os
-import time
 import sys
 
-gateway_dir = os.environ["CLINER_DIR"] + "/clicon/lib/java/entry_point"
+gateway_dir = os.environ["CLINER_DIR"] + "/cliner/lib/java/entry_point"
 
 """
     for whatever reason py4j does not run unless the directory is changed
@@ -30,27 +23,9 @@ class OpenNLPTokenizer:
 
     def __init__(self):
 
-        print "calling constructor"
-
-        # launches java gateway server.
-        self.gateway_server = GateWayServer()
-
-        self.gateway = JavaGateway()
-
-        # limit how long to wait for connection to gateway to be available.
-        kill_time = 20
-        init_time = time.time()
-
-        while True:
-
-            if time.time() - init_time > kill_time:
-                exit("\ncould not establish connection to gateway...")
-
-            try:
-                self.tokenizer = self.gateway.entry_point.getOpenNlpTokenizer()
-                break
-            except:
-                continue
+        # launches java gateway server (or shares the one already running).
+        self.gateway = GateWayServer.connect(timeout=20)
+        self.tokenizer = self.gateway.entry_point.getOpenNlpTokenizer()
 
     def __del__(self):
 
@@ -92,9 +67,9 @@ class OpenNLPTokenizer:
 if __name__ == "__main__":
 
     t = OpenNLPTokenizer()
-    print t.preProcess("hello world! this is a test sentence. i hope this becomes a seperate sentence.")
-    print t.sentenize("hello world. this is a test sentence")
-    print t.tokenize("hello world!")
+    print(t.preProcess("hello world! this is a test sentence. i hope this becomes a seperate sentence."))
+    print(t.sentenize("hello world. this is a test sentence"))
+    print(t.tokenize("hello world!"))
 
 
 # EOF
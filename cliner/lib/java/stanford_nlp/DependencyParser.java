@@ -5,6 +5,7 @@ import java.util.Collection;
 import java.util.List;
 import java.io.*;
 import java.util.ArrayList;
+import java.util.Arrays;
 
 import edu.stanford.nlp.process.Tokenizer;
 import edu.stanford.nlp.process.TokenizerFactory;
@@ -143,6 +144,66 @@ public class DependencyParser {
 
     }
 
+    public String getDependencyTree(List<String> tokens)  {
+
+        /* Parse one pre-tokenized sentence, without the shared token state. */
+
+        List<CoreLabel> labels = new ArrayList<CoreLabel>();
+        List<Word> words = new ArrayList<Word>();
+
+        for (String token : tokens) {
+
+            CoreLabel label = new CoreLabel();
+            label.setWord(token);
+            label.setValue(token);
+            labels.add(label);
+
+            Word word = new Word();
+            word.setWord(token);
+            words.add(word);
+
+        }
+
+        Tree parse = lp.parse(words);
+
+        TreebankLanguagePack tlp = lp.treebankLanguagePack(); // PennTreebankLanguagePack for English
+        GrammaticalStructureFactory gsf = tlp.grammaticalStructureFactory();
+        GrammaticalStructure gs = gsf.newGrammaticalStructure(parse);
+
+        CoreMap document = new CoreLabel();
+        document.set(TokensAnnotation.class, labels);
+
+        return gs.dependenciesToCoNLLXString(gs, document);
+
+    }
+
+    public List<String> getDependencyTrees(List<String> sentences)  {
+
+        /* Parse many sentences in one call.
+           Each sentence is a string of tab separated tokens. */
+
+        List<String> trees = new ArrayList<String>();
+
+        for (String sentence : sentences) {
+            trees.add(getDependencyTree(Arrays.asList(sentence.split("\t", -1))));
+        }
+
+        return trees;
+
+    }
+
+    public List<List<String>> getNounPhraseHeadsBatch(List<String> sentences) {
+
+        List<List<String>> heads = new ArrayList<List<String>>();
+
+        for (String sentence : sentences) {
+            heads.add(getNounPhraseHeads(sentence));
+        }
+
+        return heads;
+
+    }
+
     public void addTokenToProcess(String token) {
 
         CoreLabel label = new CoreLabel();
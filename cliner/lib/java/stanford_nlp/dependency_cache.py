@@ -1,27 +1,136 @@
-import cPickle as pickle
+import pickle
+import atexit
+import fcntl
+import glob
 import os
 
-cacheDirPath = (os.environ["CLICON_DIR"]  +  "/cliner/features_dir/stanfordNLP/")
+
+cacheDirPath = os.path.dirname(os.path.abspath(__file__))
 
 class DependencyCache:
+    """
+    persistent cache of dependency parses.
+
+    keys are tokenized sentences, values are the compact dependency_group
+    dicts built by DependencyParser. other results (such as noun phrase
+    heads) are stored under their own namespace, so keys never collide.
+
+    new entries are appended to a shard file owned by the process that
+    found them (so concurrent workers never overwrite each other), and the
+    shards are merged into the main file once, when the run exits.
+    """
+
     def __init__(self):
-        print "loading cache"
+        self.filename = os.path.join(cacheDirPath, 'dependency_cache')
+        self.shard_dir = self.filename + '.shards'
+        self.cache = self._load()
+
+        # entries added since the last flush
+        self.added = {}
+
+        atexit.register(self.merge)
+
+    def _load(self):
+        cache = {}
+        for entries in self._read(self.filename):
+            cache.update(entries)
+        for shard in sorted(glob.glob(os.path.join(self.shard_dir, '*.pickle*'))):
+            for entries in self._read(shard):
+                cache.update(entries)
+        return cache
+
+    @staticmethod
+    def _read(filename):
+        """ every pickled dict in a file (shards are appended to, one dict per flush) """
+        try:
+            with open(filename, "rb") as f:
+                while True:
+                    yield pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return
+
+    def _key(self, key, namespace):
+        # parses keep their original (unprefixed) keys
+        if namespace is None:
+            return str(key)
+        return '%s:%s' % (namespace, key)
+
+    def has_key(self, key, namespace=None):
+        return self._key(key, namespace) in self.cache
+
+    def add_map(self, key, value, namespace=None):
+        key = self._key(key, namespace)
+        self.cache[key] = value
+        self.added[key] = value
+
+    def get_map(self, key, namespace=None):
+        return self.cache[ self._key(key, namespace) ]
+
+    def flush(self):
+        """
+        append new entries to this process's shard.
+
+        cheap (only the new entries are written), so it can be called after
+        each batch: forked workers are terminated without running atexit.
+        """
+        if not self.added:
+            return
+
         try:
-            self.filename = (cacheDirPath + '/dependency_cache')
-            self.cache = pickle.load( open( self.filename , "rb" ) ) ;
-        except IOError:
-            self.cache = {}
-        print "finished loading"
-    def has_key(self, key):
-        return self.cache.has_key( str(key) )
+            if not os.path.isdir(self.shard_dir):
+                os.makedirs(self.shard_dir, exist_ok=True)
+            shard = os.path.join(self.shard_dir, '%d.pickle' % os.getpid())
+            with open(shard, "ab") as f:
+                pickle.dump(self.added, f, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            return
+
+        self.added = {}
+
+    def merge(self):
+        """ fold every shard into the main cache file (once, at exit) """
+        self.flush()
+
+        if not os.path.isdir(self.shard_dir):
+            return
+
+        # one merge at a time (runs exiting together would drop each other's)
+        try:
+            with open(os.path.join(self.shard_dir, 'lock'), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._merge()
+        except (IOError, OSError):
+            return
+
+    def _merge(self):
+        # claim the shards first, so entries appended meanwhile are kept
+        claimed = []
+        for shard in glob.glob(os.path.join(self.shard_dir, '*.pickle*')):
+            if '.merging.' in shard:
+                claimed.append(shard)
+                continue
+            merging = '%s.merging.%d' % (shard, os.getpid())
+            try:
+                os.replace(shard, merging)
+                claimed.append(merging)
+            except OSError:
+                pass
 
-    def add_map(self, key, value):
-        self.cache[ str(key) ] = value
+        if not claimed:
+            return
 
-#        pickle.dump( self.cache, open( self.filename, "wb" ) )
+        cache = {}
+        for entries in self._read(self.filename):
+            cache.update(entries)
+        for shard in sorted(claimed):
+            for entries in self._read(shard):
+                cache.update(entries)
 
-    def get_map(self, key):
-        return self.cache[ str(key) ]
+        # Write then rename, so readers never see a partial file
+        tmp_filename = '%s.%d' % (self.filename, os.getpid())
+        with open(tmp_filename, "wb") as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, self.filename)
 
-    def __del__(self):
-        pickle.dump( self.cache, open( self.filename, "wb" ) )
+        for shard in claimed:
+            os.remove(shard)
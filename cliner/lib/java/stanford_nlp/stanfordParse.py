@@ -1,8 +1,9 @@
 
 from subprocess import Popen, PIPE, STDOUT
 
-from py4j.java_collections import JavaArray
-from py4j.java_gateway import JavaGateway
+from py4j.java_collections import JavaArray, ListConverter
+from py4j.java_gateway import DEFAULT_PORT
+from concurrent.futures import ThreadPoolExecutor
 
 import re
 import os
@@ -16,47 +17,126 @@ gateway_dir = os.environ["CLINER_DIR"] + "/cliner/lib/java/entry_point"
 sys.path.append(gateway_dir)
 
 from gateway import GateWayServer
+from dependency_cache import DependencyCache
 
 class DependencyParser:
 
-    def __init__(self):
+    def __init__(self, num_gateways=1, batch_size=50):
+        """
+        num_gateways: number of JVM gateways to parse with (in parallel)
+        batch_size:   number of sentences sent to a gateway per call
+        """
 
 #        print "\nLoading stanford dependency parser..."
 
-        # launches java gateway server.
-        GateWayServer.launch_gateway()
+        self.batch_size = batch_size
 
-        init_time = time.time()
+        # parses and noun phrase heads (saved across runs), by sentence
+        self.cache = DependencyCache()
 
-        while True:
+        # one (gateway, parser) per JVM, on consecutive ports
+        # (started on first use, so cached parses never need the JVM)
+        self.num_gateways = num_gateways
+        self.gateways = []
+        self.parsers = []
+
+        # reconnect if a gateway has to be restarted
+        for port in range(DEFAULT_PORT, DEFAULT_PORT + num_gateways):
+            GateWayServer.add_restart_hook(port, self._reconnect, key=id(self))
+
+
+    def close(self):
+        """ stop listening for gateway restarts (ex. before being replaced) """
+        for port in range(DEFAULT_PORT, DEFAULT_PORT + self.num_gateways):
+            GateWayServer.remove_restart_hook(port, id(self))
+
+
+    def _connect(self):
+        """ launch and connect to the gateways (only once) """
+
+        if self.parsers:
+            return
 
-            try:
+        for port in range(DEFAULT_PORT, DEFAULT_PORT + self.num_gateways):
 
-                self.gateway = JavaGateway(eager_load=True)
-                self.parser = self.gateway.entry_point.getStanfordParserObj()
+            # launches java gateway server (or shares a running one).
+            gateway = GateWayServer.connect(port)
+            parser = gateway.entry_point.getStanfordParserObj()
+
+            self.gateways.append(gateway)
+            self.parsers.append(parser)
+
+    def _reconnect(self):
+        """ drop the connections (they are reopened on next use) """
+        self.gateways = []
+        self.parsers = []
+
+    @property
+    def gateway(self):
+        self._connect()
+        return self.gateways[0]
+
+    @property
+    def parser(self):
+        self._connect()
+        return self.parsers[0]
+
+
+    def _batched_call(self, method, args):
+        """
+        call a batch method of the java parser on a list of (string) args.
+
+        args are split between the gateways, and sent batch_size at a time.
+        returns one result per arg, in order.
+        """
 
-            except:
+        if not args:
+            return []
 
-                if (time.time() - init_time) > 60:
-                    exit("Could not load dependencies...")
-                else:
-                    time.sleep(5)
-                    continue
+        self._connect()
 
-            break
+        # one contiguous slice of args per gateway
+        n = len(self.parsers)
+        size = -(-len(args) // n)
+        slices = [args[i:i + size] for i in range(0, len(args), size)]
 
+        def run(k):
+            gateway, parser = self.gateways[k], self.parsers[k]
+            results = []
+            for i in range(0, len(slices[k]), self.batch_size):
+                batch = ListConverter().convert(slices[k][i:i + self.batch_size],
+                                                gateway._gateway_client)
+                results += list(getattr(parser, method)(batch))
+            return results
+
+        if len(slices) == 1:
+            return run(0)
+
+        with ThreadPoolExecutor(max_workers=len(slices)) as pool:
+            return [result for results in pool.map(run, range(len(slices)))
+                           for result in results]
 
 
     def getNounPhraseHeads(self, string):
 
-        heads = []
+        return self.getNounPhraseHeadsBatch([string])[0]
+
+
+    def getNounPhraseHeadsBatch(self, strings):
+        """ noun phrase heads of many sentences (in as few calls as possible) """
+
+        strings = [string.lower() for string in strings]
 
-        string =  string.lower()
+        missing = list(dict.fromkeys(s for s in strings
+                                     if not self.cache.has_key(s, 'heads')))
 
-        for head in self.parser.getNounPhraseHeads(string):
-            heads.append(head)
+        for string, heads in zip(missing, self._batched_call('getNounPhraseHeadsBatch', missing)):
+            self.cache.add_map(string, [head for head in heads], 'heads')
 
-        return heads
+        if missing:
+            self.cache.flush()
+
+        return [self.cache.get_map(string, 'heads') for string in strings]
 
     def getSentenceStructure(self, string):
         return self.parser.getSentenceStructure(string)
@@ -126,10 +206,32 @@ class DependencyParser:
 
     def get_collapsed_dependencies(self, tokenized_sentence):
 
-        for token in tokenized_sentence:
-            self.addTokenToProcess(token)
+        return self.get_collapsed_dependencies_batch([tokenized_sentence])[0]
+
+
+    def get_collapsed_dependencies_batch(self, tokenized_sentences):
+        """
+        dependencies of many tokenized sentences, sending whole sentences
+        (batch_size at a time) instead of one token per call.
+        """
+
+        keys = [tuple(sentence) for sentence in tokenized_sentences]
+
+        missing = list(dict.fromkeys(k for k in keys if not self.cache.has_key(k)))
+
+        # tokens are sent tab separated (py4j only converts flat lists)
+        outputs = self._batched_call('getDependencyTrees', ['\t'.join(k) for k in missing])
+
+        for key, output_from_parser in zip(missing, outputs):
+            self.cache.add_map(key, self._dependency_group(output_from_parser))
+
+        if missing:
+            self.cache.flush()
+
+        return [self.cache.get_map(key) for key in keys]
+
 
-        output_from_parser = self._parse_string()
+    def _dependency_group(self, output_from_parser):
 
         sentence = self._process_parser_output(output_from_parser)
 
@@ -303,13 +405,13 @@ if __name__ == "__main__":
 
     d = p.get_collapsed_dependencies(["He", "ran", "to", "his classroom"])
 
-    print d
-    print p.get_related_tokens(2, ["He", "ran", "to", "his classroom"], d)
+    print(d)
+    print(p.get_related_tokens(2, ["He", "ran", "to", "his classroom"], d))
 
     d = p.get_collapsed_dependencies(["The", "man", "was", "admitted", "to", "the", "emergency room"])
 
-    print d
-    print p.get_related_tokens(6, ["The", "man", "was", "admitted", "to", "the", "emergency room"], d)
+    print(d)
+    print(p.get_related_tokens(6, ["The", "man", "was", "admitted", "to", "the", "emergency room"], d))
 
 
 # EOF
@@ -9,6 +9,8 @@
 
 import os
 import tempfile
+import itertools
+import multiprocessing
 import pycrfsuite
 
 count = 0
@@ -105,17 +107,38 @@ def train(X, Y, do_grid):
     #            print >>f, y, '\t', x.nonzero()[1][0]
     #        print >>f
 
-    # Format features fot crfsuite
-    feats = format_features(X, Y)
+    return train_batches([(X, Y)], do_grid)
+
+
+def train_batches(batches, do_grid):
+    """
+    Train on an iterable of (X,Y) batches, formatting one batch at a time.
+
+    Each batch is appended straight to the crfsuite trainer, so the
+    batches themselves can be streamed from disk. Only a grid search
+    (which trains many models) buffers the formatted sequences.
+    """
 
     # Create a Trainer object.
     trainer = pycrfsuite.Trainer(verbose=False)
-    for xseq, yseq in pycrf_instances(feats, labeled=True):
-        trainer.append(xseq, yseq)
+
+    # Format features fot crfsuite
+    instances = []
+    for X, Y in batches:
+        feats = format_features(X, Y)
+        for xseq, yseq in pycrf_instances(feats, labeled=True):
+            trainer.append(xseq, yseq)
+            if do_grid:
+                instances.append((xseq, yseq))
 
     # Set paramters
+    params = {}
     if do_grid:
-        'Grid Search not implemented yet'
+        print('\t\tperforming grid search')
+        params = grid_search(instances)
+        print('\t\tbest parameters: %s' % params)
+        instances = None
+    trainer.set_params(params)
 
     # Train the model
     os_handle, tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="crf_temp")
@@ -133,6 +156,81 @@ def train(X, Y, do_grid):
     return model
 
 
+# Search space for crfsuite's L1 (c1) and L2 (c2) regularization
+c1_range = [0.0, 0.05, 0.1, 0.5, 1.0]
+c2_range = [0.001, 0.01, 0.1, 1.0]
+
+# Instances being searched over (inherited by forked workers, not pickled)
+_grid_instances = None
+
+
+def grid_search(instances, heldout=5):
+    """
+    Choose c1 and c2 by training one CRF per setting (in parallel) and
+    scoring each on held-out sentences.
+
+    @param instances. list of (xseq,yseq) training sequences
+    @param heldout.   every heldout-th sequence is used for scoring
+    @return           <dict> of the best trainer parameters
+    """
+
+    global _grid_instances
+
+    # Not enough sentences to hold any out
+    if len(instances) < heldout:
+        return {}
+
+    candidates = [{'c1': c1, 'c2': c2}
+                  for c1, c2 in itertools.product(c1_range, c2_range)]
+
+    _grid_instances = instances
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool() as pool:
+            scores = pool.starmap(_score_params,
+                                  [(params, heldout) for params in candidates])
+    finally:
+        _grid_instances = None
+
+    return max(zip(scores, candidates), key=lambda sc: sc[0])[1]
+
+
+def _score_params(params, heldout):
+    """ F1 of non-O (label 0) tags on held-out sequences, for one setting """
+
+    trainer = pycrfsuite.Trainer(verbose=False)
+    dev = []
+    for i, (xseq, yseq) in enumerate(_grid_instances):
+        if i % heldout == 0:
+            dev.append((xseq, yseq))
+        else:
+            trainer.append(xseq, yseq)
+    trainer.set_params(params)
+
+    os_handle, tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="crf_temp")
+    os.close(os_handle)
+    try:
+        trainer.train(tmp_file)
+        tagger = pycrfsuite.Tagger()
+        tagger.open(tmp_file)
+
+        correct = predicted = gold = 0
+        for xseq, yseq in dev:
+            for pred, ref in zip(tagger.tag(xseq), yseq):
+                predicted += (pred != '0')
+                gold += (ref != '0')
+                correct += (pred == ref != '0')
+        tagger.close()
+    finally:
+        os.remove(tmp_file)
+
+    if correct == 0:
+        return 0.0
+    precision = correct / predicted
+    recall = correct / gold
+    return 2 * precision * recall / (precision + recall)
+
+
 def predict(clf, X):
 
     # Format features fot crfsuite
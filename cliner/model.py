@@ -4,7 +4,7 @@ from sklearn.feature_extraction import DictVectorizer
 
 from cliner.features_dir import features as feat_obj
 
-from cliner.features_dir.utilities import load_pickled_obj, is_prose_sentence
+from cliner.features_dir.utilities import load_pickled_obj
 from cliner.features_dir.BagOfWords import BagOfWords
 from cliner.features_dir.read_config import enabled_modules
 
@@ -14,6 +14,7 @@ from cliner.machine_learning import crf
 from cliner.notes.note import concept_labels, reverse_concept_labels
 from cliner.notes.note import IOB_labels,     reverse_IOB_labels
 from cliner.tools import flatten, save_list_structure, reconstruct_list
+from cliner.tools import chunked, FeatureShards
 
 from collections import defaultdict
 
@@ -70,19 +71,21 @@ class Model:
         assert self.cui_freq is not None
         return self.cui_freq
 
-    def train(self, notes, do_grid=False, do_third=False):
+    def train(self, notes, do_grid=False, do_third=False, feature_store=None):
         """
         Model::train()
 
         Purpose: Train a Machine Learning model on annotated data
 
-        @param notes. A list of Note objects (containing text and annotations)
-        @return       None
+        @param notes.         A list of Note objects (containing text and annotations)
+        @param feature_store. <FeatureStore> to reuse previously extracted
+                              features from (or None to always extract)
+        @return               None
         """
 
         # Extract formatted data
-        tokenized_sentences, iob_labels = first_pass_data_and_labels(notes)
-        chunks, indices, con_labels = second_pass_data_and_labels(notes)
+        tokenized_sentences, _ = first_pass_data_and_labels(notes)
+        chunks, indices, _ = second_pass_data_and_labels(notes)
 
         if enabled_modules().get('WORD2VEC', False):
 
@@ -94,16 +97,84 @@ class Model:
 
             # setting as globals within module so they don't have to be passed
             # as parameters...
-            clustering.lexical_cluster = self.seq_lex_clusters
+            clustering.lexical_clusters = self.seq_lex_clusters
             clustering.embedding_clusters = self.seq_clusters
 
+        # Extract features (reusing stored ones for unchanged notes)
+        if globals_cliner.verbosity > 0:
+            print('\textracting  features (pass one and pass two)')
+        shard = extract_training_shard(notes, feature_store)
+
+        # Vectors kept from clustering are only needed for feature extraction
+        if enabled_modules().get('WORD2VEC', False):
+            clustering.sequence_vectors.clear()
+
         # Train classifiers for 1st pass and 2nd pass
-        self.__first_train(tokenized_sentences, iob_labels, do_grid)
-        self.__second_train(chunks, indices, con_labels, do_grid)
+        self.__first_train(shard['prose'], shard['nonprose'], do_grid)
+        self.__second_train(shard['concept'], do_grid)
 
         if do_third is True:
             self.__third_train(tokenized_sentences, notes, do_grid)
 
+    def train_streaming(self, notes, do_grid=False, chunk_size=50,
+                        shard_dir=None, feature_store=None):
+        """
+        Model::train_streaming()
+
+        Purpose: Train a Machine Learning model without holding the whole
+                 corpus (or its features) in memory at once
+
+        @param notes.      An iterable of Note objects (ex. a generator that
+                           reads each note only when it is requested)
+        @param do_grid.    <boolean> whether to perform a grid search
+        @param chunk_size. <int> number of notes to extract features for at once
+        @param shard_dir.  directory to write intermediate feature shards to
+        @param feature_store. <FeatureStore> to reuse previously extracted
+                              features from (or None to always extract)
+        @return            None
+        """
+
+        # Clusters are fit over every chunk of the corpus before extraction
+        if enabled_modules().get('WORD2VEC', False):
+            raise Exception('Streaming training does not support WORD2VEC')
+
+        # Extract features chunk by chunk, spilling them to disk
+        shards = FeatureShards(shard_dir)
+        try:
+            con_classes = set()
+            for i, chunk in enumerate(chunked(notes, chunk_size)):
+                if globals_cliner.verbosity > 0:
+                    print('\textracting  features (chunk %d)' % (i + 1))
+
+                shard = extract_training_shard(chunk, feature_store)
+                con_classes.update(shard['concept'][1])
+                shards.append(shard)
+
+            if shards.num_shards == 0:
+                raise Exception('Training must have at least one note')
+
+            # Train classifiers for 1st pass and 2nd pass
+            if globals_cliner.verbosity > 0:
+                print('first pass')
+
+            pvec, pclf = self.__generic_first_train_streaming(
+                'prose', shards, do_grid)
+            nvec, nclf = self.__generic_first_train_streaming(
+                'nonprose', shards, do_grid)
+
+            self._first_prose_vec = pvec
+            self._first_nonprose_vec = nvec
+            self._first_prose_clf = pclf
+            self._first_nonprose_clf = nclf
+
+            if globals_cliner.verbosity > 0:
+                print('second pass')
+
+            self.__second_train_streaming(shards, con_classes, do_grid)
+
+        finally:
+            shards.close()
+
     def set_char_gram_maps(self, tokenized_sentences):
 
         self.skipgram_mappings = get_char_gram_mappings(
@@ -114,7 +185,8 @@ class Model:
     def set_clusters(self, chunked_sentences, chunked_indices):
 
         self.seq_clusters, self.seq_lex_clusters = get_sequence_vector_clusters(
-            chunked_sentences, chunked_indices)
+            chunked_sentences, chunked_indices,
+            sample_size=globals_cliner.cluster_sample_size)
 
         return
 
@@ -132,7 +204,7 @@ class Model:
 
             # setting as globals within module so they don't have to be passed
             # as parameters...
-            clustering.lexical_cluster = self.seq_lex_clusters
+            clustering.lexical_clusters = self.seq_lex_clusters
             clustering.embedding_clusters = self.seq_clusters
             clustering.skipgram_mappings = self.skipgram_mappings
 
@@ -142,9 +214,10 @@ class Model:
 
         # Extract formatted data
         tokenized_sentences = first_pass_data(note)
+        prose_mask = note.getProseMask()
 
         # Predict IOB labels
-        iobs = self.__first_predict(tokenized_sentences)
+        iobs = self.__first_predict(tokenized_sentences, prose_mask)
         note.setIOBLabels(iobs)
 
         # Second pass (concept labels)
@@ -183,34 +256,26 @@ class Model:
     ##           Mid-level reformats data and sends to lower level         ##
     #########################################################################
 
-    def __first_train(self, tokenized_sentences, Y, do_grid=False):
+    def __first_train(self, prose, nonprose, do_grid=False):
         """
         Model::__first_train()
 
         Purpose: Train the first pass classifiers (for IOB chunking)
 
-        @param tokenized_sentences. <list> of tokenized sentences
-        @param Y.                   <list-of-lists> of IOB labels for words
-        @param do_grid.             <boolean> whether to perform a grid search
+        @param prose.    <tuple> of prose sentence features and IOB labels
+                           - <list-of-lists> of feature dictionaries
+                           - <list-of-lists> of IOB labels for words
+        @param nonprose. <tuple> of nonprose sentence features and IOB labels
+        @param do_grid.  <boolean> whether to perform a grid search
 
         @return          None
         """
 
         if globals_cliner.verbosity > 0:
             print('first pass')
-        if globals_cliner.verbosity > 0:
-            print('\textracting  features (pass one)')
 
-        # Seperate into prose v nonprose
-        nested_prose_data,    nested_prose_Y = list(zip(
-            *[line_iob_tup for line_iob_tup in zip(tokenized_sentences, Y) if is_prose_sentence(line_iob_tup[0])]))
-        nested_nonprose_data, nested_nonprose_Y = list(zip(
-            *[line_iob_tup for line_iob_tup in zip(tokenized_sentences, Y) if not is_prose_sentence(line_iob_tup[0])]))
-
-        # extract features
-        nested_prose_feats = feat_obj.IOB_prose_features(nested_prose_data)
-        nested_nonprose_feats = feat_obj.IOB_nonprose_features(
-            nested_nonprose_data)
+        nested_prose_feats, nested_prose_Y = prose
+        nested_nonprose_feats, nested_nonprose_Y = nonprose
 
         # Flatten lists (because classifier will expect flat)
         prose_Y = flatten(nested_prose_Y)
@@ -236,20 +301,15 @@ class Model:
         self._first_prose_clf = pclf
         self._first_nonprose_clf = nclf
 
-    def __second_train(self, chunked_data, inds_list, con_labels, do_grid=False):
+    def __second_train(self, concepts, do_grid=False):
         """
         Model::__second_train()
 
-        Purpose: Train the first pass classifiers (for IOB chunking)
+        Purpose: Train the second pass classifier (for concept labels)
 
-        @param data      <list> of tokenized sentences after collapsing chunks
-        @param inds_list <list-of-lists> of indices
-                           - assertion: len(data) == len(inds_list)
-                           - one line of 'inds_list' contains a list of indices
-                               into the corresponding line for 'data'
-        @param con_labels <list> of concept label strings
-                           - assertion: there are sum(len(inds_list)) labels
-                              AKA each index from inds_list maps to a label
+        @param concepts  <tuple> of chunk features and concept labels
+                           - <list> of feature dictionaries (one per chunk)
+                           - <list> of numeric concept labels (1:1 with it)
         @param do_grid   <boolean> indicating whether to perform a grid search
 
         @return          None
@@ -258,21 +318,11 @@ class Model:
         if globals_cliner.verbosity > 0:
             print('second pass')
 
-        # Extract features
-        if globals_cliner.verbosity > 0:
-            print('\textracting  features (pass two)')
-
-        text_features = [feat_obj.concept_features(
-            s, inds) for s, inds in zip(chunked_data, inds_list)]
-
-        flattened_text_features = flatten(text_features)
+        flattened_text_features, numeric_labels = concepts
 
         if globals_cliner.verbosity > 0:
             print('\tvectorizing features (pass two)')
 
-        # Vectorize labels
-        numeric_labels = [concept_labels[y] for y in con_labels]
-
         # Vectorize features
         self._second_vec = DictVectorizer()
         vectorized_features = self._second_vec.fit_transform(
@@ -362,23 +412,26 @@ class Model:
         # Train classifier
         self.third_clf = sci.train(X, Y, do_grid, default_label=0)
 
-    def __first_predict(self, data):
+    def __first_predict(self, data, prose_mask):
         """
         Model::__first_predict()
 
         Purpose: Predict IOB chunks on data
 
-        @param data.  A list of split sentences    (1 sent = 1 line from file)
-        @return       A list of list of IOB labels (1:1 mapping with data)
+        @param data.       A list of split sentences (1 sent = 1 line from file)
+        @param prose_mask. A list of booleans (is sentence prose?)
+        @return            A list of list of IOB labels (1:1 mapping with data)
         """
 
         if globals_cliner.verbosity > 0:
             print('\textracting  features (pass one)')
 
-        # Seperate into
-        nested_prose_data = [line for line in data if is_prose_sentence(line)]
-        nested_nonprose_data = [
-            line for line in data if not is_prose_sentence(line)]
+        # Seperate into (empty sentences have nothing to predict)
+        prose_inds, nonprose_inds = partition_prose(prose_mask)
+        nonprose_inds = [i for i in nonprose_inds if data[i]]
+
+        nested_prose_data = [data[i] for i in prose_inds]
+        nested_nonprose_data = [data[i] for i in nonprose_inds]
 
         # Parition into prose v. nonprose
         nested_prose_feats = feat_obj.IOB_prose_features(nested_prose_data)
@@ -397,21 +450,11 @@ class Model:
 
         # Stitch prose and nonprose data back together
         # translate IOB labels into a readable format
-        prose_iobs = []
-        nonprose_iobs = []
-        iobs = []
+        iobs = [[] for _ in data]
         num2iob = lambda l: reverse_IOB_labels[int(l)]
-        for sentence in data:
-            if sentence == []:
-                iobs.append([])
-            elif is_prose_sentence(sentence):
-                prose_iobs.append(plist.pop(0))
-                prose_iobs[-1] = list(map(num2iob, prose_iobs[-1]))
-                iobs.append(prose_iobs[-1])
-            else:
-                nonprose_iobs.append(nlist.pop(0))
-                nonprose_iobs[-1] = list(map(num2iob, nonprose_iobs[-1]))
-                iobs.append(nonprose_iobs[-1])
+        for inds, predictions in ((prose_inds, plist), (nonprose_inds, nlist)):
+            for i, labels in zip(inds, predictions):
+                iobs[i] = list(map(num2iob, labels))
 
         # list of list of IOB labels
         return iobs
@@ -431,8 +474,8 @@ class Model:
         print('\textracting  features (pass two)')
 
         # Extract features
-        text_features = [feat_obj.concept_features(
-            s, inds) for s, inds in zip(chunked_sentences, inds_list)]
+        text_features = feat_obj.concept_features_for_sentences(
+            chunked_sentences, inds_list)
         flattened_text_features = flatten(text_features)
 
         print('\tvectorizing features (pass two)')
@@ -618,6 +661,89 @@ class Model:
 
         return dvect, clf
 
+    def __generic_first_train_streaming(self, p_or_n, shards, do_grid=False):
+        '''
+        Model::__generic_first_train_streaming()
+
+        Purpose: Streaming version of __generic_first_train()
+
+        @param p_or_n.  <string> either "prose" or "nonprose"
+        @param shards.  <FeatureShards> with (features, iob labels) shards
+        @param do_grid. <boolean> indicating whether to perform grid search
+        '''
+
+        if globals_cliner.verbosity > 0:
+            print('\tvectorizing features (pass one) ' + p_or_n)
+
+        # Fit vocabulary with one pass over the shards
+        dvect = DictVectorizer()
+        dvect.fit(feats for text_features, _ in shards.iter(p_or_n)
+                  for sentence in text_features for feats in sentence)
+
+        # Must have data to train on
+        if len(dvect.vocabulary_) == 0:
+            raise Exception('Training must have %s training examples' % p_or_n)
+
+        # Vectorize one shard at a time
+        def make_batches():
+            for text_features, iob_labels in shards.iter(p_or_n):
+                flat_features = flatten(text_features)
+                if not flat_features:
+                    continue
+
+                offsets = save_list_structure(text_features)
+                X_feats = dvect.transform(flat_features)
+                Y_labels = [IOB_labels[y] for y in flatten(iob_labels)]
+
+                # CRF needs reconstructed lists
+                if self._crf_enabled:
+                    X_feats = reconstruct_list(list(X_feats), offsets)
+                    Y_labels = reconstruct_list(Y_labels, offsets)
+
+                yield X_feats, Y_labels
+
+        if globals_cliner.verbosity > 0:
+            print('\ttraining classifiers (pass one) ' + p_or_n)
+
+        # Train classifier
+        if self._crf_enabled:
+            clf = crf.train_batches(make_batches(), do_grid)
+        else:
+            clf = sci.train_batches(make_batches, IOB_labels.values(), do_grid)
+
+        return dvect, clf
+
+    def __second_train_streaming(self, shards, con_classes, do_grid=False):
+        '''
+        Model::__second_train_streaming()
+
+        Purpose: Streaming version of __second_train()
+
+        @param shards.      <FeatureShards> with (features, labels) shards
+        @param con_classes. <set> of numeric concept labels seen in the shards
+        @param do_grid.     <boolean> indicating whether to perform grid search
+        '''
+
+        if globals_cliner.verbosity > 0:
+            print('\tvectorizing features (pass two)')
+
+        # Fit vocabulary with one pass over the shards
+        self._second_vec = DictVectorizer()
+        self._second_vec.fit(feats for text_features, _ in shards.iter('concept')
+                             for feats in text_features)
+
+        # Vectorize one shard at a time
+        def make_batches():
+            for text_features, numeric_labels in shards.iter('concept'):
+                if text_features:
+                    X = self._second_vec.transform(text_features)
+                    yield X, numeric_labels
+
+        if globals_cliner.verbosity > 0:
+            print('\ttraining  classifier (pass two)')
+
+        self._second_clf = sci.train_batches(make_batches, con_classes, do_grid)
+
     def __generic_first_predict(self, p_or_n, text_features, dvect, clf, do_grid=False):
         '''
         Model::__generic_first_predict()
@@ -671,10 +797,154 @@ class Model:
 
 def extract_concept_features(chunked_sentences, inds_list, feat_obj):
     ''' extract conept (2nd pass) features from textual data '''
-    X = []
-    for s, inds in zip(chunked_sentences, inds_list):
-        X += feat_obj.concept_features(s, inds)
-    return X
+    return flatten(feat_obj.concept_features_for_sentences(chunked_sentences,
+                                                           inds_list))
+
+
+def extract_training_shard(notes, feature_store=None):
+    '''
+    extract_training_shard()
+
+    Purpose: Extract first and second pass features for a chunk of notes
+
+    @param notes.         List of Note objects
+    @param feature_store. <FeatureStore> of previously extracted features
+    @return <dict> of (features, labels) tuples, with keys:
+              'prose'    - prose sentence features and IOB labels
+              'nonprose' - nonprose sentence features and IOB labels
+              'concept'  - chunk features and numeric concept labels
+    '''
+
+    # Cluster features depend on the clusters fit during this run
+    concept_store = feature_store
+    if enabled_modules().get('WORD2VEC', False):
+        concept_store = None
+
+    # Per-note features
+    first_feats = stored_note_features(notes, feature_store,
+                                       first_pass_key, first_pass_features)
+    second_feats = stored_note_features(notes, concept_store,
+                                        second_pass_key, second_pass_features)
+
+    # Labels (1:1 with the features)
+    prose_Y = []
+    nonprose_Y = []
+    for note in notes:
+        for iobs, is_prose in zip(note.getIOBLabels(), note.getProseMask()):
+            if is_prose:
+                prose_Y.append(iobs)
+            else:
+                nonprose_Y.append(iobs)
+
+    con_labels = flatten([note.getConceptLabels() for note in notes])
+    numeric_labels = [concept_labels[y] for y in con_labels]
+
+    return {
+        'prose':    (flatten([f[0] for f in first_feats]), prose_Y),
+        'nonprose': (flatten([f[1] for f in first_feats]), nonprose_Y),
+        'concept':  (flatten(second_feats), numeric_labels),
+    }
+
+
+def stored_note_features(notes, feature_store, key_func, extract_func):
+    '''
+    stored_note_features()
+
+    Purpose: Look up each note's features in a feature store, and only
+             extract features (all at once) for the notes that are missing
+
+    @param notes.         List of Note objects
+    @param feature_store. <FeatureStore> (or None to extract everything)
+    @param key_func.      function mapping (feature_store, note) to a key
+    @param extract_func.  function mapping notes to a list of per-note features
+    @return               <list> of per-note features (1:1 with notes)
+    '''
+
+    if feature_store is None:
+        return extract_func(notes)
+
+    keys = [key_func(feature_store, note) for note in notes]
+    missing = [i for i, key in enumerate(keys)
+               if not feature_store.has_key(key)]  # NOQA
+
+    if globals_cliner.verbosity > 0:
+        print('\t\treusing stored features for %d of %d notes (%s)' %
+              (len(notes) - len(missing), len(notes), extract_func.__name__))
+
+    # Extract features for notes that have changed
+    extracted = {}
+    if missing:
+        note_feats = extract_func([notes[i] for i in missing])
+        for i, feats in zip(missing, note_feats):
+            feature_store.add_map(keys[i], feats)
+            extracted[i] = feats
+
+    return [extracted[i] if i in extracted else feature_store.get_map(keys[i])
+            for i in range(len(notes))]
+
+
+def first_pass_key(feature_store, note):
+    ''' first pass features depend only on the tokenized text '''
+    return feature_store.key('first pass', note.getTokenizedSentences())
+
+
+def second_pass_key(feature_store, note):
+    ''' second pass features depend on the chunked text '''
+    return feature_store.key('second pass', note.getChunkedText(),
+                             note.getConceptIndices())
+
+
+def first_pass_features(notes):
+    '''
+    first_pass_features()
+
+    Purpose: Extract first pass features for the prose and nonprose sentences
+             of every note (extracted all at once, then split up by note)
+
+    @param notes. List of Note objects
+    @return       <list> of (prose features, nonprose features) per note
+    '''
+
+    # Partition each note's sentences into prose v nonprose
+    prose = []
+    nonprose = []
+    for note in notes:
+        data = note.getTokenizedSentences()
+        prose_inds, nonprose_inds = partition_prose(note.getProseMask())
+        prose.append([data[i] for i in prose_inds])
+        nonprose.append([data[i] for i in nonprose_inds])
+
+    # extract features
+    prose_feats = feat_obj.IOB_prose_features(flatten(prose))
+    nonprose_feats = feat_obj.IOB_nonprose_features(flatten(nonprose))
+
+    # split features back up by note
+    prose_feats = reconstruct_list(prose_feats, save_list_structure(prose))
+    nonprose_feats = reconstruct_list(nonprose_feats,
+                                      save_list_structure(nonprose))
+
+    return list(zip(prose_feats, nonprose_feats))
+
+
+def second_pass_features(notes):
+    '''
+    second_pass_features()
+
+    Purpose: Extract second pass features for every concept of every note
+
+    @param notes. List of Note objects
+    @return       <list> of <list> of feature dicts (one list per note)
+    '''
+
+    # Extract features for all notes at once (so they can be parallelized)
+    sentences = [note.getChunkedText() for note in notes]
+    inds_lists = [note.getConceptIndices() for note in notes]
+    feats = feat_obj.concept_features_for_sentences(flatten(sentences),
+                                                    flatten(inds_lists))
+
+    # split features back up by note
+    feats = reconstruct_list(feats, save_list_structure(sentences))
+    return [flatten(note_feats) for note_feats in feats]
 
 
 def first_pass_data_and_labels(notes):
@@ -710,6 +980,24 @@ def first_pass_data_and_labels(notes):
     return tokenized_sentences, iob_labels
 
 
+def partition_prose(prose_mask):
+    '''
+    partition_prose()
+
+    Purpose: Split sentence indices into prose and nonprose partitions
+
+    @param prose_mask. <list> of booleans (is sentence prose?)
+    @return            <tuple> of index arrays (prose, nonprose)
+
+    >>> partition_prose([True, False, False, True])
+    (array([0, 3]), array([1, 2]))
+    '''
+
+    mask = np.asarray(prose_mask, dtype=bool)
+
+    return np.flatnonzero(mask), np.flatnonzero(~mask)
+
+
 def second_pass_data_and_labels(notes):
     '''
     second_pass_data_and_labels()
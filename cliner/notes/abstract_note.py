@@ -17,6 +17,8 @@ __date__   = 'Nov. 6, 2014'
 # Abstract Note (to be inherited from)
 class AbstractNote:
 
+    __slots__ = ()
+
     def __init__(self):
         raise Exception('Cannot instantiate AbstractNote')
 
@@ -75,6 +77,14 @@ class AbstractNote:
         raise Exception('Must define selector for derived class')
 
 
+    def getTokenSpans(self):
+        """
+        Purpose: Return a list of list of (start,end) char offsets (one per
+                 token), or None if the reader does not keep them
+        """
+        return None
+
+
     def read_standard(self, txt, con=None):
         """
         Purpose: Every note must be able to read from standardized forat
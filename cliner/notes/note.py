@@ -16,91 +16,123 @@ __date__   = 'Nov. 6, 2014'
 
 import re
 import string
+import importlib
 from copy import copy
 import nltk.data
 import os.path
 
-from cliner.notes.utilities_for_notes import lineno_and_tokspan
-import cliner
+from cliner.notes.utilities_for_notes import SpanIndex, CompactSentences, IOBLabels
+from cliner.features_dir.utilities import is_prose_sentence
 
 # Master Class
 class Note:
 
-    # Memoize results from static method calls
-    supported_formats = []
-    dict_of_format_to_extensions = []
+    __slots__ = ('derived_note', 'format', 'views', 'concepts',
+                 'txtPath', 'conPath')
+
+    # Registry of supported data formats
+    #   format name -> (module, derived note class, file extension)
+    # (derived note modules are only imported when a note of that format is made)
+    formats = {
+        'i2b2'    : ('cliner.notes.note_i2b2'   , 'Note_i2b2'   , 'con'  ),
+        'plain'   : ('cliner.notes.note_plain'  , 'Note_plain'  , 'plain'),
+        'semeval' : ('cliner.notes.note_semeval', 'Note_semeval', 'pipe' ),
+        'xml'     : ('cliner.notes.note_xml'    , 'Note_xml'    , 'xml'  ),
+    }
+
+    # format name -> derived note class (memoized imports)
+    derived_classes = {}
 
     # Constructor
     def __init__(self, _format):
 
         # Error-check input
-        if _format not in Note.supportedFormats():
+        if _format not in Note.formats:
             raise Exception('Cannot create Note object for format %s' % _format)
 
         # Instantiate the given format derived class
-        notes_module = getattr(cliner.notes, "note_{}".format(_format))
-        DerivedNote = getattr(notes_module, "Note_{}".format(_format))
-        self.derived_note = DerivedNote()
+        self.derived_note = Note.derivedClass(_format)()
 
         # Helpful for debugging
+        # NOTE - this is the format() builtin, not _format, so the semeval-only
+        #        branches (disjoint IOB labels, getText(), third pass) stay off.
+        #        Turning them on changes semeval training labels: the semeval
+        #        span lookup also takes punctuation right after a concept.
         self.format = format
 
-        # Memoizations of selectors
-        self.data            = []
+        # Memoizations of selectors (derived views of the note)
+        self.views           = {}
         self.concepts        = []
-        self.iob_labels      = []
-        self.text_chunks     = []
 
         self.txtPath = None
         self.conPath = None
 
 
-    @staticmethod
-    def supportedFormats():
-        """ returns a list of data formats supported by CliNER """
+    # Views derived from the IOB labels (dropped whenever the labels change)
+    iob_views = ('chunks', 'concept_indices', 'noncontiguous_spans')
 
-        # Memoized?
-        if Note.supported_formats: return Note.supported_formats
 
-        # Note files
-        cands = os.listdir(os.path.join(os.getenv('CLINER_DIR'),'cliner/notes'))
-        notes = filter(lambda f:f.startswith('note_'), cands)
-        notes = filter(lambda f:  f.endswith('.py'  ), notes)
+    def view(self, name, build):
+        """
+        Purpose: Return the memoized view 'name', computing it with build()
+        """
+        if name not in self.views:
+            self.views[name] = build()
+        return self.views[name]
 
-        # Extract format name from all files like 'note_i2b2.py'
-        formats = []
-        for filename in notes:
-            f = re.search('note_(.*)\\.py', filename).groups(1)[0]
-            formats.append(f)
 
-        return formats
+    def invalidate(self, names=None):
+        """
+        Purpose: Drop memoized views (all of them, by default)
+        """
+        if names is None:
+            self.views = {}
+            self.concepts = []
+        else:
+            for name in names:
+                self.views.pop(name, None)
 
 
     @staticmethod
-    def supportedFormatExtensions():
-        return Note.dictOfFormatToExtensions().values()
+    def registerFormat(name, module, class_name, extension):
+        """
+        Note::registerFormat()
+
+        Purpose: Add a data format (ex. from a plugin) to the registry
 
+        @param name.       format name (ex. 'i2b2')
+        @param module.     module that defines the derived note class
+        @param class_name. name of the derived note class (an AbstractNote)
+        @param extension.  file extension of that format's annotation files
+        """
+        Note.formats[name] = (module, class_name, extension)
+        Note.derived_classes.pop(name, None)
 
 
     @staticmethod
-    def dictOfFormatToExtensions():
-        # Memoized?
-        if Note.dict_of_format_to_extensions:
-            return Note.dict_of_format_to_extensions
+    def derivedClass(format):
+        """ returns the derived note class for a format (imported on first use) """
+        if format not in Note.derived_classes:
+            module,class_name,extension = Note.formats[format]
+            Note.derived_classes[format] = getattr(importlib.import_module(module), class_name)
+        return Note.derived_classes[format]
+
+
+    @staticmethod
+    def supportedFormats():
+        """ returns a list of data formats supported by CliNER """
+        return sorted(Note.formats)
 
-        # Get each format's extension
-        extensions = {}
-        for format in Note.supportedFormats():
-            # Import next note format
-            cmd1 = 'from cliner.notes.note_%s import Note_%s' % (format,format)
-            exec(cmd1)
 
-            # Get extension for note
-            cmd2 = 'extensions[format] = Note_%s().getExtension()' % format
-            exec(cmd2)
+    @staticmethod
+    def supportedFormatExtensions():
+        return Note.dictOfFormatToExtensions().values()
 
-        Note.dict_of_format_to_extensions = extensions
-        return extensions
+
+    @staticmethod
+    def dictOfFormatToExtensions():
+        """ returns a dictionary of format name -> file extension """
+        return { format:entry[2] for format,entry in Note.formats.items() }
 
 
 
@@ -130,6 +162,8 @@ class Note:
         Purpose: Call derived object's reader
         """
         retVal = self.derived_note.read(txt_file, con_file)
+        self.compact()
+        self.invalidate()
 
         self.txtPath = txt_file
         self.conPath = con_file
@@ -146,13 +180,47 @@ class Note:
         """
         return self.derived_note.write(con_file)
 
+    def compact(self):
+        """
+        Purpose: Store the derived note's tokens as offsets into its text
+        """
+        derived = self.derived_note
+        if not isinstance(derived.data, CompactSentences):
+            derived.data = CompactSentences(derived.getText(), derived.data,
+                                            derived.getLineIndices())
+
     def getTokenizedSentences(self):
         """
         Purpose: Return list of list of tokens from text file.
         """
-        if not self.data:
-            self.data = self.derived_note.getTokenizedSentences()
-        return self.data
+        def build():
+            data = self.derived_note.getTokenizedSentences()
+            if not isinstance(data, CompactSentences):
+                data = CompactSentences(self.derived_note.getText(), data,
+                                        self.derived_note.getLineIndices())
+            return data
+        return self.view('tokens', build)
+
+    def getProseMask(self):
+        """
+        Purpose: Return a list of booleans (one per sentence) marking prose
+        """
+        def build():
+            data = self.getTokenizedSentences()
+            return [ is_prose_sentence(sent) for sent in data ]
+        return self.view('prose_mask', build)
+
+    def getSpanIndex(self):
+        """
+        Purpose: Return the (memoized) character span => token span index
+        """
+        def build():
+            self.getTokenizedSentences()
+            return SpanIndex(self.derived_note.getLineIndices(),
+                             self.derived_note.data,
+                             self.derived_note.text,
+                             self.derived_note.getTokenSpans())
+        return self.view('span_index', build)
 
     def setFileName(self, fname):
         """
@@ -165,6 +233,8 @@ class Note:
         Purpose: Every note must be able to read from standard forat
         """
         self.derived_note.read_standard(txt,con)
+        self.compact()
+        self.invalidate()
         self.getIOBLabels()
 
 
@@ -179,8 +249,10 @@ class Note:
         """
         Purpose: return a list of concept labels for second pass training
         """
-        classifications = self.derived_note.getClassificationTuples()
-        return [  c[0]  for  c  in  classifications  ]
+        def build():
+            classifications = self.derived_note.getClassificationTuples()
+            return [  c[0]  for  c  in  classifications  ]
+        return self.view('concept_labels', build)
 
 
 
@@ -193,6 +265,10 @@ class Note:
                         that belong in the same noncontiguous span      ***
         """
 
+        # Memoized?
+        if 'noncontiguous_spans' in self.views:
+            return self.views['noncontiguous_spans']
+
         j = 0
         data = self.derived_note.data
 
@@ -219,10 +295,7 @@ class Note:
         tok_classifications = []
 
         # Used for converting character offset -> token index
-        self.getTokenizedSentences()
-        line_inds = self.derived_note.getLineIndices()
-        data = self.derived_note.data
-        text = self.derived_note.text
+        span_index = self.getSpanIndex()
 
         #for i,line in enumerate(data): print i, ': ', line
         #print '\n\n\n'
@@ -242,7 +315,7 @@ class Note:
 
             for span in char_spans:
                 # character offset span --> lineno and list of token index spans
-                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, span, self.format)
+                lineno,tokspan = span_index.lookup(span, self.format)
                 tok_spans.append(tokspan)
                 #if p: exit()
 
@@ -262,6 +335,7 @@ class Note:
             tok_classifications.append( (concept, lineno, chunk_inds)  )
 
 
+        self.views['noncontiguous_spans'] = tok_classifications
         return tok_classifications
 
 
@@ -271,15 +345,13 @@ class Note:
         """
 
         # Only compute if not already memoized
-        if self.iob_labels: return self.iob_labels
+        if 'iob' in self.views: return self.views['iob']
 
         # Build list of proper dimensions (1:1 with self.data)
-        self.getTokenizedSentences()
-        iobs = [ ['O' for tok in sent] for sent in self.data ]
+        data = self.getTokenizedSentences()
+        iobs = [ ['O' for tok in sent] for sent in data ]
 
-        line_inds = self.derived_note.getLineIndices()
-        data = self.derived_note.data
-        text = self.derived_note.text
+        span_index = self.getSpanIndex()
 
         #for d in data:
         #    print d
@@ -299,7 +371,7 @@ class Note:
             for span in char_spans:
                 start_ind,end_ind = span
 
-                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, span, "i2b2")
+                lineno,tokspan = span_index.lookup(span, "i2b2")
                 start,end = tokspan
 
                 #print '\t', lineno, tokspan
@@ -322,9 +394,9 @@ class Note:
             #exit()
         #exit()
 
-        # Memoize for next call
-        self.iob_labels = iobs
-        return iobs
+        # Memoize for next call (one byte per label)
+        self.views['iob'] = IOBLabels(iobs)
+        return self.views['iob']
 
 
     def get_disjoint_IOBLabels(self):
@@ -333,17 +405,15 @@ class Note:
         """
 
         # Only comput if not already memoized
-        if self.iob_labels: return self.iob_labels
+        if 'iob' in self.views: return self.views['iob']
 
 
         # Build list of proper dimensions (1:1 with self.data)
-        self.getTokenizedSentences()
+        data = self.getTokenizedSentences()
 #        iobs = [ ['O' for tok in sent] for sent in self.derived_note.data ]
-        iobs = [ ['O' for tok in sent] for sent in self.data]
+        iobs = [ ['O' for tok in sent] for sent in data]
 
-        line_inds = self.derived_note.getLineIndices()
-        data = self.derived_note.data
-        text = self.derived_note.text
+        span_index = self.getSpanIndex()
 
         #print '\n\n'+'/'*40+'\n\n'
 
@@ -388,7 +458,7 @@ class Note:
 
             # Each span (could be noncontiguous span)
             for span in char_spans:
-                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, span, "semeval")
+                lineno,tokspan = span_index.lookup(span, "semeval")
                 start,end = tokspan
 
     #            print "lineno: ", lineno
@@ -401,9 +471,9 @@ class Note:
                 for i in range(start+1,end+1):
                     iobs[lineno][i] = 'I'
 
-        # Memoize for next call
-        self.iob_labels = iobs
-        return iobs
+        # Memoize for next call (one byte per label)
+        self.views['iob'] = IOBLabels(iobs)
+        return self.views['iob']
 
 
 
@@ -417,7 +487,9 @@ class Note:
                 assert (label == 'O') or (label == 'B') or (label == 'I'),  \
                        "All labels must be I, O, or B. Given: " + label
 
-        self.iob_labels = iobs
+        # Chunks (and everything built from them) are stale now
+        self.invalidate(Note.iob_views)
+        self.views['iob'] = IOBLabels(iobs)
 
 
 
@@ -427,11 +499,12 @@ class Note:
         """
 
         # Memoized?
-        if self.text_chunks: return self.text_chunks
+        if 'chunks' in self.views: return self.views['chunks']
 
         # Line-by-line chunking
+        text_chunks = []
         text = self.getTokenizedSentences()
-        for sent,iobs in zip(text,self.iob_labels):
+        for sent,iobs in zip(text,self.getIOBLabels()):
 
             # One line of chunked phrases
             line = []
@@ -457,19 +530,23 @@ class Note:
             if phrase: line.append(phrase)
 
             # Add line from file
-            self.text_chunks.append(line)
+            text_chunks.append(line)
 
-        return self.text_chunks
+        self.views['chunks'] = text_chunks
+        return text_chunks
 
 
 
     def getConceptIndices(self):
 
+        # Memoized?
+        if 'concept_indices' in self.views: return self.views['concept_indices']
+
         # Return value
         inds_list = []
 
         # Line-by-line chunking
-        for iobs in self.iob_labels:
+        for iobs in self.getIOBLabels():
 
             # One line of chunked phrases
             line = []
@@ -489,6 +566,7 @@ class Note:
             inds_list.append(line)
 
 
+        self.views['concept_indices'] = inds_list
         return inds_list
 
 
@@ -540,7 +618,7 @@ class Note:
 
         # For each word, store a corresponding concept label
         # Initially, all labels will be stored as 'none'
-        for line in self.data:
+        for line in self.getTokenizedSentences():
             tmp = []
             for word in line:
                 tmp.append('none')
@@ -552,11 +630,9 @@ class Note:
             char_spans = classification[1]
 
             # Assumption - assumes no clustering third pass
-            line_inds = self.derived_note.getLineIndices()
-            data      = self.derived_note.getTokenizedSentences()
-            text      = self.derived_note.getText()
+            span_index = self.getSpanIndex()
             for span in char_spans:
-                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, span, self.format)
+                lineno,tokspan = span_index.lookup(span, self.format)
                 start,end = tokspan
 
             self.concepts[lineno][start] = concept
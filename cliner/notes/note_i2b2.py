@@ -22,12 +22,15 @@ import os
 
 from .abstract_note import AbstractNote
 from .utilities_for_notes import classification_cmp, lineno_and_tokspan
-from .utilities_for_notes import NoteException
+from .utilities_for_notes import read_standard_concepts
+from .utilities_for_notes import NoteException, printable_mask_table
 
 
 
 class Note_i2b2(AbstractNote):
 
+    __slots__ = ('text', 'data', 'classifications', 'line_inds')
+
     def __init__(self):
         # Internal representation natural for i2b2 format
         self.data            = []  # list of list of tokens
@@ -44,7 +47,8 @@ class Note_i2b2(AbstractNote):
 
 
     def getTokenizedSentences(self):
-        return [(' '.join(s)).split() for s in self.data]
+        # Tokens come from str.split(), so they are already whitespace-free
+        return self.data
 
 
     def getClassificationTuples(self):
@@ -101,9 +105,35 @@ class Note_i2b2(AbstractNote):
 
 
     def read_standard(self, txt, con=None):
+        """
+        Note_i2b2::read_standard()
+
+        @param txt. A file path for the tokenized medical record
+        @param con. A file path for the standardized annotated concepts for txt
+        """
 
-        print('ERROR: MAKE SURE TOKENIZATION IN READ_STANDARD()')
-        exit()
+        # Text is read (and tokenized) just like i2b2 data
+        self.read(txt)
+
+        # If an accompanying concept file was specified, read it
+        if con:
+            classifications = []
+            for concept,span_inds in read_standard_concepts(con):
+
+                # FIXME - For now, treat non-contiguous spans as separate
+                for span in span_inds:
+                    l,(start,end) = lineno_and_tokspan(self.line_inds,
+                                                       self.data,
+                                                       self.text,
+                                                       span, "i2b2")
+                    classifications.append( (concept,l+1,start,end) )
+
+            # Safe guard against concept file having duplicate entries
+            classifications = list(set(classifications))
+
+            # Concept file does not guarantee ordering by line number
+            self.classifications = sorted(classifications,
+                                          key=cmp_to_key(classification_cmp))
 
 
 
@@ -133,8 +163,8 @@ class Note_i2b2(AbstractNote):
             for sentence in sentences:
 
                 # NOTE - technically, assumes every sentence is unique
-                # Get verbatim slice into sentence
-                start += self.text[start:].index(sentence)
+                # Get verbatim slice into sentence (search forward from last line)
+                start = self.text.index(sentence, start)
                 end = start + len(sentence)
 
                 #print '<%s>' % sentence
@@ -157,7 +187,7 @@ class Note_i2b2(AbstractNote):
                 start = end
 
                 # FIXME - Should we be removing unprintable?
-                sent = ''.join([x if (x in string.printable) else '@' for x in sentence])
+                sent = sentence.translate(printable_mask_table)
                 self.data.append(word_tokenize(sent))
 
                 #i += 1
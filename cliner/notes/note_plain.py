@@ -13,6 +13,7 @@ __author__ = 'Willie Boag'
 __date__   = 'Aug 2, 2015'
 
 
+from functools import cmp_to_key
 import string
 import sys
 import re
@@ -22,6 +23,7 @@ from .abstract_note import AbstractNote
 from .utilities_for_notes import concept_cmp, classification_cmp
 from .utilities_for_notes import lineno_and_tokspan, lno_and_tokspan__to__char_span
 from .utilities_for_notes import WordTokenizer, SentenceTokenizer
+from .utilities_for_notes import printable_table, read_standard_concepts
 
 
 word_tokenizer =     WordTokenizer()
@@ -31,6 +33,8 @@ sent_tokenizer = SentenceTokenizer()
 
 class Note_plain(AbstractNote):
 
+    __slots__ = ('text', 'data', 'classifications', 'line_inds')
+
     def __init__(self):
         # Internal representation natural for i2b2 format
         self.data            = []  # list of list of tokens
@@ -65,78 +69,30 @@ class Note_plain(AbstractNote):
 
 
     def read_standard(self, txt, con=None):
+        """
+        Note_plain::read_standard()
 
-        print('ERROR: MAKE SURE TOKENIZATION IN READ_STANDARD()')
-        exit()
-
-        start = 0
-        end = 0
-
-        with open(txt) as f:
-
-            # Get entire file
-            text = f.read().strip('\n')
-            self.text = text
-
-            # Split into lines
-            self.data = [s.split() for s in text.split('\n')]
-
-            # Tokenize each sentence into words (and save line number indices)
-            toks = []
-            gold = []          # Actual lines
-
-            for sent in self.data:
-
-                gold.append(sent)
-
-                # Keep track of which indices each line has
-                for word in sent:
-                    end += len(word) + 1
-
-                self.line_inds.append( (start,end-1) )
-                start = end
-
-                # Skip ahead to next non-whitespace
-                while (start < len(text)) and text[start].isspace(): start += 1
+        @param txt. A file path for the tokenized medical record
+        @param con. A file path for the standardized annotated concepts for txt
+        """
 
+        # Text is read (and tokenized) just like plain data
+        self.read(txt)
 
         # If an accompanying concept file was specified, read it
         if con:
             classifications = []
-            with open(con) as f:
-                for line in f:
+            for concept,span_inds in read_standard_concepts(con):
 
-                    # Empty line
-                    if line == '\n': continue
-
-                    # Parse concept file line
-                    fields = line.strip().split('||')
-                    #print fields
-                    concept = fields[0]
-                    span_inds = []
-                    for i in range(1,len(fields),2):
-                        span = int(fields[i]), int(fields[i+1])
-                        span_inds.append( span )
-
-                    # FIXME - For now, treat non-contiguous spans as separate
-                    for span in span_inds:
-                        # Add the classification to the Note object
-                        l,(start,end) = lineno_and_tokspan(self.line_inds,
-                                                           self.data,
-                                                           self.text,
-                                                           span)
-                        #print 'span:   ', span
-                        #print 'lineno: ', l
-                        #print 'start:  ', start
-                        #print 'end:    ', end
-                        #print '\n'
-                        classifications.append((concept,l+1,start,end))
+                # FIXME - For now, treat non-contiguous spans as separate
+                for span in span_inds:
+                    classifications.append( (concept,span) )
 
             # Safe guard against concept file having duplicate entries
             classifications = list(set(classifications))
 
             # Concept file does not guarantee ordering by line number
-            self.classifications = sorted(classifications,cmp=classification_cmp)
+            self.classifications = sorted(classifications, key=lambda t:t[1][0])
 
 
 
@@ -159,16 +115,18 @@ class Note_plain(AbstractNote):
         with open(txt) as f:
             # Original text file
             text = f.read().strip('\n')
-            self.text = [x for x in text if x in string.printable]
+
+            # FIXME - Should we be removing unprintable?
+            self.text = text.translate(printable_table)
 
             i = 0
-            sentences = sent_tokenize(self.text)
+            sentences = sent_tokenize(self.text, 'plain')
             for sentence in sentences:
 
                 # NOTE - Fails on repeat line
                 #  need to reference previous length to advance by that much guaranteed
-                # Get verbatim slice into sentence
-                start += self.text[start:].index(sentence)
+                # Get verbatim slice into sentence (search forward from last line)
+                start = self.text.index(sentence, start)
                 end = start + len(sentence)
 
                 #i += 1
@@ -192,9 +150,7 @@ class Note_plain(AbstractNote):
                 # Advance index to avoid rare issue of duplicate lines
                 start = end
 
-                # FIXME - Should we be removing unprintable?
-                sentence = [x for x in sentence if x in string.printable]
-                self.data.append(word_tokenize(sentence))
+                self.data.append(word_tokenize(sentence, 'plain'))
 
                 #i += 1
                 #if i < 4: continue
@@ -274,9 +230,9 @@ class Note_plain(AbstractNote):
             text      = self.text
             classifications = []
             for concept,char_span in self.classifications:
-                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, char_span)
+                lineno,tokspan = lineno_and_tokspan(line_inds, data, text, char_span, "plain")
                 classifications.append( ( concept,lineno+1,tokspan[0],tokspan[1] ) )
-            classifications = sorted(classifications, cmp=classification_cmp)
+            classifications = sorted(classifications, key=cmp_to_key(classification_cmp))
         else:
             raise Exception('Cannot write concept file: must specify labels')
 
@@ -333,7 +289,7 @@ class Note_plain(AbstractNote):
             #print "concept:        ", concept
 
             # Find the text string that the concept refers to
-            span = lno_and_tokspan__to__char_span(self.line_inds, self.data, self.text, lineno-1, (start,end))
+            span = lno_and_tokspan__to__char_span(self.line_inds, self.data, self.text, lineno-1, (start,end), "plain")
             span_start, span_end = span
 
             #print 'span:           ', span
@@ -24,8 +24,10 @@ import os
 import sys
 
 from .utilities_for_notes import concept_cmp, SentenceTokenizer, WordTokenizer, lno_and_tokspan__to__char_span, lineno_and_tokspan, remove_non_ascii
+from .utilities_for_notes import stokenizer, wtokenizer, CompactSentences
+from .utilities_for_notes import read_standard_concepts
 from .abstract_note       import AbstractNote
-from functools import reduce
+from functools import reduce, cmp_to_key
 
 #CLINER_PATH = os.environ["CLINER_DIR"]
 #OPEN_NLP_PATH = CLINER_PATH + "/cliner/lib/java/openNLP"
@@ -36,17 +38,22 @@ from functools import reduce
 
 class Note_semeval(AbstractNote):
 
+    __slots__ = ('sent_tokenizer', 'word_tokenizer', 'text', 'data',
+                 'line_inds', 'token_spans', 'classifications', 'fileName')
+
     def __init__(self):
         # For parsing text file
 #        self.opennlp_tokenizer = OpenNLPTokenizer();
 
-        self.sent_tokenizer = SentenceTokenizer()
-        self.word_tokenizer = WordTokenizer()
+        # (shared by every note, so punkt is only loaded once)
+        self.sent_tokenizer = stokenizer
+        self.word_tokenizer = wtokenizer
 
         # Internal representation natural for i2b2 format
         self.text = ''
         self.data            = []  # list of list of tokens
         self.line_inds = []
+        self.token_spans     = []  # list of list of (start,end) for every token
         self.classifications = []
         self.fileName = 'no-file'
 
@@ -71,76 +78,62 @@ class Note_semeval(AbstractNote):
         return self.line_inds
 
 
+    def getTokenSpans(self):
+        return self.token_spans
+
+
     def setFileName(self, fname):
         self.fileName = fname
 
 
     def read_standard(self, txt, con=None):
 
+        # Filename
+        self.fileName = txt
+
         start = 0
         end = 0
 
         with open(txt) as f:
 
-            # Get entire file
-            text = f.read()
+            # Get entire file (stripped of non ascii chars, just like read())
+            text = remove_non_ascii(f.read())
             self.text = text
 
             # Sentence splitter
-
-
-            sents = self.sent_tokenizer.tokenize(txt)
-#            sents = self.opennlp_tokenizer.sentenize(text)
+            sents = self.sent_tokenizer.tokenize(text, "semeval")
 
             # Tokenize each sentence into words (and save line number indices)
-            toks = []
-            gold = []          # Actual lines
-
             for s in sents:
-                gold.append(s)
 
                 # Store data
-
-                toks = self.word_tokenizer.tokenize(s)
-#                toks = self.opennlp_tokenizer.tokenize(s)
-
+                spans = self.word_tokenizer.span_tokenize(s, "semeval")
+                toks = [ tok for tok,tok_start,tok_end in spans ]
                 self.data.append(toks)
 
+                # Token offsets into the file (for span => token lookups)
+                self.token_spans.append( [ (start+tok_start, start+tok_end) for tok,tok_start,tok_end in spans ] )
+
                 # Keep track of which indices each line has
                 end = start + len(s)
 
                 self.line_inds.append( (start,end) )
-                start = end + 1
+                start = end
 
                 # Skip ahead to next non-whitespace
                 while (start < len(text)) and text[start].isspace(): start += 1
 
+            # Keep the tokens as offsets into the text
+            self.data = CompactSentences(text, self.data, self.line_inds, self.token_spans)
+            self.token_spans = self.data.spans
+
 
         # If an accompanying concept file was specified, read it
         if con:
-            classifications = []
-            with open(con) as f:
-                for line in f:
-
-                    # Empty line
-                    if line == '\n': continue
-
-                    # Parse concept file line
-                    fields = line.strip().split('||')
-                    #print fields
-                    concept = fields[0]
-                    span_inds = []
-                    for i in range(1,len(fields),2):
-                        span = int(fields[i]), int(fields[i+1])
-                        span_inds.append( span )
-
-                    #print '\t', concept
-                    #print '\t', span_inds
-
-                    classifications.append( (concept, span_inds) )
+            classifications = read_standard_concepts(con)
 
             # Concept file does not guarantee ordering by line number
-            self.classifications = sorted(classifications, cmp=concept_cmp)
+            self.classifications = sorted(classifications, key=cmp_to_key(concept_cmp))
 
 
 
@@ -175,7 +168,8 @@ class Note_semeval(AbstractNote):
 
             # Sentence splitter
 
-            sents = self.sent_tokenizer.tokenize(txt, "semeval")
+            # (text is already read in, and stripped of non ascii chars)
+            sents = self.sent_tokenizer.tokenize(text, "semeval")
 #            sents = self.opennlp_tokenizer.sentenize(text)
 
 #            print "sentenized text: "
@@ -205,9 +199,13 @@ class Note_semeval(AbstractNote):
 
                 # Store data
 
-                toks = self.word_tokenizer.tokenize(s, "semeval")
+                spans = self.word_tokenizer.span_tokenize(s, "semeval")
+                toks = [ tok for tok,tok_start,tok_end in spans ]
             #    toks = self.opennlp_tokenizer.tokenize(s)
 
+                # Token offsets into the file (for span => token lookups)
+                self.token_spans.append( [ (start+tok_start, start+tok_end) for tok,tok_start,tok_end in spans ] )
+
                 #print toks
 
                 #if b: print "\ntokenized sentence:----------------------------"
@@ -235,6 +233,10 @@ class Note_semeval(AbstractNote):
                 # Skip ahead to next non-whitespace
                 while (start < len(text)) and text[start].isspace(): start += 1
 
+            # Keep the tokens as offsets into the text
+            self.data = CompactSentences(text, self.data, self.line_inds, self.token_spans)
+            self.token_spans = self.data.spans
+
             '''
             for line,inds in zip(gold,self.line_inds):
                 print '!!!' + line + '!!!'
@@ -300,7 +302,7 @@ class Note_semeval(AbstractNote):
 #                        print "skipping > 1"
 
             # Safe guard against concept file having duplicate entries
-            classifications = sorted(classifications, cmp=concept_cmp)
+            classifications = sorted(classifications, key=cmp_to_key(concept_cmp))
 
             # Hack: Throw away noncontiguous spans that cross line numbers
             newClassifications = []
@@ -378,7 +380,7 @@ class Note_semeval(AbstractNote):
             #exit()
 
             # Concept file does not guarantee ordering by line number
-            #self.classifications = sorted(classifications, cmp=concept_cmp)
+            #self.classifications = sorted(classifications, key=cmp_to_key(concept_cmp))
 
 
 
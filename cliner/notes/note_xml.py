@@ -17,16 +17,19 @@ __date__   = 'Nov. 6, 2014'
 
 import re
 import string
-from copy import copy
+from functools import cmp_to_key
 
 
 from .abstract_note       import AbstractNote
 from .utilities_for_notes import classification_cmp, lineno_and_tokspan
+from .utilities_for_notes import read_standard_concepts
 
 from .preprocessor 	 import PreProcessor
 
 class Note_xml(AbstractNote):
 
+    __slots__ = ('text', 'data', 'classifications', 'line_inds', 'pre_processor')
+
     def __init__(self):
         # Internal representation natural for i2b2 format
         self.data            = []  # list of list of tokens
@@ -92,8 +95,6 @@ class Note_xml(AbstractNote):
 
 
     def read(self, txt, con=None):
-        print("called xml read")
-
         """
         Note_xml::read()
 
@@ -125,7 +126,7 @@ class Note_xml(AbstractNote):
                 start = end
 
                 # Strip away non-printable characters
-                line = [x for x in line if x in string.printable]
+                line = ''.join(x for x in line if x in string.printable)
 
                 # Add sentence to the data list
                 self.data.append(line.split() if con is not None else self.pre_processor.tokenizeSentence(line)) 
@@ -191,7 +192,7 @@ class Note_xml(AbstractNote):
 
 
         # Intermediate copy
-        toks = copy(self.data)
+        toks = [ list(sent) for sent in self.data ]
 
         # Order classification tuples so they are accessed right to left
         # Assumption: sorted() is a stable sort
@@ -249,60 +250,36 @@ class Note_xml(AbstractNote):
             self.text = text
 
             # Split into lines
-            self.data = [s.split() for s in text.split('\n')]
-
-            # Tokenize each sentence into words (and save line number indices)
-            toks = []
-            gold = []          # Actual lines
-
-            for sent in self.data:
-
-                gold.append(sent)
-
-                # Keep track of which indices each line has
-                for word in sent:
-                    end += len(word) + 1
-
-                self.line_inds.append( (start,end-1) )
+            lines = text.split('\n')
+            self.data = [s.split() for s in lines]
+
+            # Keep track of which indices each line has
+            for line in lines:
+                start = text.index(line, start)
+                end = start + len(line)
+                self.line_inds.append( (start,end) )
                 start = end
 
-                # Skip ahead to next non-whitespace
-                while (start < len(text)) and text[start].isspace(): start += 1
-
 
         # If an accompanying concept file was specified, read it
         if con:
             classifications = []
-            with open(con) as f:
-                for line in f:
-
-                    # Empty line
-                    if line == '\n': continue
-
-                    # Parse concept file line
-                    fields = line.strip().split('||')
-                    #print fields
-                    concept = fields[0]
-                    span_inds = []
-                    for i in range(1,len(fields),2):
-                        span = int(fields[i]), int(fields[i+1])
-                        span_inds.append( span )
-
-                    # FIXME - For now, treat non-contiguous spans as separate
-                    for span in span_inds:
-                        # Add the classification to the Note object
-                        l,(start,end) = lineno_and_tokspan(self.line_inds, self.data, self.text, span)
-                        #print 'span:   ', span
-                        #print 'lineno: ', l
-                        #print 'start:  ', start
-                        #print 'end:    ', end
-                        #print '\n'
-                        classifications.append((concept,l+1,start,end))
+            for concept,span_inds in read_standard_concepts(con):
+
+                # FIXME - For now, treat non-contiguous spans as separate
+                for span in span_inds:
+                    # Add the classification to the Note object
+                    l,(start,end) = lineno_and_tokspan(self.line_inds,
+                                                       self.data,
+                                                       self.text,
+                                                       span, "xml")
+                    classifications.append((concept,l+1,start,end))
 
             # Safe guard against concept file having duplicate entries
             classifications = list(set(classifications))
 
             # Concept file does not guarantee ordering by line number
-            self.classifications = sorted(classifications,cmp=classification_cmp)
+            self.classifications = sorted(classifications,
+                                          key=cmp_to_key(classification_cmp))
 
 
@@ -9,6 +9,9 @@
 
 import nltk.data
 import pickle
+import bisect
+import operator
+from array import array
 import nltk.tokenize
 import re
 import string
@@ -57,7 +60,39 @@ def concept_cmp(a,b):
 
     Purpose: Compare concept classification tokens
     """
-    return a[1][0] < b[1][0]
+    a = a[1][0]
+    b = b[1][0]
+    return (a > b) - (a < b)
+
+
+
+def read_standard_concepts(con):
+    """
+    read_standard_concepts()
+
+    Purpose: Read a concept file in the standardized format
+
+    @param con. A file path for the standardized annotated concepts
+    @return     list of (concept, list of (start,end) char spans) tuples
+    """
+    classifications = []
+    with open(con) as f:
+        for line in f:
+
+            # Empty line
+            if line.strip() == '': continue
+
+            # Parse concept file line
+            fields = line.strip().split('||')
+            concept = fields[0]
+            span_inds = []
+            for i in range(1,len(fields),2):
+                span = int(fields[i]), int(fields[i+1])
+                span_inds.append( span )
+
+            classifications.append( (concept, span_inds) )
+
+    return classifications
 
 
 
@@ -376,6 +411,380 @@ def lno_and_tokspan__to__char_span(line_inds, data, text, lineno, tokspan, forma
 
 
 
+class SpanIndex:
+    """
+    Character span => (line number, token span) lookups for one note
+
+    Same answers as lineno_and_tokspan(), but the line is found by binary
+    search over the line end offsets, and each line's token offsets are
+    computed once (the first time a span lands on that line) and then
+    searched with bisect. Spans that the offsets cannot resolve fall back
+    to lineno_and_tokspan().
+    """
+
+    def __init__(self, line_inds, data, text, token_spans=None):
+        self.line_inds   = line_inds
+        self.data        = data
+        self.text        = text
+        self.token_spans = token_spans
+
+        # lines are in file order, so their end offsets are sorted
+        self.line_ends = [ span[1] for span in line_inds ]
+
+        # (format,lineno) -> token offsets for that line
+        self.offsets = {}
+
+
+    def lineno(self, char_span):
+        """ index of the first line ending at (or after) the end of char_span """
+        i = bisect.bisect_left(self.line_ends, char_span[1])
+        if i == len(self.line_ends):
+            return None
+        return i
+
+
+    def lookup(self, char_span, format):
+        """
+        SpanIndex::lookup()
+
+        @param char_span. (start,end) character offsets into the text
+        @param format.    data format (decides how tokens map onto the text)
+        @return           (lineno, (start_tok,end_tok)), like lineno_and_tokspan()
+        """
+        i = self.lineno(char_span)
+
+        if format == "semeval":
+            if i is None: return None
+            return (i, self.__semeval_tokspan(i, char_span))
+
+        else:
+            if i is not None:
+                tokspan = self.__tokspan(i, char_span)
+                if tokspan is not None:
+                    return i, tokspan
+
+            # offsets could not resolve the span, so do the full search
+            return lineno_and_tokspan(self.line_inds, self.data, self.text,
+                                      char_span, format)
+
+
+    def __semeval_tokspan(self, i, char_span):
+
+        key = ("semeval", i)
+        if key not in self.offsets:
+            self.offsets[key] = self.__semeval_offsets(i)
+        starts,indices = self.offsets[key]
+
+        # start and end of span relative to sentence
+        line_start = self.line_inds[i][0]
+        start = char_span[0] - line_start
+        end   = char_span[1] - line_start
+
+        tok_span = [0, len(self.data[i])-1]
+
+        # first token beginning after the end of the span closes it
+        k = bisect.bisect_right(starts, end)
+        if k < len(starts):
+            tok_span[1] = indices[k] - 1
+
+        # first token beginning at (or after) the start of the span opens it
+        j = bisect.bisect_left(starts, start)
+        if j < k:
+            tok_span[0] = indices[j]
+
+        return tuple(tok_span)
+
+
+    def __semeval_offsets(self, i):
+        """ offsets of every token (as lineno_and_tokspan() counts them) """
+
+        text = self.text
+        span = self.line_inds[i]
+
+        # Offsets kept by the reader (no need to tokenize again)
+        if self.token_spans is not None:
+            starts = [ tok_start - span[0] for tok_start,tok_end in self.token_spans[i] ]
+            return starts, list(range(len(starts)))
+
+        toks = wtokenizer.tokenize(text[span[0]:span[1] + 1], "semeval")
+
+        starts  = []
+        indices = []
+
+        char_count = 0
+        index = 0
+        for tok in toks:
+            starts.append(char_count)
+            indices.append(index)
+
+            char_count += len(tok)
+            if len(tok) > 0:
+                index += 1
+
+            # Skip ahead to next non-whitespace
+            while ((span[0] + char_count) < len(text)) and \
+                  text[span[0]+char_count].isspace():
+                char_count += 1
+
+        return starts,indices
+
+
+    def __tokspan(self, i, char_span):
+
+        key = ("i2b2", i)
+        if key not in self.offsets:
+            self.offsets[key] = self.__offsets(i)
+        offsets = self.offsets[key]
+
+        if offsets is None:
+            return None
+        starts,ends = offsets
+
+        # the span must begin exactly on a token and end exactly on a token
+        line_start = self.line_inds[i][0]
+        start = char_span[0] - line_start
+        end   = char_span[1] - line_start
+
+        j = bisect.bisect_left(starts, start)
+        k = bisect.bisect_left(ends, end)
+        if (j == len(starts)) or (starts[j] != start): return None
+        if (k == len(ends))   or (ends[k]   != end  ): return None
+        if j > k: return None
+
+        # and cover exactly those tokens (nothing skipped in between)
+        if self.text[char_span[0]:char_span[1]].split() != self.data[i][j:k+1]:
+            return None
+
+        return (j,k)
+
+
+    def __offsets(self, i):
+        """ token offsets, as lno_and_tokspan__to__char_span() finds them """
+
+        start,end = self.line_inds[i]
+        phrase = self.text[start:end].replace('\n', '\t')
+        tokens = self.data[i]
+
+        starts = []
+        ends   = []
+
+        index = 0
+        for j,token in enumerate(tokens):
+            if j > 0:
+                index = phrase.find(token, index + len(tokens[j-1]))
+                if index < 0:
+                    return None
+            starts.append(index)
+            ends.append(index + len(token))
+
+        # empty tokens would make the offsets ambiguous
+        if any(a >= b for a,b in zip(starts,starts[1:])):
+            return None
+
+        return starts,ends
+
+
+
+class CompactSentences(object):
+    """
+    Tokenized sentences stored as offsets into the note's text
+
+    Behaves like a (read-only) list of list of tokens, but keeps one text
+    buffer and arrays of token start/end offsets instead of a str object
+    per token. Token lists are built when a line is accessed. Tokens that
+    are not a verbatim slice of the text (ex. masked characters or nltk's
+    quotes) are kept as strings.
+
+    Pickles (and so hashes into feature store keys) as a list of lists.
+    """
+
+    __slots__ = ('text', 'starts', 'ends', 'line_starts', 'overrides')
+
+    def __init__(self, text, data, line_inds, token_spans=None):
+        """
+        Constructor.
+
+        @param text.        The verbatim text of the note
+        @param data.        list of list of tokens
+        @param line_inds.   list of (start,end) char offsets (one per line)
+        @param token_spans. list of list of (start,end) char offsets (one per
+                            token), or None to locate the tokens in the text
+        """
+        self.text        = text
+        self.starts      = array('I')
+        self.ends        = array('I')
+        self.line_starts = array('I', [0])
+        self.overrides   = {}
+
+        for i,sent in enumerate(data):
+            if token_spans is not None:
+                spans = token_spans[i]
+            else:
+                spans = self.__align(sent, line_inds[i] if i < len(line_inds) else (0,0))
+
+            for tok,(start,end) in zip(sent, spans):
+                if text[start:end] != tok:
+                    self.overrides[len(self.starts)] = tok
+                self.starts.append(start)
+                self.ends.append(end)
+
+            self.line_starts.append(len(self.starts))
+
+
+    def __align(self, sent, line_span):
+        """ char offsets of each token, searching forward through the line """
+        spans = []
+        cursor = line_span[0]
+        for tok in sent:
+            start = self.text.find(tok, cursor, line_span[1])
+            if start < 0:
+                spans.append( (cursor,cursor) )
+            else:
+                cursor = start + len(tok)
+                spans.append( (start,cursor) )
+        return spans
+
+
+    def __len__(self):
+        return len(self.line_starts) - 1
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+
+        i = operator.index(i)
+        if i < 0: i += len(self)
+        if not (0 <= i < len(self)):
+            raise IndexError('line index out of range')
+
+        text      = self.text
+        starts    = self.starts
+        ends      = self.ends
+        overrides = self.overrides
+
+        return [ overrides[k] if k in overrides else text[starts[k]:ends[k]]
+                 for k in range(self.line_starts[i], self.line_starts[i+1]) ]
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+    def __reduce__(self):
+        return (list, (self.tolist(),))
+
+
+    def tolist(self):
+        """ list of list of tokens """
+        return list(self)
+
+
+    def line_spans(self, i):
+        """ (start,end) char offsets of every token on line i """
+        return list(zip(self.starts[self.line_starts[i]:self.line_starts[i+1]],
+                        self.ends[  self.line_starts[i]:self.line_starts[i+1]]))
+
+
+    @property
+    def spans(self):
+        """ list-like view of line_spans() for every line """
+        return _LineSpans(self)
+
+
+
+class _LineSpans(object):
+
+    __slots__ = ('sents',)
+
+    def __init__(self, sents):
+        self.sents = sents
+
+    def __len__(self):
+        return len(self.sents)
+
+    def __getitem__(self, i):
+        return self.sents.line_spans(i)
+
+
+
+class IOBLabels(object):
+    """
+    IOB labels stored as one byte per token
+
+    Behaves like a (read-only) list of list of 'O'/'B'/'I' labels.
+    Pickles as a list of lists.
+    """
+
+    __slots__ = ('codes', 'line_starts')
+
+    # code -> label (codes match note.IOB_labels)
+    labels = ('O', 'B', 'I')
+    label_codes = { label:code for code,label in enumerate(labels) }
+
+    def __init__(self, iobs):
+        """
+        Constructor.
+
+        @param iobs. list of list of IOB labels (one list per line)
+        """
+        codes = IOBLabels.label_codes
+        self.codes = array('B')
+        self.line_starts = array('I', [0])
+        for line in iobs:
+            self.codes.extend( codes[label] for label in line )
+            self.line_starts.append(len(self.codes))
+
+
+    def __len__(self):
+        return len(self.line_starts) - 1
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+
+        i = operator.index(i)
+        if i < 0: i += len(self)
+        if not (0 <= i < len(self)):
+            raise IndexError('line index out of range')
+
+        labels = IOBLabels.labels
+        return [ labels[code] for code in self.codes[self.line_starts[i]:self.line_starts[i+1]] ]
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+    def __reduce__(self):
+        return (list, (self.tolist(),))
+
+
+    def tolist(self):
+        """ list of list of labels """
+        return list(self)
+
+
+
 def span_relationship(s1, s2):
     if (s1[0] <= s2[0]) and (s1[1] >= s2[1]):
         return 'subsumes'
@@ -415,17 +824,34 @@ def span_stuff(classifs):
     #print newClassifs
     return newClassifs
 
-def remove_non_ascii(string):
+class CharTable(dict):
+    """
+    Translation table for str.translate()
 
-    ret = []
+    Keeps the characters in 'keep' and replaces every other character with
+    'replacement' (None deletes it). Entries are filled in the first time a
+    character is seen, so any unicode text can be filtered in one pass.
+    """
+
+    def __init__(self, keep, replacement=None):
+        self.keep = frozenset(keep)
+        self.replacement = replacement
+
+    def __missing__(self, o):
+        self[o] = o if chr(o) in self.keep else self.replacement
+        return self[o]
+
+
+# ascii characters (without NUL and DEL)
+ascii_table = CharTable(chr(i) for i in range(1,127))
 
-    for c in string:
-        if ord(c) > 0 and ord(c) < 127:
-            ret.append(c)
+# string.printable characters, others deleted or masked with '@'
+printable_table = CharTable(string.printable)
+printable_mask_table = CharTable(string.printable, '@')
 
-    ret = ''.join(ret)
 
-    return ret
+def remove_non_ascii(string):
+    return string.translate(ascii_table)
 
 
 # Break file into sentences.
@@ -434,11 +860,10 @@ class SentenceTokenizer:
     def __init__(self):
         self.sent_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
 
-    def tokenize(self, text_file, format):
-        """ Split the document into sentences """
+    def tokenize(self, text, format):
+        """ Split the document (already read in) into sentences """
 
         if format == "semeval":
-            text = open(text_file, 'r').read()
 
             # strip non ascii chars
             text = remove_non_ascii(text)
@@ -488,21 +913,7 @@ class WordTokenizer:
 
         if format == "semeval":
 
-            toks = nltk.tokenize.word_tokenize(sent)
-
-            # Second pass, delimit on token-combiners such as '/' and '-'
-            delims = ['/', '-', '(', ')', ',', '.', ':', '*', '[', ']', '%', '+']
-            for delim in delims:
-                retVal = []
-                for tok in toks:
-                    line_split = tok.split(delim)
-                    if line_split[0] != '': retVal.append(line_split[0])
-                    for t in line_split[1:]:
-                        retVal.append(delim)
-                        if t != '': retVal.append(t)
-                toks = retVal
-
-            return retVal
+            return [ tok for tok,start,end in self.span_tokenize(sent, format) ]
 
         else:
 
@@ -510,11 +921,77 @@ class WordTokenizer:
             #return sent.strip().split()
             #return sent.strip().split(' ')
             #return filter(lambda word: word!= '', nltk.tokenize.wordpunct_tokenize(sent))
-            toks = filter(lambda w: len(w)>0, nltk.tokenize.wordpunct_tokenize(sent))
+            toks = [w for w in nltk.tokenize.wordpunct_tokenize(sent) if len(w)>0]
             #splitted = [ w.replace('/',' / ').split() for w in toks ]
             #toks = sum(splitted, [])
             return toks
 
+
+    def span_tokenize(self, sent, format):
+        """
+        WordTokenizer::span_tokenize()
+
+        Purpose: Split the sentence into tokens, keeping their char offsets
+
+        @param sent.   A sentence string
+        @param format. Data format (only semeval splits on token-combiners)
+        @return        A list of (token,start,end) tuples (offsets into sent)
+        """
+
+        toks = nltk.tokenize.word_tokenize(sent) if format == "semeval" \
+               else self.tokenize(sent, format)
+
+        retVal = []
+        cursor = 0
+        for tok in toks:
+            start,length = align_token(sent, tok, cursor)
+            cursor = start + length
+
+            # Tokens that are not verbatim in the text (ex. nltk's `` for ")
+            # keep the width they have in the text, and are not split
+            if (format != "semeval") or (length != len(tok)):
+                retVal.append( (tok, start, start+length) )
+                continue
+
+            # Second pass, delimit on token-combiners such as '/' and '-'
+            ind = start
+            for piece in token_combiners.split(tok):
+                if piece != '':
+                    retVal.append( (piece, ind, ind+len(piece)) )
+                ind += len(piece)
+
+        return retVal
+
+
+# Token-combiners that semeval tokens are split on (delimiters are kept)
+token_combiners = re.compile(r'([/\-(),.:*\[\]%+])')
+
+
+def align_token(sent, tok, cursor):
+    """
+    align_token()
+
+    Purpose: Find where a token (from nltk) occurs in the sentence
+
+    @param sent.   The sentence that was tokenized
+    @param tok.    The token
+    @param cursor. Offset where the previous token ended
+    @return        (start,length) of the token's text in sent
+    """
+    start = sent.find(tok, cursor)
+
+    # nltk rewrites double quotes as `` and ''
+    if tok in ('``', "''"):
+        quote = sent.find('"', cursor)
+        if (quote >= 0) and ((start < 0) or (quote < start)):
+            return quote, 1
+
+    if start < 0:
+        return cursor, 0
+
+    return start, len(tok)
+
+
 def find_all(a_str, sub):
     start = 0
     while True:
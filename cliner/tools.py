@@ -7,6 +7,10 @@
 ######################################################################
 
 
+import os
+import pickle
+import shutil
+import tempfile
 
 
 def flatten(list_of_lists):
@@ -71,3 +75,67 @@ def reconstruct_list(flat_list, offsets):
     return [ flat_list[i:j] for i, j in zip([0] + offsets, offsets)]
 
 
+
+
+def chunked(iterable, chunk_size):
+    '''
+    chunked()
+
+    Purpose: Lazily group an iterable into lists of (at most) chunk_size items
+
+    @param iterable.   Any iterable (ex. a generator of Note objects)
+    @param chunk_size. <int> maximum number of items per chunk
+    @return            <generator> of <list> of items
+
+    >>> list(chunked(iter('abcdefg'), 3))
+    [['a', 'b', 'c'], ['d', 'e', 'f'], ['g']]
+    '''
+
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+
+
+class FeatureShards:
+
+    '''
+    FeatureShards
+
+    Purpose: Spill intermediate data (ex. feature dicts) to disk in shards,
+             so that it can be re-read one shard at a time.
+
+    Each shard is stored under a name (ex. 'prose', 'concept'), so a pass over
+    the data only has to load the part of each shard that it needs.
+    '''
+
+    def __init__(self, shard_dir=None):
+        self.dirname = tempfile.mkdtemp(dir=shard_dir, suffix='_shards')
+        self.num_shards = 0
+
+    def append(self, shard):
+        """ write a dictionary of {name:object} as the next shard """
+        for name, obj in shard.items():
+            with open(self.__path(self.num_shards, name), 'wb') as f:
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        self.num_shards += 1
+
+    def iter(self, name):
+        """ lazily load every shard's object that was stored under name """
+        for i in range(self.num_shards):
+            with open(self.__path(i, name), 'rb') as f:
+                yield pickle.load(f)
+
+    def close(self):
+        """ delete all shards from disk """
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def __path(self, i, name):
+        return os.path.join(self.dirname, '%06d.%s.pickle' % (i, name))
@@ -15,8 +15,11 @@ import pickle as pickle
 import sys
 
 from cliner import helper
+from cliner import globals_cliner
 from cliner.model import Model
 from cliner.notes.note import Note
+from cliner.features_dir.features import feature_signature
+from cliner.features_dir.feature_store import FeatureStore
 from read_config import enabled_modules
 
 __author__ = 'Willie Boag'
@@ -82,6 +85,32 @@ def main():
                         help="A flag indicating wheter to disambiguate CUI id for detected entities in semeval format",
                         )
 
+    parser.add_argument("-stream",
+                        dest="stream",
+                        action="store_true",
+                        help="A flag indicating whether to read notes and extract features in chunks (for corpora larger than memory). "
+                             "Note: the CRF still holds every training sequence in memory (pycrfsuite's trainer keeps all appended sequences)",
+                        )
+
+    parser.add_argument("-shard_dir",
+                        dest="shard_dir",
+                        default=None,
+                        help="Directory for intermediate feature shards when streaming (default: system temp dir)",
+                        )
+
+    parser.add_argument("-feature_store",
+                        dest="feature_store",
+                        default=None,
+                        help="Directory to store extracted features in, so later runs with the same features can skip extraction for unchanged notes",
+                        )
+
+    parser.add_argument("-processes",
+                        dest="processes",
+                        type=int,
+                        default=globals_cliner.processes,
+                        help="Number of processes to extract features with",
+                        )
+
     """
     parser.add_argument("-unlabeled",
         dest = "unlabeled",
@@ -93,6 +122,7 @@ def main():
     args = parser.parse_args()
     is_crf = not args.nocrf
     third = args.third
+    globals_cliner.processes = max(1, args.processes)
 
     # Error check: Ensure that file paths are specified
     if not args.txt:
@@ -132,6 +162,9 @@ def main():
     if third is True and args.format == "i2b2":
         exit("i2b2 formatting does not support disjoint spans")
 
+    if third is True and args.stream is True:
+        exit("streaming does not support disjoint spans")
+
     # Must specify output format
     if format not in Note.supportedFormats():
         print('\n\tError: Must specify output format', file=sys.stderr)
@@ -153,10 +186,30 @@ def main():
 
     # Train the model
     train(training_list, args.model, format, is_crf=is_crf,
-          grid=args.grid, third=third, disambiguate=args.umls_disambiguation)
+          grid=args.grid, third=third, disambiguate=args.umls_disambiguation,
+          stream=args.stream, shard_dir=args.shard_dir,
+          feature_store=args.feature_store)
+
+
+def read_notes(training_list, format):
+    """
+    read_notes()
+
+    Purpose: Lazily read (txt,con) file pairs into Note objects.
+
+    @param training_list  list of (txt,con) file path tuples
+    @param format         concept file data format (ex. i2b2, semeval)
+    @return               generator of Note objects
+    """
+
+    for txt, con in training_list:
 
+        note_tmp = Note(format)   # Create Note
+        note_tmp.read(txt, con)   # Read data into Note
+        yield note_tmp
 
-def train(training_list, model_path, format, is_crf=True, grid=False, third=False, disambiguate=False):
+
+def train(training_list, model_path, format, is_crf=True, grid=False, third=False, disambiguate=False, stream=False, shard_dir=None, feature_store=None):
     """
     train()
 
@@ -168,30 +221,38 @@ def train(training_list, model_path, format, is_crf=True, grid=False, third=Fals
     @param is_crf         whether first pass should use CRF classifier
     @param grid           whether second pass should perform grid search
     @param third          whether to perform third/clustering pass
+    @param stream         whether to read notes and extract features lazily
+    @param shard_dir      where to spill feature shards when streaming
+    @param feature_store  directory of previously extracted features (or None)
     """
 
-    # Read the data into a Note object
-    notes = []
-    for txt, con in training_list:
-
-        note_tmp = Note(format)   # Create Note
-        note_tmp.read(txt, con)   # Read data into Note
-        notes.append(note_tmp)    # Add the Note to the list
-
     # file names
-    if not notes:
+    if not training_list:
         print('Error: Cannot train on 0 files. Terminating train.')
         return 1
 
+    # Read the data into Note objects (only as needed, when streaming)
+    notes = read_notes(training_list, format)
+    if not stream:
+        notes = list(notes)
+
     # Create a Machine Learning model
     model = Model(is_crf=is_crf)
 
+    # Reuse features extracted by previous runs
+    if feature_store:
+        feature_store = FeatureStore(feature_store, feature_signature())
+
     # disambiguation
     if format == "semeval" and disambiguate is True and enabled.get('UMLS', False):
         model.set_cui_freq(cui_disambiguation.calcFreqOfCuis(training_list))
 
     # Train the model using the Note's data
-    model.train(notes, grid, do_third=third)
+    if stream:
+        model.train_streaming(notes, grid, shard_dir=shard_dir,
+                              feature_store=feature_store)
+    else:
+        model.train(notes, grid, do_third=third, feature_store=feature_store)
 
     # Pickle dump
     print('\nserializing model to %s\n' % model_path)
@@ -0,0 +1,82 @@
+"""
+Checks for converting annotations between data formats.
+
+    python -m unittest tests.test_format
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('CLINER_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliner.format import convert
+from cliner.notes.note import Note
+from cliner.notes.utilities_for_notes import remove_non_ascii
+
+
+# Non-ascii characters (stripped by the semeval reader) before the concepts
+TEXT = (u'Café au lait spots were noted – naïve patient.\n'
+        u'He reports chest pain and shortness of breath.\n')
+
+CONCEPTS = ['chest pain', 'shortness of breath']
+
+
+class TestConvert(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+        self.txt = os.path.join(self.dirname, 'note.txt')
+        with open(self.txt, 'w') as f:
+            f.write(TEXT)
+
+        # semeval offsets count the text without its non-ascii characters
+        text = remove_non_ascii(TEXT)
+        self.spans = []
+        for concept in CONCEPTS:
+            start = text.index(concept)
+            self.spans.append( (start, start + len(concept)) )
+
+        self.pipe = os.path.join(self.dirname, 'note.pipe')
+        with open(self.pipe, 'w') as f:
+            for start,end in self.spans:
+                f.write('note.txt|%d-%d|CUI-less\n' % (start, end))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def labelled(self, note):
+        """ the concept tokens of each line (as the IOB labels mark them) """
+        return [ ' '.join(tok for tok,label in zip(sent,iobs) if label != 'O')
+                 for sent,iobs in zip(note.getTokenizedSentences(), note.getIOBLabels()) ]
+
+    def test_semeval_round_trip(self):
+        out = convert(self.txt, self.pipe, 'semeval', 'semeval')
+
+        spans = []
+        for line in out.strip().split('\n'):
+            start,end = line.split('|')[1].split('-')
+            spans.append( (int(start), int(end)) )
+        self.assertEqual(spans, self.spans)
+
+    def test_semeval_read_standard(self):
+        note = Note('semeval')
+        note.read(self.txt, self.pipe)
+
+        standard = os.path.join(self.dirname, 'note.standard')
+        with open(standard, 'w') as f:
+            f.write(note.write_standard())
+
+        # offsets and tokens must agree with the ones read() found
+        converted = Note('semeval')
+        converted.read_standard(self.txt, standard)
+        self.assertEqual(converted.derived_note.getText(), note.derived_note.getText())
+        self.assertEqual(list(converted.getTokenizedSentences()),
+                         list(note.getTokenizedSentences()))
+        self.assertEqual(self.labelled(converted), ['', 'chest pain shortness of breath'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Checks for the py4j gateway manager, run against a stub server (a python
+process that only opens the port) instead of the JVM.
+
+    python -m unittest tests.test_gateway
+"""
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import unittest
+
+os.environ.setdefault('CLINER_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PY4J_DIR_PATH', '')
+
+gateway_dir = os.path.join(os.environ['CLINER_DIR'], 'cliner', 'lib', 'java', 'entry_point')
+if gateway_dir not in sys.path: sys.path.append(gateway_dir)
+
+import gateway
+from gateway import GateWayServer, _FileLock, retry
+
+
+# Accepts (and ignores) connections on the port given as its last argument
+STUB_SERVER = '''
+import sys, socket
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("127.0.0.1", int(sys.argv[-1])))
+server.listen(5)
+while True:
+    server.accept()[0].close()
+'''
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+        self.sleep = gateway.time.sleep
+        gateway.time.sleep = self.delays.append
+
+    def tearDown(self):
+        gateway.time.sleep = self.sleep
+
+    def test_backoff(self):
+        attempts = []
+        def func():
+            attempts.append(1)
+            if len(attempts) == 2:
+                raise Exception('not ready')
+            return 'up' if len(attempts) == 5 else None
+
+        self.assertEqual(retry(func, first_delay=10, max_delay=40), 'up')
+        self.assertEqual(self.delays, [0.01, 0.02, 0.04, 0.04])
+
+    def test_timeout(self):
+        with self.assertRaises(SystemExit):
+            retry(lambda: None, timeout=0, message='gave up')
+
+
+class TestFileLock(unittest.TestCase):
+
+    def test_exclusive(self):
+        path = os.path.join(tempfile.mkdtemp(), 'test.lock')
+        events = []
+
+        def other():
+            with _FileLock(path):
+                events.append('other')
+
+        with _FileLock(path):
+            thread = threading.Thread(target=other)
+            thread.start()
+            time.sleep(0.2)
+            events.append('first')
+        thread.join()
+
+        self.assertEqual(events, ['first', 'other'])
+
+
+class TestGateWayServer(unittest.TestCase):
+
+    def setUp(self):
+        self.command = GateWayServer.command
+        GateWayServer.command = [sys.executable, '-c', STUB_SERVER]
+        self.port = free_port()
+
+    def tearDown(self):
+        GateWayServer.stop(self.port)
+        GateWayServer.restart_hooks.pop(self.port, None)
+        GateWayServer.command = self.command
+
+    def test_launch(self):
+        self.assertFalse(GateWayServer.healthy(self.port))
+
+        GateWayServer.launch_gateway(self.port, timeout=10)
+        server = GateWayServer.servers[self.port]
+        self.assertTrue(GateWayServer.healthy(self.port))
+
+        # A running gateway is shared, not launched again
+        GateWayServer.launch_gateway(self.port, timeout=10)
+        self.assertIs(GateWayServer.servers[self.port], server)
+
+        GateWayServer.stop(self.port)
+        self.assertFalse(GateWayServer.healthy(self.port))
+
+    def test_failed_launch(self):
+        GateWayServer.command = [sys.executable, '-c', 'import sys; sys.exit(1)']
+        with self.assertRaises(SystemExit):
+            GateWayServer.launch_gateway(self.port, timeout=10)
+        self.assertNotIn(self.port, GateWayServer.servers)
+
+    def test_restart(self):
+        calls = []
+
+        class Client(object):
+            def reconnect(self):
+                calls.append(self)
+
+        client = Client()
+        removed = Client()
+
+        # Registering twice under one key keeps a single hook
+        GateWayServer.add_restart_hook(self.port, client.reconnect, key='client')
+        GateWayServer.add_restart_hook(self.port, client.reconnect, key='client')
+        GateWayServer.add_restart_hook(self.port, removed.reconnect, key='removed')
+        GateWayServer.remove_restart_hook(self.port, 'removed')
+
+        # Hooks of instances that were garbage collected are dropped
+        dead = Client()
+        GateWayServer.add_restart_hook(self.port, dead.reconnect, key='dead')
+        del dead
+
+        GateWayServer.launch_gateway(self.port, timeout=10)
+        pid = GateWayServer.servers[self.port].pid
+
+        GateWayServer.restart(self.port, timeout=10)
+
+        self.assertTrue(GateWayServer.healthy(self.port))
+        self.assertNotEqual(GateWayServer.servers[self.port].pid, pid)
+        self.assertEqual(calls, [client])
+        self.assertEqual(list(GateWayServer.restart_hooks[self.port]), ['client'])
+
+
+if __name__ == '__main__':
+    unittest.main()
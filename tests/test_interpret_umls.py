@@ -0,0 +1,121 @@
+"""
+Checks for the batched MetaMap concept id lookups, run against a stub
+MetaMap (no java gateway) and an in-memory cache.
+
+    python -m unittest tests.test_interpret_umls
+"""
+
+import os
+import sys
+import unittest
+
+os.environ.setdefault('CLINER_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliner.features_dir.umls_dir import interpret_umls
+from cliner.features_dir.umls_dir import interface_umls
+
+
+class StubMetaMap(object):
+    """ same interface as cuiLookup.MetaMap, one made up cui per phrase """
+
+    def __init__(self):
+        self.batches = []
+
+    def getConceptIdsBatch(self, phrases, batch_size=100):
+        self.batches.append(list(phrases))
+        return [{"norms":set(), "text":phrase,
+                 "mappings":{phrase:set([cui(phrase)])}} for phrase in phrases]
+
+
+class DictCache(object):
+    """ same interface as UmlsCache, without the file on disk """
+
+    def __init__(self):
+        self.cache = {}
+
+    def has_key(self, key):
+        return key in self.cache
+
+    def add_map(self, key, value):
+        self.cache[key] = value
+
+    def get_map(self, key):
+        return self.cache[key]
+
+
+def cui(phrase):
+    return 'C' + phrase.replace(' ', '_')
+
+
+class TestObtainConceptIds(unittest.TestCase):
+
+    def setUp(self):
+        self.metamap = interpret_umls.metamap
+        self.interface = (interface_umls.abbreviation_index,
+                          interface_umls.cui_lookup,
+                          interface_umls.cuis_with_tuis)
+
+        interpret_umls.metamap = StubMetaMap()
+
+        # every made up cui is a disorder, and nothing is an abbreviation
+        interface_umls.abbreviation_index = lambda: {}
+        interface_umls.cui_lookup = lambda string: []
+        interface_umls.cuis_with_tuis = lambda tuis: set(cui(p) for p in self.phrases)
+
+        self.phrases = ['chest pain', 'fever', 'cough']
+        self.cui_freq = dict((cui(p), 1) for p in self.phrases)
+        self.cache = DictCache()
+
+    def tearDown(self):
+        interpret_umls.metamap = self.metamap
+        (interface_umls.abbreviation_index,
+         interface_umls.cui_lookup,
+         interface_umls.cuis_with_tuis) = self.interface
+
+    def lookup(self, phrases):
+        return interpret_umls.obtain_concept_ids_batch(self.cache, phrases,
+                                                       cui_freq=self.cui_freq)
+
+    def test_batch(self):
+        phrases = ['chest pain', 'fever', 'chest pain', '!!', 'fever']
+
+        self.assertEqual(self.lookup(phrases),
+                         [cui('chest pain'), cui('fever'), cui('chest pain'),
+                          ['CUI-less'], cui('fever')])
+
+        # duplicates (and phrases metamap cannot handle) are never sent
+        self.assertEqual(interpret_umls.metamap.batches, [['chest pain', 'fever']])
+
+        # metamap results are cached under their own key
+        self.assertEqual(self.cache.get_map('fever--metamap')['text'], 'fever')
+        self.assertFalse(self.cache.has_key('fever'))
+
+    def test_cache_hits(self):
+        self.lookup(['chest pain', 'fever'])
+        self.assertEqual(self.lookup(['fever', 'cough', 'chest pain']),
+                         [cui('fever'), cui('cough'), cui('chest pain')])
+
+        # only the new phrase was looked up the second time
+        self.assertEqual(interpret_umls.metamap.batches,
+                         [['chest pain', 'fever'], ['cough']])
+
+        # and nothing at all once everything is cached
+        self.assertEqual(self.lookup(['cough', 'fever']), [cui('cough'), cui('fever')])
+        self.assertEqual(len(interpret_umls.metamap.batches), 2)
+
+    def test_concurrent(self):
+        phrases = ['fever', 'chest pain', 'cough', 'fever', '!!']
+        cuis = interpret_umls.obtain_concept_ids_concurrent(
+            self.cache, phrases, cui_freq=self.cui_freq,
+            max_workers=4, batch_size=1)
+
+        self.assertEqual(cuis, [cui('fever'), cui('chest pain'), cui('cough'),
+                                cui('fever'), ['CUI-less']])
+
+        # metamap is called once (never from the worker threads)
+        self.assertEqual(interpret_umls.metamap.batches,
+                         [['fever', 'chest pain', 'cough']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Checks for the note tokenizers.
+
+    python -m unittest tests.test_utilities_for_notes
+"""
+
+import os
+import unittest
+
+os.environ.setdefault('CLINER_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliner.notes.utilities_for_notes import wtokenizer, align_token
+
+
+class TestSpanTokenize(unittest.TestCase):
+
+    def test_quotes(self):
+        sent = 'He called it "chest pain" (left-sided), not "fatigue".'
+        spans = wtokenizer.span_tokenize(sent, "semeval")
+
+        # same tokens as tokenize()
+        self.assertEqual([tok for tok,start,end in spans],
+                         wtokenizer.tokenize(sent, "semeval"))
+
+        # nltk's `` and '' cover just the one " character
+        quotes = [ (start,end) for tok,start,end in spans if tok in ('``', "''") ]
+        self.assertEqual(quotes, [ (i,i+1) for i,c in enumerate(sent) if c == '"' ])
+
+        # every other token is a verbatim slice, and none overlap
+        for tok,start,end in spans:
+            if tok not in ('``', "''"):
+                self.assertEqual(sent[start:end], tok)
+        ends = [end for tok,start,end in spans]
+        starts = [start for tok,start,end in spans]
+        self.assertTrue(all(e <= s for e,s in zip(ends, starts[1:])))
+
+    def test_missing_token(self):
+        # a token that is not in the sentence takes up no characters
+        self.assertEqual(align_token('chest pain', 'fever', 5), (5, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()